@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+compare_structure_definition_elements.py の性能計測スクリプト
+
+同梱のjpclinsスナップショットを使って処理時間とピークメモリを計測する。
+--script で別リビジョンのスクリプトを指定すると、同じ条件で変更前後を比較できる。
+--json の結果を保存しておけば、--baseline で別のコミットの結果と比較できる。
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+DEFAULT_SCRIPT = Path(__file__).resolve().parent / "compare_structure_definition_elements.py"
+DEFAULT_PAIR = ("jp-eCSCLINS.r4-1.9.0-snap", "jp-eCSCLINS.r4-1.10.0-snap")
+DEFAULT_SNAPSHOTS = (
+    "jp-eCSCLINS.r4-1.7.1-snap",
+    "jp-eCSCLINS.r4-1.8.0-snap",
+    "jp-eCSCLINS.r4-1.9.0-snap",
+    "jp-eCSCLINS.r4-1.10.0-snap",
+)
+
+
+def load_comparator_module(script_path):
+    """指定パスのスクリプトをモジュールとして読み込む"""
+    spec = importlib.util.spec_from_file_location("comparator_under_test", script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+REPEAT = 1
+
+
+def measure(func, *args, **kwargs):
+    """関数の実行時間(秒)とtracemallocによるピーク割り当て量(バイト)を計測
+
+    tracemallocは実行時間を大きく歪めるため、時間計測とメモリ計測は別々の実行で行う。
+    時間はREPEAT回実行したうちの最短を採る。
+    """
+    elapsed = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        elapsed = seconds if elapsed is None else min(elapsed, seconds)
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_report(module, v1_path, v2_path):
+    """差分計算後のHTMLレポート生成（generate_html_report）を計測"""
+    comparator = module.StructureDefinitionElementComparator(v1_path, v2_path)
+    comparator.compare_files()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "report.html"
+        _, elapsed, peak = measure(comparator.generate_html_report, str(output_file))
+        report_bytes = output_file.stat().st_size
+    return {
+        'name': f"generate_html_report {v1_path} -> {v2_path}",
+        'seconds': round(elapsed, 6),
+        'peak_alloc_mb': round(peak / (1024 * 1024), 3),
+        'report_bytes': report_bytes,
+    }
+
+
+def perturb_concepts(concepts, rename_first=0):
+    """リリース間の変更を模して、コードの表示名変更・削除・追加を一定間隔で加える
+
+    入れ子のconceptも含めて深さ優先の1始まりの通し番号で判定する（0始まりだと先頭のconceptが
+    削除され、ルートが1つのCodeSystemでは全体が1つの削除になるため）。rename_firstを指定すると、
+    先頭からその件数の表示名をまとめて変更する（連続した置換ブロック）。
+    """
+    counter = [1]
+
+    def walk(items):
+        changed = []
+        for concept in items:
+            i = counter[0]
+            counter[0] += 1
+            concept = dict(concept)
+            if 'concept' in concept:
+                concept['concept'] = walk(concept['concept'])
+            if rename_first:
+                if i <= rename_first:
+                    concept['display'] = f"{concept.get('display', '')} (改)"
+                changed.append(concept)
+                continue
+            if i % 53 == 0:
+                continue
+            if i % 97 == 0:
+                concept['display'] = f"{concept.get('display', '')} (改)"
+            changed.append(concept)
+            if i % 71 == 0:
+                changed.append({'code': f"bench-{i}", 'display': "ベンチマーク用追加コード"})
+        return changed
+
+    changed = walk(concepts)
+    if not rename_first:
+        check_scattered_edits(concepts, changed)
+    return changed
+
+
+def flatten_concepts(concepts):
+    """入れ子のconceptを含めて コード -> 表示名 を返す"""
+    displays = {}
+    for concept in concepts:
+        displays[concept.get('code')] = concept.get('display')
+        displays.update(flatten_concepts(concept.get('concept') or []))
+    return displays
+
+
+def check_scattered_edits(concepts, changed, minimum=2):
+    """変更後のconceptに、表示名変更・削除・追加がそれぞれminimum件以上含まれることを確かめる"""
+    before = flatten_concepts(concepts)
+    after = flatten_concepts(changed)
+    counts = {
+        'modified': sum(1 for code in before.keys() & after.keys() if before[code] != after[code]),
+        'removed': len(before.keys() - after.keys()),
+        'added': len(after.keys() - before.keys()),
+    }
+    assert all(count >= minimum for count in counts.values()), f"変更が散らばっていません: {counts}"
+
+
+def largest_codesystems(module, v1_path, v2_path, count):
+    """新バージョンで大きい順にcount件のCodeSystemについて (ファイル名, 旧文書またはNone, 新文書) を返す"""
+    v1_source = module.open_package_source(v1_path)
+    v2_source = module.open_package_source(v2_path)
+    v1_files = set(v1_source.list_files('CodeSystem-*.json'))
+    largest = sorted(v2_source.list_files('CodeSystem-*.json'), key=v2_source.size, reverse=True)[:count]
+    documents = []
+    for filename in largest:
+        with v2_source.open(filename) as f:
+            new_doc = json.load(f)
+        old_doc = None
+        if filename in v1_files:
+            with v1_source.open(filename) as f:
+                old_doc = json.load(f)
+        documents.append((filename, old_doc, new_doc))
+    v1_source.close()
+    v2_source.close()
+    return documents
+
+
+def html_diff_cases(module, v1_path, v2_path, count):
+    """html_diffの計測対象: 実際に変更のあるCodeSystemと、大きなCodeSystemのconceptに変更を加えたもの"""
+    cases = []
+    for filename, old_doc, new_doc in largest_codesystems(module, v1_path, v2_path, count):
+        if old_doc is not None and old_doc != new_doc:
+            cases.append((f"{filename} (document)", old_doc, new_doc))
+        concepts = new_doc.get('concept') or []
+        if concepts:
+            cases.append((f"{filename} concept (scattered edits)", concepts, perturb_concepts(concepts)))
+            cases.append((f"{filename} concept (500 renamed)", concepts, perturb_concepts(concepts, rename_first=500)))
+    return cases
+
+
+def json_diff_cases(module, v1_path, v2_path, count):
+    """json_diff_flat/json_diff_structuralの計測対象: 大きなCodeSystemの文書全体の組"""
+    cases = []
+    for filename, old_doc, new_doc in largest_codesystems(module, v1_path, v2_path, count):
+        if old_doc is not None:
+            cases.append((f"{filename} (document)", old_doc, new_doc))
+        concepts = new_doc.get('concept') or []
+        if concepts:
+            cases.append((f"{filename} (scattered edits)", new_doc, dict(new_doc, concept=perturb_concepts(concepts))))
+    return cases
+
+
+def bench_json_diff(module, v1_path, v2_path, count=3):
+    """大きなCodeSystemに対するjson_diff_flatとjson_diff_structuralを計測"""
+    comparator = module.StructureDefinitionElementComparator(v1_path, v2_path)
+    methods = [name for name in ('json_diff_flat', 'json_diff_structural') if hasattr(comparator, name)]
+    results = []
+    for name, old, new in json_diff_cases(module, v1_path, v2_path, count):
+        for method in methods:
+            diffs, elapsed, peak = measure(getattr(comparator, method), old, new)
+            results.append({
+                'name': f"{method} {name}",
+                'seconds': round(elapsed, 6),
+                'peak_alloc_mb': round(peak / (1024 * 1024), 3),
+                'rows': len(diffs),
+            })
+    comparator.close()
+    return results
+
+
+def bench_stream(module, v1_path, v2_path, count=3):
+    """大きなCodeSystemのパースと差分計算を、文書全体の読み込みとストリーミングとで計測"""
+    if not hasattr(module, 'StreamedArray'):
+        return []
+    results = []
+    for name, old, new in json_diff_cases(module, v1_path, v2_path, count):
+        filename = 'CodeSystem-bench.json'
+        sources = {
+            'v1': module.MemoryPackageSource({filename: json.dumps(old, ensure_ascii=False).encode('utf-8')}),
+            'v2': module.MemoryPackageSource({filename: json.dumps(new, ensure_ascii=False).encode('utf-8')}),
+        }
+        for mode, threshold in (('document', 0), ('stream', 1)):
+            def compute():
+                comparator = module.StructureDefinitionElementComparator(
+                    v1_path, v2_path, sources=sources, stream_threshold=threshold)
+                return comparator.compute_file_diff(filename)[0]
+            diffs, elapsed, peak = measure(compute)
+            results.append({
+                'name': f"compute_file_diff[{mode}] {name}",
+                'seconds': round(elapsed, 6),
+                'peak_alloc_mb': round(peak / (1024 * 1024), 3),
+                'rows': len(diffs),
+            })
+    return results
+
+
+def bench_html_diff(module, v1_path, v2_path, count=3, ndiff_max_lines=30000):
+    """大きな値に対するhtml_diffを差分エンジンごとに計測"""
+    engines = sorted(getattr(module, 'LINE_DIFF_ENGINES', {'ndiff': None}))
+    results = []
+    for name, old, new in html_diff_cases(module, v1_path, v2_path, count):
+        lines = sum(len(json.dumps(v, indent=2, ensure_ascii=False).splitlines()) for v in (old, new))
+        for engine in engines:
+            if engine == 'ndiff' and lines > ndiff_max_lines:
+                results.append({'name': f"html_diff[{engine}] {name}", 'lines': lines, 'skipped': True})
+                continue
+            comparator = module.StructureDefinitionElementComparator(v1_path, v2_path)
+            comparator.diff_engine = engine
+            comparator.diff_max_lines = 0
+            html, elapsed, peak = measure(comparator.html_diff, old, new)
+            results.append({
+                'name': f"html_diff[{engine}] {name}",
+                'lines': lines,
+                'seconds': round(elapsed, 6),
+                'peak_alloc_mb': round(peak / (1024 * 1024), 3),
+                'html_bytes': len(html.encode('utf-8')),
+            })
+    return results
+
+
+def parse_all_documents(module, path):
+    """1バージョンの全JSONファイルを新しい比較器で読み込み、StructureDefinitionは要素の抽出まで行う"""
+    comparator = module.StructureDefinitionElementComparator(path, path)
+    source = comparator.sources['v1']
+    filenames = source.list_files('*.json')
+    for filename in source.order(filenames):
+        if filename.startswith('StructureDefinition-'):
+            comparator.parse_structure_definition_elements('v1', filename)
+        else:
+            comparator.get_document('v1', filename)
+    comparator.close()
+    return len(filenames)
+
+
+def bench_parse(module, path):
+    """1バージョン分のパースを計測
+
+    cold は最初の1回（OSのページキャッシュに載っていない可能性がある状態）、
+    warm はファイル内容がページキャッシュに載った後の計測。どちらもプロセス内のキャッシュは使わない。
+    """
+    label = module.version_label(path)
+    start = time.perf_counter()
+    files = parse_all_documents(module, path)
+    cold = time.perf_counter() - start
+    _, warm, peak = measure(parse_all_documents, module, path)
+    return [
+        {'name': f"parse cold {label}", 'seconds': round(cold, 6), 'files': files},
+        {'name': f"parse warm {label}", 'seconds': round(warm, 6),
+         'peak_alloc_mb': round(peak / (1024 * 1024), 3), 'files': files},
+    ]
+
+
+def bench_analyze(module, v1_path, v2_path):
+    """両バージョンに存在するプロファイルごとにanalyze_element_differencesを計測"""
+    comparator = module.StructureDefinitionElementComparator(v1_path, v2_path)
+    comparator.compare_files()
+    results = []
+    for filename in sorted(set(comparator.v1_elements) & set(comparator.v2_elements)):
+        diffs, elapsed, peak = measure(comparator.analyze_element_differences, filename)
+        results.append({
+            'name': f"analyze {filename}",
+            'seconds': round(elapsed, 6),
+            'peak_alloc_mb': round(peak / (1024 * 1024), 3),
+            'rows': len(diffs),
+            'changed': sum(1 for diff in diffs if diff['type'] != 'unchanged'),
+        })
+    comparator.close()
+    return results
+
+
+def run_end_to_end(module, v1_path, v2_path, output_file):
+    """比較器の生成からcompare_files、generate_html_reportまでを1回実行"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        comparator = module.StructureDefinitionElementComparator(v1_path, v2_path)
+        comparator.compare_files()
+        comparator.generate_html_report(str(output_file))
+        comparator.close()
+
+
+def bench_end_to_end(module, snapshots):
+    """隣接するスナップショットの組ごとに、差分キャッシュなしでレポート生成までを計測"""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "report.html"
+        for v1_path, v2_path in zip(snapshots, snapshots[1:]):
+            _, elapsed, peak = measure(run_end_to_end, module, v1_path, v2_path, output_file)
+            results.append({
+                'name': f"end_to_end {module.version_label(v1_path)} -> {module.version_label(v2_path)}",
+                'seconds': round(elapsed, 6),
+                'peak_alloc_mb': round(peak / (1024 * 1024), 3),
+                'report_bytes': output_file.stat().st_size,
+            })
+    return results
+
+
+def load_adjacent_pairs(module, snapshots):
+    """隣接するスナップショットの組ごとにcompare_filesまで行い、比較器を全て保持したまま返す"""
+    comparators = []
+    for v1_path, v2_path in zip(snapshots, snapshots[1:]):
+        comparator = module.StructureDefinitionElementComparator(v1_path, v2_path)
+        comparator.compare_files()
+        comparators.append(comparator)
+    return comparators
+
+
+def bench_memory(module, snapshots):
+    """全スナップショットを同時に読み込んだ状態で保持されるメモリ量を計測"""
+    start = time.perf_counter()
+    for comparator in load_adjacent_pairs(module, snapshots):
+        comparator.close()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        comparators = load_adjacent_pairs(module, snapshots)
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    for comparator in comparators:
+        comparator.close()
+    return [{
+        'name': f"compare_files {' / '.join(module.version_label(p) for p in snapshots)} (all pairs held)",
+        'seconds': round(elapsed, 6),
+        'peak_alloc_mb': round(peak / (1024 * 1024), 3),
+        'retained_mb': round(retained / (1024 * 1024), 3),
+    }]
+
+
+BENCHMARKS = {
+    'parse': lambda module, args: bench_parse(module, args.v2),
+    'analyze': lambda module, args: bench_analyze(module, args.v1, args.v2),
+    'json_diff': lambda module, args: bench_json_diff(module, args.v1, args.v2),
+    'stream': lambda module, args: bench_stream(module, args.v1, args.v2),
+    'report': lambda module, args: [bench_report(module, args.v1, args.v2)],
+    'end_to_end': lambda module, args: bench_end_to_end(module, args.snapshots),
+    'memory': lambda module, args: bench_memory(module, args.snapshots),
+    'html_diff': lambda module, args: bench_html_diff(module, args.v1, args.v2, ndiff_max_lines=args.ndiff_max_lines),
+}
+
+
+def script_revision(script_path):
+    """計測対象スクリプトのあるリポジトリのコミット（取得できなければNone）"""
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(script_path).resolve().parent,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.strip() or None
+
+
+def format_result(r, baseline=None):
+    if r.get('skipped'):
+        return f"{r['name']}: skipped ({r['lines']} lines)"
+    fields = [f"{r['seconds']:.4f}s"]
+    if 'peak_alloc_mb' in r:
+        fields.append(f"peak alloc {r['peak_alloc_mb']:.1f}MB")
+    if 'retained_mb' in r:
+        fields.append(f"retained {r['retained_mb']:.1f}MB")
+    fields += [f"{key} {r[key]}" for key in ('files', 'rows', 'changed', 'lines', 'report_bytes', 'html_bytes') if key in r]
+    line = f"{r['name']}: {', '.join(fields)}"
+    previous = (baseline or {}).get(r['name'])
+    if previous and not previous.get('skipped') and previous.get('seconds'):
+        line += f" (baseline {previous['seconds']:.4f}s, x{r['seconds'] / previous['seconds']:.2f})"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="jpclins差分ツールの性能計測")
+    parser.add_argument('--script', default=str(DEFAULT_SCRIPT), help="計測対象のスクリプト（変更前後の比較用）")
+    parser.add_argument('--v1', default=DEFAULT_PAIR[0], help="旧バージョンフォルダまたは.tgz")
+    parser.add_argument('--v2', default=DEFAULT_PAIR[1], help="新バージョンフォルダまたは.tgz")
+    parser.add_argument('--snapshots', nargs='+', default=list(DEFAULT_SNAPSHOTS),
+                        help="memory・end_to_end計測で使うバージョン（古い順）")
+    parser.add_argument('--bench', action='append', choices=sorted(BENCHMARKS),
+                        help="実行する計測（複数指定可、デフォルトは全て）")
+    parser.add_argument('--ndiff-max-lines', type=int, default=30000,
+                        help="ndiffエンジンを計測する値の最大行数（これを超えるとスキップ）")
+    parser.add_argument('--repeat', type=int, default=1, help="時間計測の繰り返し回数（最短時間を採る）")
+    parser.add_argument('--json', action='store_true', help="結果をJSONで出力する")
+    parser.add_argument('--baseline', help="以前の --json の出力ファイル。同名の計測と時間を比較して表示する")
+    args = parser.parse_args()
+
+    global REPEAT
+    REPEAT = max(1, args.repeat)
+    module = load_comparator_module(args.script)
+    results = []
+    for name in args.bench or sorted(BENCHMARKS):
+        results.extend(BENCHMARKS[name](module, args))
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    if args.json:
+        json.dump({
+            'environment': {
+                'script': str(args.script),
+                'revision': script_revision(args.script),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'repeat': REPEAT,
+            },
+            'results': results,
+            'max_rss_mb': round(max_rss_mb, 1),
+        }, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {r['name']: r for r in json.load(f)['results']}
+    for r in results:
+        print(format_result(r, baseline))
+    print(f"max RSS: {max_rss_mb:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,286 +10,47 @@ import json
 import hashlib
 from datetime import datetime
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, deque
 import difflib
+import bisect
 import inspect
 import textwrap
 import sys
+import tarfile
+import fnmatch
+import argparse
+import sqlite3
+import time
+import zlib
+import io
+import marshal
+import struct
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from contextlib import contextmanager
+import cProfile
+import pstats
+import tracemalloc
+import re
+import threading
+import shutil
+import tempfile
 
-class StructureDefinitionElementComparator:
-    def __init__(self, v1_path, v2_path):
-        self.v1_path = Path(v1_path)
-        self.v2_path = Path(v2_path)
-        self.v1_elements = {}
-        self.v2_elements = {}
-        self.all_attributes = set()
-        
-    def parse_structure_definition_elements(self, file_path):
-        """StructureDefinitionファイルからelement配列を抽出"""
-        if not file_path.exists():
-            return {}
-        
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            elements = {}
-            
-            # snapshot.elementsを優先、なければdifferential.elementsを使用
-            element_list = data.get('snapshot', {}).get('element', [])
-            if not element_list:
-                element_list = data.get('differential', {}).get('element', [])
-            
-            for element in element_list:
-                path = element.get('path', '')
-                if path:
-                    elements[path] = element
-                    # 全属性を収集
-                    self.all_attributes.update(element.keys())
-            
-            return elements
-        except Exception as e:
-            print(f"Error parsing {file_path}: {e}")
-            return {}
-    
-    def compare_files(self):
-        """両バージョンのStructureDefinitionファイルを比較"""
-        # 1.9.0のStructureDefinitionファイル一覧を取得
-        v1_package = self.v1_path / "package"
-        if v1_package.exists():
-            for file_path in v1_package.glob("StructureDefinition-*.json"):
-                self.v1_elements[file_path.name] = self.parse_structure_definition_elements(file_path)
-        
-        # 1.10.0のStructureDefinitionファイル一覧を取得
-        v2_package = self.v2_path / "package"
-        if v2_package.exists():
-            for file_path in v2_package.glob("StructureDefinition-*.json"):
-                self.v2_elements[file_path.name] = self.parse_structure_definition_elements(file_path)
-    
-    def analyze_element_differences(self, filename):
-        """特定のファイルのelement差分を分析"""
-        v1_elements = self.v1_elements.get(filename, {})
-        v2_elements = self.v2_elements.get(filename, {})
-        
-        all_paths = set(v1_elements.keys()) | set(v2_elements.keys())
-        differences = []
-        
-        for path in sorted(all_paths):
-            v1_element = v1_elements.get(path)
-            v2_element = v2_elements.get(path)
-            
-            if not v1_element and v2_element:
-                # 新規追加
-                differences.append({
-                    'path': path,
-                    'type': 'added',
-                    'v1_element': None,
-                    'v2_element': v2_element
-                })
-            elif v1_element and not v2_element:
-                # 削除
-                differences.append({
-                    'path': path,
-                    'type': 'removed',
-                    'v1_element': v1_element,
-                    'v2_element': None
-                })
-            elif v1_element and v2_element:
-                # 変更の可能性
-                changed_attributes = []
-                for attr in self.all_attributes:
-                    v1_value = v1_element.get(attr)
-                    v2_value = v2_element.get(attr)
-                    if v1_value != v2_value:
-                        changed_attributes.append({
-                            'attribute': attr,
-                            'v1_value': v1_value,
-                            'v2_value': v2_value
-                        })
-                
-                if changed_attributes:
-                    differences.append({
-                        'path': path,
-                        'type': 'modified',
-                        'v1_element': v1_element,
-                        'v2_element': v2_element,
-                        'changed_attributes': changed_attributes
-                    })
-                else:
-                    # 変更なし
-                    differences.append({
-                        'path': path,
-                        'type': 'unchanged',
-                        'v1_element': v1_element,
-                        'v2_element': v2_element
-                    })
-        
-        return differences
-    
-    def format_value(self, value):
-        """値をHTML表示用にフォーマット"""
-        if value is None:
-            return '<span class="no-value">-</span>'
-        elif isinstance(value, (dict, list)):
-            return f'<pre class="complex-value">{json.dumps(value, indent=2, ensure_ascii=False)}</pre>'
-        else:
-            return str(value)
-    
-    def html_diff(self, old, new):
-        # old/newがdictやlistなら整形
-        if isinstance(old, (dict, list)):
-            old = json.dumps(old, indent=2, ensure_ascii=False)
-        if isinstance(new, (dict, list)):
-            new = json.dumps(new, indent=2, ensure_ascii=False)
-        old_lines = str(old).splitlines()
-        new_lines = str(new).splitlines()
-        diff = difflib.ndiff(old_lines, new_lines)
-        html = ''
-        for line in diff:
-            if line.startswith('+ '):
-                html += f'<div class="diff-added">+ {line[2:]}</div>'
-            elif line.startswith('- '):
-                html += f'<div class="diff-removed">- {line[2:]}</div>'
-            else:
-                html += f'<div>{line[2:]}</div>'
-        return html
-
-    def get_file_metadata(self, file_path):
-        """StructureDefinitionファイルのメタ情報をdictで返す"""
-        if not file_path.exists():
-            return {}
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            meta_keys = [
-                'resourceType','id','language','url','version','name','title','status','date','publisher','description','copyright','fhirVersion','kind','abstract','type','baseDefinition','derivation','mapping'
-            ]
-            return {k: data.get(k) for k in meta_keys if k in data}
-        except Exception as e:
-            return {'error': str(e)}
-
-    def get_file_metadata_html(self, meta):
-        """メタ情報をHTMLテーブルで返す"""
-        if not meta:
-            return '<div>メタ情報なし</div>'
-        html = '<table style="border-collapse:collapse;">'
-        for k, v in meta.items():
-            html += f'<tr><th style="text-align:left;padding:2px 8px;background:#f8f9fa;">{k}</th><td style="padding:2px 8px;">{self.format_value(v)}</td></tr>'
-        html += '</table>'
-        return html
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-    def get_script_source_html(self):
-        """このスクリプト自身のソースをHTMLで返す"""
-        try:
-            with open(__file__, 'r', encoding='utf-8') as f:
-                code = f.read()
-            return f'<pre style="max-height:400px;overflow-y:auto;background:#222;color:#eee;padding:10px;border-radius:6px;">{code}</pre>'
-        except Exception:
-            return '<div>スクリプトソース取得不可</div>'
 
-    def generate_html_report(self, output_file="public/structure_definition_elements_diff.html"):
-        """HTMLレポートを生成"""
-        # 統計情報を計算
-        # StructureDefinition以外も含めて全JSONファイルを対象にする
-        all_files = set()
-        for d in [self.v1_path / "package", self.v2_path / "package"]:
-            if d.exists():
-                all_files.update([f.name for f in d.glob('*.json')])
-        total_files = len(all_files)
-        modified_files = []
-        for filename in sorted(all_files):
-            if filename.startswith('StructureDefinition-'):
-                differences = self.analyze_element_differences(filename)
-                if any(d['type'] != 'unchanged' for d in differences):
-                    modified_files.append((filename, differences, 'StructureDefinition'))
-            else:
-                v1_file = self.v1_path / "package" / filename
-                v2_file = self.v2_path / "package" / filename
-                v1_json = self.load_json(v1_file)
-                v2_json = self.load_json(v2_file)
-                diffs = self.json_diff_flat(v1_json, v2_json)
-                if any(d['type'] != 'unchanged' for d in diffs):
-                    modified_files.append((filename, diffs, 'Other'))
-        
-        # サイドバー用ファイルリスト
-        sidebar_items = []
-        file_meta_map = {}
-        v1_package = self.v1_path / "package"
-        v2_package = self.v2_path / "package"
-        for file_idx, (filename, differences, filetype) in enumerate(modified_files):
-            # ファイルパス特定
-            v1_file = v1_package / filename
-            v2_file = v2_package / filename
-            meta = self.get_file_metadata(v2_file if v2_file.exists() else v1_file)
-            file_meta_map[filename] = meta
-            sidebar_items.append(f'<div class="sidebar-item" title="{filename}"><a href="#file-{file_idx}">{filename}</a></div>')
-        # 追加情報（スクリプト全文）
-        script_html = self.get_script_source_html()
-        js_script = textwrap.dedent('''
-// ファイルごとの表示状態を管理
-window.fileRowDisplay = {};
-window.fileMetaDisplay = {};
-function toggleFileSection(idx) {
-  var wrap = document.getElementById('file-content-wrap-' + idx);
-  var header = document.getElementById('file-header-' + idx);
-  if (wrap.style.display === 'none') {
-    wrap.style.display = '';
-    header.classList.add('active');
-    // 状態復元
-    var fileId = 'file' + idx;
-    var showAll = (window.fileRowDisplay[fileId] === 'all');
-    toggleRows(fileId, showAll, true); // 状態復元
-    var metaId = 'meta-' + fileId;
-    var metaEl = document.getElementById(metaId);
-    if (window.fileMetaDisplay[fileId] === 'show') {
-      metaEl.style.display = '';
-    } else {
-      metaEl.style.display = 'none';
-    }
-  } else {
-    wrap.style.display = 'none';
-    header.classList.remove('active');
-  }
-}
-function toggleRows(fileId, showAll, restoreOnly) {
-  var allRows = document.querySelectorAll('.row-' + fileId);
-  allRows.forEach(function(row) {
-    if (showAll) {
-      row.style.display = '';
-    } else {
-      if (row.classList.contains('row-unchanged')) {
-        row.style.display = 'none';
-      } else {
-        row.style.display = '';
-      }
-    }
-  });
-  if (!restoreOnly) {
-    window.fileRowDisplay[fileId] = showAll ? 'all' : 'diff';
-  }
-}
-function toggleDisplay(id, fileId) {
-  var el = document.getElementById(id);
-  if (el.style.display === 'none') { el.style.display = ''; if(fileId) window.fileMetaDisplay[fileId] = 'show'; } else { el.style.display = 'none'; if(fileId) window.fileMetaDisplay[fileId] = 'hide'; }
-}
-''')
-        # バージョン名を引数から取得
-        v1_label = str(self.v1_path).rstrip('/').split('/')[-1]
-        v2_label = str(self.v2_path).rstrip('/').split('/')[-1]
-        html_content = f"""<!DOCTYPE html>
-<html lang="ja">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>jpclins StructureDefinition Elements差分レポート ({v1_label} → {v2_label})</title>
-    <style>
-        body {{
+# レポート共通のスタイルシート
+REPORT_CSS = """\
+        body {
             font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
             margin: 0;
             padding: 0;
             background-color: #f5f5f5;
-        }}
-        #sidebar {{
+        }
+        #sidebar {
             position: fixed;
             left: 0;
             top: 0;
@@ -301,19 +62,19 @@ function toggleDisplay(id, fileId) {
             z-index: 100;
             padding: 30px 0 30px 0;
             box-shadow: 2px 0 8px rgba(0,0,0,0.04);
-        }}
-        #sidebar h3 {{
+        }
+        #sidebar h3 {
             margin: 0 0 16px 32px;
             font-size: 1.2em;
             color: #1976d2;
-        }}
-        #sidebar-list {{
+        }
+        #sidebar-list {
             display: flex;
             flex-direction: column;
             gap: 8px;
             padding: 0 0 0 24px;
-        }}
-        .sidebar-item {{
+        }
+        .sidebar-item {
             background: #fff;
             border-radius: 8px;
             box-shadow: 0 1px 4px rgba(0,0,0,0.04);
@@ -324,59 +85,59 @@ function toggleDisplay(id, fileId) {
             white-space: nowrap;
             overflow-x: auto;
             max-width: 260px;
-        }}
-        .sidebar-item:hover {{
+        }
+        .sidebar-item:hover {
             background: #e3f2fd;
             box-shadow: 0 2px 8px rgba(0,0,0,0.08);
-        }}
-        .sidebar-item a {{
+        }
+        .sidebar-item a {
             color: #007bff;
             text-decoration: none;
             font-weight: 500;
-        }}
-        .sidebar-item a:hover {{
+        }
+        .sidebar-item a:hover {
             text-decoration: underline;
-        }}
-        #main-content {{
+        }
+        #main-content {
             margin-left: 360px;
             padding: 30px;
-        }}
-        .container {{
+        }
+        .container {
             max-width: 1600px;
             margin: 0 auto;
             background: white;
             border-radius: 8px;
             box-shadow: 0 2px 10px rgba(0,0,0,0.1);
             overflow: hidden;
-        }}
-        .header {{
+        }
+        .header {
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             color: white;
             padding: 30px;
             text-align: center;
-        }}
-        .header h1 {{
+        }
+        .header h1 {
             margin: 0;
             font-size: 2.5em;
             font-weight: 300;
-        }}
-        .header p {{
+        }
+        .header p {
             margin: 10px 0 0 0;
             opacity: 0.9;
             font-size: 1.1em;
-        }}
-        .summary {{
+        }
+        .summary {
             padding: 30px;
             background: #f8f9fa;
             border-bottom: 1px solid #e9ecef;
-        }}
-        .content {{
+        }
+        .content {
             padding: 30px;
-        }}
-        .file-section {{
+        }
+        .file-section {
             margin-bottom: 40px;
-        }}
-        .file-header {{
+        }
+        .file-header {
             background: #e3f2fd;
             padding: 15px;
             border-radius: 8px;
@@ -384,53 +145,61 @@ function toggleDisplay(id, fileId) {
             display: flex;
             align-items: center;
             cursor: pointer;
-        }}
-        .file-header h2 {{
+        }
+        .file-header h2 {
             margin: 0;
             color: #1976d2;
             flex: 1;
             font-size: 1.1em;
-        }}
-        .file-header .badge, .file-header .toggle-btn, .file-header .fold-btn {{
+        }
+        .file-header .badge, .file-header .toggle-btn, .file-header .fold-btn {
             /* pointer-events: none; を削除 */
-        }}
-        .file-header.active {{
+        }
+        .file-header.active {
             background: #1976d2;
             color: #fff;
-        }}
-        .file-header.active h2 {{
+        }
+        .file-header.active h2 {
             color: #fff;
-        }}
-        .file-content-wrap {{
+        }
+        .file-content-wrap {
             /* 追加 */
-        }}
-        .file-content-wrap.collapsed {{
+        }
+        .file-content-wrap.collapsed {
             display: none;
-        }}
-        .badge {{
+        }
+        .badge {
             display: inline-block;
             padding: 2px 8px;
             border-radius: 12px;
             font-size: 0.9em;
             margin-left: 8px;
-        }}
-        .badge-added {{
+        }
+        .badge-added {
             background: #28a745;
             color: white;
-        }}
-        .badge-removed {{
+        }
+        .badge-removed {
             background: #dc3545;
             color: white;
-        }}
-        .badge-modified {{
+        }
+        .badge-modified {
             background: #ffc107;
             color: #333;
-        }}
-        .badge-unchanged {{
+        }
+        .badge-unchanged {
             background: #6c757d;
             color: white;
-        }}
-        .toggle-btn {{
+        }
+        .badge-moved {
+            background: #6f42c1;
+            color: white;
+        }
+        .badge-noise {
+            background: #fd7e14;
+            color: white;
+        }
+        .toggle-btn {
             background: #007bff;
             color: white;
             border: none;
@@ -438,70 +207,94 @@ function toggleDisplay(id, fileId) {
             border-radius: 4px;
             cursor: pointer;
             margin-left: 10px;
-        }}
-        .toggle-btn:hover {{
+        }
+        .toggle-btn:hover {
             background: #0056b3;
-        }}
-        .table-container {{
+        }
+        .impact-list {
+            background: #f1f8ff;
+            border: 1px solid #c8e1ff;
+            border-radius: 4px;
+            padding: 8px 12px;
+            margin-bottom: 10px;
+        }
+        .impact-list ul {
+            margin: 6px 0 0 0;
+            padding-left: 20px;
+            max-height: 200px;
+            overflow-y: auto;
+        }
+        .impact-note {
+            color: #6c757d;
+            font-size: 0.9em;
+        }
+        .lazy-placeholder {
+            color: #6c757d;
+            padding: 12px;
+            margin: 0;
+        }
+        .table-container {
             max-height: 500px;
             overflow: auto;
             border: 1px solid #e9ecef;
             border-radius: 4px;
             margin-top: 20px;
-        }}
-        .elements-table {{
+        }
+        .elements-table {
             width: 100%;
-            min-width: 2000px;
             border-collapse: collapse;
-        }}
-        .elements-table th, .elements-table td {{
+        }
+        .elements-table th, .elements-table td {
             padding: 8px;
             text-align: left;
             border-bottom: 1px solid #e9ecef;
             vertical-align: top;
             font-size: 0.9em;
-        }}
-        .elements-table th {{
+        }
+        .elements-table th {
             background-color: #f8f9fa;
             font-weight: 600;
             position: sticky;
             top: 0;
             z-index: 10;
-        }}
-        .elements-table tr:hover {{
+        }
+        .elements-table tr:hover {
             background-color: #f8f9fa;
-        }}
-        .row-added {{
+        }
+        .row-added {
             background-color: #d4edda !important;
-        }}
-        .row-removed {{
+        }
+        .row-removed {
             background-color: #f8d7da !important;
-        }}
-        .row-modified {{
+        }
+        .row-modified {
             background-color: #fff3cd !important;
-        }}
-        .cell-added {{
+        }
+        .row-moved {
+            background-color: #e2d9f3 !important;
+        }
+        .cell-added {
             background-color: #c3e6cb;
             color: #155724;
-        }}
-        .cell-removed {{
+        }
+        .cell-removed {
             background-color: #f5c6cb;
             color: #721c24;
-        }}
-        .cell-modified {{
+        }
+        .cell-modified {
             background-color: #ffeaa7;
             color: #856404;
-        }}
-        .path-cell {{
+        }
+        .path-cell {
             font-weight: bold;
             font-family: 'Courier New', monospace;
             background-color: #f8f9fa;
-        }}
-        .no-value {{
+        }
+        .no-value {
             color: #6c757d;
             font-style: italic;
-        }}
-        .complex-value {{
+        }
+        .complex-value {
             background-color: #f8f9fa;
             padding: 4px;
             border-radius: 2px;
@@ -509,29 +302,29 @@ function toggleDisplay(id, fileId) {
             max-width: 300px;
             overflow-x: auto;
             white-space: pre-wrap;
-        }}
-        .diff-cell-content {{
+        }
+        .diff-cell-content {
             max-height: 200px;
             overflow-y: auto;
-        }}
-        .legend {{
+        }
+        .legend {
             margin: 20px 0;
             padding: 15px;
             background: #f8f9fa;
             border-radius: 4px;
-        }}
-        .legend-item {{
+        }
+        .legend-item {
             display: inline-block;
             margin-right: 20px;
-        }}
-        .legend-color {{
+        }
+        .legend-color {
             display: inline-block;
             width: 20px;
             height: 20px;
             margin-right: 5px;
             border-radius: 2px;
-        }}
-        .fold-btn {{
+        }
+        .fold-btn {
             background: #888;
             color: white;
             border: none;
@@ -540,164 +333,2692 @@ function toggleDisplay(id, fileId) {
             cursor: pointer;
             margin-left: 10px;
             font-size: 0.9em;
-        }}
-        .fold-btn:hover {{
+        }
+        .fold-btn:hover {
             background: #444;
-        }}
-        .diff-added {{
+        }
+        .diff-added {
             background-color: #d4edda;
             color: #155724;
             padding: 2px 8px;
             border-radius: 4px;
             margin: 2px 0;
             font-size: 0.9em;
-        }}
-        .diff-removed {{
+        }
+        .diff-removed {
             background-color: #f8d7da;
             color: #721c24;
             padding: 2px 8px;
             border-radius: 4px;
             margin: 2px 0;
             font-size: 0.9em;
-        }}
-    </style>
-</head>
-<body>
-<div id="sidebar">
-<h3>差分ファイル一覧</h3>
-<div id="sidebar-list">
-{''.join(sidebar_items)}
-</div>
-</div>
-<div id="main-content">
-<div class="container">
-<div class="header">
-<h1>jpclins StructureDefinition Elements差分レポート</h1>
-<p>バージョン {v1_label} → {v2_label} の比較結果</p>
-<p>生成日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')}</p>
-</div>
-<div class="summary">
-<h2>差分サマリー</h2>
-<p>比較対象ファイル数: {total_files}</p>
-<p>変更ありファイル数: {len(modified_files)}</p>
-</div>
-<div style="margin-bottom:24px;">
-<button class="fold-btn" onclick="toggleDisplay('script-info')">追加情報（スクリプト全文など）表示/非表示</button>
-<div id="script-info" style="display:none;">{script_html}</div>
-</div>
-<div class="content">
-<div class="legend">
+        }
+        .diff-summary {
+            background-color: #fff3cd;
+            color: #856404;
+            padding: 2px 8px;
+            border-radius: 4px;
+            font-size: 0.9em;
+        }"""
+
+# レポートの折りたたみ・表示切り替え
+REPORT_JS = textwrap.dedent('''
+// ファイルごとの表示状態を管理
+window.fileRowDisplay = {};
+window.fileMetaDisplay = {};
+function toggleFileSection(idx) {
+  var wrap = document.getElementById('file-content-wrap-' + idx);
+  var header = document.getElementById('file-header-' + idx);
+  if (wrap.style.display === 'none') {
+    wrap.style.display = '';
+    header.classList.add('active');
+    // 状態復元
+    var fileId = 'file' + idx;
+    var showAll = (window.fileRowDisplay[fileId] === 'all');
+    toggleRows(fileId, showAll, true); // 状態復元
+    var metaId = 'meta-' + fileId;
+    var metaEl = document.getElementById(metaId);
+    if (window.fileMetaDisplay[fileId] === 'show') {
+      metaEl.style.display = '';
+    } else {
+      metaEl.style.display = 'none';
+    }
+  } else {
+    wrap.style.display = 'none';
+    header.classList.remove('active');
+  }
+}
+function toggleRows(fileId, showAll, restoreOnly) {
+  var allRows = document.querySelectorAll('.row-' + fileId);
+  allRows.forEach(function(row) {
+    if (showAll) {
+      row.style.display = '';
+    } else {
+      if (row.classList.contains('row-unchanged')) {
+        row.style.display = 'none';
+      } else {
+        row.style.display = '';
+      }
+    }
+  });
+  if (!restoreOnly) {
+    window.fileRowDisplay[fileId] = showAll ? 'all' : 'diff';
+  }
+}
+function toggleDisplay(id, fileId) {
+  var el = document.getElementById(id);
+  if (el.style.display === 'none') { el.style.display = ''; if(fileId) window.fileMetaDisplay[fileId] = 'show'; } else { el.style.display = 'none'; if(fileId) window.fileMetaDisplay[fileId] = 'hide'; }
+}
+''')
+
+# 差分テーブルの凡例
+REPORT_LEGEND_HTML = """<div class="legend">
 <h3>凡例</h3>
 <div class="legend-item"><span class="legend-color" style="background-color: #d4edda;"></span>新規追加</div>
 <div class="legend-item"><span class="legend-color" style="background-color: #f8d7da;"></span>削除</div>
 <div class="legend-item"><span class="legend-color" style="background-color: #fff3cd;"></span>変更</div>
+<div class="legend-item"><span class="legend-color" style="background-color: #e2d9f3;"></span>移動（順序のみ変更）</div>
 </div>"""
-        
-        # 変更されたファイルごとにテーブルを生成
-        for file_idx, (filename, differences, filetype) in enumerate(modified_files):
-            file_id = f"file{file_idx}"
-            meta = self.get_file_metadata(v2_package / filename if (v2_package / filename).exists() else v1_package / filename)
-            desc = meta.get("description") or filename
-            meta_html = self.get_file_metadata_html(meta)
-            count_added = sum(1 for d in differences if d['type'] == 'added')
-            count_removed = sum(1 for d in differences if d['type'] == 'removed')
-            count_modified = sum(1 for d in differences if d['type'] == 'modified')
-            count_unchanged = sum(1 for d in differences if d['type'] == 'unchanged')
-            html_content += f"""
-<a id="file-{file_idx}"></a>
-<div class="file-section">
-  <div class="file-header" id="file-header-{file_idx}" onclick="toggleFileSection({file_idx})">
-    <h2>{desc}</h2>
-    <span class="badge badge-added">追加: {count_added}</span>
-    <span class="badge badge-removed">削除: {count_removed}</span>
-    <span class="badge badge-modified">変更: {count_modified}</span>
-    <span class="badge badge-unchanged">変更なし: {count_unchanged}</span>
-    <button class="toggle-btn" onclick="event.stopPropagation();toggleRows('{file_id}', false)">差分のみ表示</button>
-    <button class="toggle-btn" onclick="event.stopPropagation();toggleRows('{file_id}', true)">全行表示</button>
-    <button class="fold-btn" onclick="event.stopPropagation();toggleDisplay('meta-{file_id}', '{file_id}')">メタ情報表示/非表示</button>
-  </div>
-  <div class="file-content-wrap" id="file-content-wrap-{file_idx}">
-    <div id="meta-{file_id}" style="display:none;margin-bottom:10px;">{meta_html}</div>
-"""
-            if filetype == 'StructureDefinition':
-                html_content += """
-    <div class="table-container">
-      <table class="elements-table">
-        <thead>
-          <tr>
-            <th>Path</th>
-            <th>Type</th>"""
-                for attr in sorted(self.all_attributes):
-                    if attr != 'path':
-                        html_content += f"""
-                                <th>{attr}</th>"""
-                html_content += """
-                            </tr>
-                        </thead>
-                        <tbody>"""
-                for diff in differences:
-                    row_class = f"row-{diff['type']} row-{file_id}"
-                    display_style = '' if diff['type'] != 'unchanged' else 'style="display:none"'
-                    html_content += f"""
-                            <tr class="{row_class}" {display_style}>
-                                <td class="path-cell">{diff['path']}</td>
-                                <td>{diff['type']}</td>"""
-                    for attr in sorted(self.all_attributes):
-                        if attr == 'path':
-                            continue
-                        v1_element = diff.get('v1_element', {})
-                        v2_element = diff.get('v2_element', {})
-                        v1_value = v1_element.get(attr) if v1_element else None
-                        v2_value = v2_element.get(attr) if v2_element else None
-                        if diff['type'] == 'added':
-                            cell_class = 'cell-added'
-                            cell_content = f"""
-                                    <td class="{cell_class}"><div class="diff-cell-content">{self.format_value(v2_value)}</div></td>"""
-                        elif diff['type'] == 'removed':
-                            cell_class = 'cell-removed'
-                            cell_content = f"""
-                                    <td class="{cell_class}"><div class="diff-cell-content">{self.format_value(v1_value)}</div></td>"""
-                        elif diff['type'] == 'modified':
-                            if v1_value != v2_value:
-                                cell_class = 'cell-modified'
-                                cell_content = f"""
-                                    <td class="{cell_class}"><div class="diff-cell-content">{self.html_diff(v1_value, v2_value)}</div></td>"""
-                            else:
-                                cell_content = f"""
-                                    <td><div class="diff-cell-content">{self.format_value(v1_value)}</div></td>"""
-                        else:  # unchanged
-                            cell_content = f"""
-                                    <td><div class="diff-cell-content">{self.format_value(v1_value)}</div></td>"""
-                        html_content += cell_content
-                    html_content += """
-                            </tr>"""
-                html_content += """
-                        </tbody>
-                    </table>
+
+# 遅延読み込みモードで追加するスクリプト
+LAZY_REPORT_JS = textwrap.dedent('''
+// 遅延読み込み: 表の行はセクション展開時にJSONから取得し、スクロールに合わせて少しずつ描画する
+window.fileFragments = {};
+var LAZY_BATCH_ROWS = 100;
+var eagerToggleRows = toggleRows;
+function loadFragment(container, fileId) {
+  if (!window.fileFragments[fileId]) {
+    window.fileFragments[fileId] = fetch(container.dataset.fragment).then(function(res) {
+      if (!res.ok) { throw new Error(res.status + ' ' + res.statusText); }
+      return res.json();
+    }).catch(function(err) {
+      delete window.fileFragments[fileId];
+      container.innerHTML = '<p class="lazy-placeholder">差分データを読み込めませんでした: ' + err + '</p>';
+      throw err;
+    });
+  }
+  return window.fileFragments[fileId];
+}
+function renderLazyTable(container, fragment, showAll) {
+  var mode = showAll ? 'all' : 'diff';
+  if (container.dataset.rendered === mode) { return; }
+  container.dataset.rendered = mode;
+  var rows = showAll ? fragment.rows : fragment.rows.filter(function(row) { return row[0] !== 'unchanged'; });
+  container.innerHTML = fragment.open + fragment.close;
+  container.scrollTop = 0;
+  var tbody = container.querySelector('tbody');
+  var rendered = 0;
+  function renderMore() {
+    var end = Math.min(rendered + LAZY_BATCH_ROWS, rows.length);
+    tbody.insertAdjacentHTML('beforeend', rows.slice(rendered, end).map(function(row) { return row[1]; }).join(''));
+    rendered = end;
+  }
+  function fill() {
+    // 表示領域が埋まるまで描画し、残りはスクロールが末尾に近づいたら追加する
+    do { renderMore(); } while (rendered < rows.length && container.offsetParent !== null
+                                && container.scrollHeight <= container.clientHeight + 200);
+  }
+  container.onscroll = function() {
+    if (rendered < rows.length && container.scrollTop + container.clientHeight >= container.scrollHeight - 200) { fill(); }
+  };
+  fill();
+}
+toggleRows = function(fileId, showAll, restoreOnly) {
+  var container = document.getElementById('table-' + fileId);
+  if (!container || !container.dataset.fragment) { return eagerToggleRows(fileId, showAll, restoreOnly); }
+  if (!restoreOnly) {
+    window.fileRowDisplay[fileId] = showAll ? 'all' : 'diff';
+  }
+  loadFragment(container, fileId).then(function(fragment) {
+    renderLazyTable(container, fragment, showAll);
+  }).catch(function() {});
+};
+''')
+
+
+class DirectoryPackageSource:
+    """展開済みの package/ ディレクトリからJSONを読み出す"""
+
+    # 同時に読み出せるスレッド数（Noneは制限なし）
+    max_readers = None
+
+    def __init__(self, package_dir):
+        self.package_dir = Path(package_dir)
+
+    def list_files(self, pattern='*.json'):
+        if not self.package_dir.exists():
+            return []
+        return [f.name for f in self.package_dir.glob(pattern)]
+
+    def exists(self, filename):
+        return (self.package_dir / filename).exists()
+
+    def open(self, filename):
+        return open(self.package_dir / filename, 'rb')
+
+    def read(self, filename):
+        return (self.package_dir / filename).read_bytes()
+
+    def size(self, filename):
+        return (self.package_dir / filename).stat().st_size
+
+    def order(self, filenames):
+        return sorted(filenames)
+
+    def describe(self, filename):
+        return str(self.package_dir / filename)
+
+    def close(self):
+        pass
+
+
+class TarballPackageSource:
+    """配布されている .tgz を展開せずに package/*.json をストリームで読み出す"""
+
+    MEMBER_PREFIX = 'package/'
+    # 1本のgzipストリームを読むため、先読みは1スレッドで行う
+    max_readers = 1
+
+    def __init__(self, tgz_path):
+        self.tgz_path = Path(tgz_path)
+        self._lock = threading.Lock()
+        self._tar = None
+        self._members = None
+        self._member_order = {}
+
+    def _index(self):
+        # ヘッダだけを1回走査し、package直下のJSONメンバーを記録する
+        if self._members is None:
+            self._tar = tarfile.open(self.tgz_path, 'r:gz')
+            self._members = {}
+            for member in self._tar:
+                name = member.name
+                if not member.isfile() or not name.startswith(self.MEMBER_PREFIX):
+                    continue
+                filename = name[len(self.MEMBER_PREFIX):]
+                if '/' in filename or not filename.endswith('.json'):
+                    continue
+                self._members[filename] = member
+                self._member_order[filename] = member.offset
+        return self._members
+
+    def list_files(self, pattern='*.json'):
+        return [name for name in self._index() if fnmatch.fnmatchcase(name, pattern)]
+
+    def exists(self, filename):
+        return filename in self._index()
+
+    def open(self, filename):
+        # _index()が初回（およびclose()後）にアーカイブを開くため、先に呼んでおく
+        members = self._index()
+        return self._tar.extractfile(members[filename])
+
+    def read(self, filename):
+        with self._lock:
+            with self.open(filename) as f:
+                return f.read()
+
+    def size(self, filename):
+        return self._index()[filename].size
+
+    def order(self, filenames):
+        # gzipは後方シークすると先頭から解凍し直すため、アーカイブ内の順序で読む
+        self._index()
+        return sorted(filenames, key=lambda name: self._member_order.get(name, -1))
+
+    def describe(self, filename):
+        return f"{self.tgz_path}:{self.MEMBER_PREFIX}{filename}"
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+            self._members = None
+
+
+class MemoryPackageSource:
+    """読み込み済みのバイト列からJSONを読み出す（並列実行時のワーカー用）"""
+
+    # 読み出しの待ち時間がないため先読みしない
+    max_readers = 0
+
+    def __init__(self, files):
+        self.files = files
+
+    def list_files(self, pattern='*.json'):
+        return [name for name in self.files if fnmatch.fnmatchcase(name, pattern)]
+
+    def exists(self, filename):
+        return filename in self.files
+
+    def open(self, filename):
+        return io.BytesIO(self.files[filename])
+
+    def read(self, filename):
+        return self.files[filename]
+
+    def size(self, filename):
+        return len(self.files[filename])
+
+    def order(self, filenames):
+        return sorted(filenames)
+
+    def describe(self, filename):
+        return filename
+
+    def close(self):
+        pass
+
+
+class FileSelector:
+    """ファイル名による絞り込み（--include / --exclude / --resource-type）
+
+    リソース種別はFHIRパッケージの命名規則（<ResourceType>-<id>.json）からファイル名だけで判定する。
+    """
+
+    def __init__(self, include=(), exclude=(), resource_types=()):
+        self.include = tuple(include or ())
+        self.exclude = tuple(exclude or ())
+        self.resource_types = frozenset(resource_types or ())
+
+    def __bool__(self):
+        return bool(self.include or self.exclude or self.resource_types)
+
+    def __call__(self, filename):
+        if self.resource_types and filename.split('-', 1)[0] not in self.resource_types:
+            return False
+        if self.include and not any(fnmatch.fnmatchcase(filename, pattern) for pattern in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(filename, pattern) for pattern in self.exclude)
+
+
+class FilteredPackageSource:
+    """選択されたファイルだけを見せる読み出し元（一覧の段階で絞り込むため、対象外のファイルは開かない）"""
+
+    def __init__(self, source, selector):
+        self.source = source
+        self.selector = selector
+
+    def __getattr__(self, name):
+        # package_dir・max_readersなどは元の読み出し元のものを使う
+        return getattr(self.source, name)
+
+    def list_files(self, pattern='*.json'):
+        return [name for name in self.source.list_files(pattern) if self.selector(name)]
+
+    def exists(self, filename):
+        return self.selector(filename) and self.source.exists(filename)
+
+    def open(self, filename):
+        return self.source.open(filename)
+
+    def read(self, filename):
+        return self.source.read(filename)
+
+    def size(self, filename):
+        return self.source.size(filename)
+
+    def order(self, filenames):
+        return self.source.order(filenames)
+
+    def describe(self, filename):
+        return self.source.describe(filename)
+
+    def close(self):
+        self.source.close()
+
+
+DEFAULT_IO_THREADS = 4
+DEFAULT_READ_AHEAD = 16
+DEFAULT_READ_AHEAD_MB = 128
+
+
+class PrefetchReader:
+    """読み出し元のファイルをスレッドで先読みし、指定した順にバイト列を渡す
+
+    ネットワーク越しのストレージなどファイルごとの待ち時間が大きい場合に、読み出しとパース・差分計算を重ねる。
+    先読みは最大 read_ahead 件までで、読み込み済みで未消費のバイト数が max_bytes を超えている間は
+    新たな読み出しを始めない。threadsが0なら先読みせずに1件ずつ読む。
+    """
+
+    def __init__(self, threads=DEFAULT_IO_THREADS, read_ahead=DEFAULT_READ_AHEAD,
+                 max_bytes=DEFAULT_READ_AHEAD_MB * 1024 * 1024):
+        self.threads = threads
+        self.read_ahead = max(1, read_ahead)
+        self.max_bytes = max_bytes
+
+    def read_files(self, source, filenames, process=None):
+        """(ファイル名, 内容, 例外) をfilenamesの順に生成する
+
+        processを指定すると、読み出しと同じスレッドでバイト列を (結果, 保持するバイト数) に変換してから渡す。
+        """
+        threads = self.threads if source.max_readers is None else min(self.threads, source.max_readers)
+        if threads <= 0 or len(filenames) <= 1:
+            for filename in filenames:
+                yield (filename, *self._read(source, filename, process)[:2])
+            return
+        names = iter(filenames)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            try:
+                while True:
+                    while len(pending) < self.read_ahead and self._buffered(pending) < self.max_bytes:
+                        filename = next(names, None)
+                        if filename is None:
+                            break
+                        pending.append((filename, executor.submit(self._read, source, filename, process)))
+                    if not pending:
+                        return
+                    filename, future = pending.popleft()
+                    yield (filename, *future.result()[:2])
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def _read(source, filename, process):
+        try:
+            data = source.read(filename)
+        except Exception as e:
+            return None, e, 0
+        if process is None:
+            return data, None, len(data)
+        result, size = process(data)
+        return result, None, size
+
+    @staticmethod
+    def _buffered(pending):
+        """読み込み済みで未消費のバイト数"""
+        return sum(future.result()[2] for _, future in pending if future.done())
+
+
+def sha256_digest(data):
+    return hashlib.sha256(data).hexdigest(), 0
+
+
+def file_digest(source, filename, chunk_size=1024 * 1024):
+    """ファイル内容をチャンク単位で読みながらSHA-256ダイジェストを計算"""
+    digest = hashlib.sha256()
+    with source.open(filename) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def value_fingerprint(value):
+    """属性値のハッシュ（同一プロセス内での比較専用）
+
+    JSONへの再エンコードより高速なmarshalでバイト列にしてハッシュする。dictのキー順や
+    1と1.0の違いでも値が異なるため、ハッシュが一致しない場合は元の値を比較して確かめる。
+    """
+    return hash(marshal.dumps(value))
+
+
+class ElementRecord:
+    """比較用に圧縮した1要素分の情報
+
+    names: ソートした属性名のタプル（internし、同じ組み合わせは1つのタプルを共有）
+    hashes: namesと同じ順の属性値ハッシュ（value_fingerprint）を8バイトずつ詰めたbytes
+    element: 元のElementDefinition。差分として表示しないファイルでは解放し、必要になれば読み直す
+    """
+    __slots__ = ('names', 'hashes', 'element')
+
+    def __init__(self, names, hashes, element):
+        self.names = names
+        self.hashes = hashes
+        self.element = element
+
+    def same_values(self, other):
+        return self.names == other.names and self.hashes == other.hashes
+
+    def attribute_hashes(self):
+        return dict(zip(self.names, struct.unpack(f"{len(self.names)}q", self.hashes)))
+
+
+def ndiff_lines(old_lines, new_lines):
+    """difflib.ndiffによる行差分（行内の類似判定を行うため、大きな値では非常に遅い）"""
+    for line in difflib.ndiff(old_lines, new_lines):
+        tag = line[0]
+        # '?' で始まる行内ヒントは従来どおり通常行として扱う
+        yield (tag if tag in '+-' else ' ', line[2:])
+
+
+# アンカーのない区間をSequenceMatcherで比較する上限（旧行数×新行数）
+PATIENCE_FALLBACK_LIMIT = 40000
+
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    """両側の区間で1回だけ現れる行を対応付け、順序が保たれる最長の組を返す"""
+    counts = {}
+    for i in range(alo, ahi):
+        entry = counts.get(a[i])
+        if entry is None:
+            counts[a[i]] = [1, i, 0, -1]
+        else:
+            entry[0] += 1
+    for j in range(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[2] += 1
+            entry[3] = j
+    pairs = sorted((e[1], e[3]) for e in counts.values() if e[0] == 1 and e[2] == 1)
+    if not pairs:
+        return []
+    # patience sortingで新側インデックスの最長増加部分列を求める
+    tails = []
+    tail_indexes = []
+    previous = [None] * len(pairs)
+    for k, (_, bj) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, bj)
+        if pos > 0:
+            previous[k] = tail_indexes[pos - 1]
+        if pos == len(tails):
+            tails.append(bj)
+            tail_indexes.append(k)
+        else:
+            tails[pos] = bj
+            tail_indexes[pos] = k
+    anchors = []
+    k = tail_indexes[-1]
+    while k is not None:
+        anchors.append(pairs[k])
+        k = previous[k]
+    anchors.reverse()
+    return anchors
+
+
+def _patience_diff(a, alo, ahi, b, blo, bhi, ops):
+    # 共通の先頭・末尾はそのまま一致行にする
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        ops.append((' ', a[alo]))
+        alo += 1
+        blo += 1
+    tail_start = len(ops)
+    tail = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        tail.append(a[ahi])
+    if alo == ahi:
+        ops.extend(('+', line) for line in b[blo:bhi])
+    elif blo == bhi:
+        ops.extend(('-', line) for line in a[alo:ahi])
+    else:
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            for ai, bj in anchors:
+                _patience_diff(a, alo, ai, b, blo, bj, ops)
+                ops.append((' ', a[ai]))
+                alo, blo = ai + 1, bj + 1
+            _patience_diff(a, alo, ahi, b, blo, bhi, ops)
+        elif (ahi - alo) * (bhi - blo) <= PATIENCE_FALLBACK_LIMIT:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == 'equal':
+                    ops.extend((' ', line) for line in a[alo + i1:alo + i2])
+                else:
+                    ops.extend(('-', line) for line in a[alo + i1:alo + i2])
+                    ops.extend(('+', line) for line in b[blo + j1:blo + j2])
+        else:
+            ops.extend(('-', line) for line in a[alo:ahi])
+            ops.extend(('+', line) for line in b[blo:bhi])
+    ops.extend((' ', line) for line in reversed(tail))
+
+
+def patience_diff_lines(old_lines, new_lines):
+    """patience diffによる行差分
+
+    両側で1回だけ現れる行をアンカーに区間を分割していくため、ほぼ線形時間で終わる。
+    アンカーのない小さな区間だけSequenceMatcherで比較し、大きな区間は削除＋追加として扱う。
+    """
+    ops = []
+    _patience_diff(old_lines, 0, len(old_lines), new_lines, 0, len(new_lines), ops)
+    return ops
+
+
+# html_diffで使う行差分エンジン（(タグ, 行) を返す）
+LINE_DIFF_ENGINES = {
+    'patience': patience_diff_lines,
+    'ndiff': ndiff_lines,
+}
+DEFAULT_DIFF_MAX_LINES = 5000
+
+class StdlibJsonCodec:
+    """標準ライブラリのjsonによる読み書き"""
+    name = 'json'
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(value):
+        """区切りの空白を省いたUTF-8のバイト列にする"""
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def dumps_indent(value):
+        """表示用にインデント2で整形した文字列にする"""
+        return json.dumps(value, indent=2, ensure_ascii=False)
+
+
+class OrjsonCodec:
+    """orjsonによる読み書き（バイト列を直接扱う）
+
+    出力は標準ライブラリと同じになるようにする。orjsonでは書式の異なる小数や扱えない値
+    （64bitを超える整数、NaNなど）を含む場合は標準ライブラリで処理する。
+    """
+    name = 'orjson'
+    # 文字列の外にある小数らしき数値。文字列中の誤検出は標準ライブラリで処理するだけなので構わない
+    FLOAT_PATTERN = re.compile(rb'(?:[:,\[]|: |\n +)-?[0-9]+[.eE]')
+    # NaN・Infinityを読み込んだ後は、nullとして書き出さないよう常に標準ライブラリで書き出す
+    nonfinite_loaded = False
+
+    @classmethod
+    def loads(cls, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data, parse_constant=cls._parse_constant)
+
+    @classmethod
+    def _parse_constant(cls, name):
+        cls.nonfinite_loaded = True
+        return float(name)
+
+    @classmethod
+    def dumps(cls, value):
+        if not cls.nonfinite_loaded:
+            try:
+                data = orjson.dumps(value)
+            except TypeError:
+                pass
+            else:
+                if not cls.FLOAT_PATTERN.search(data):
+                    return data
+        return StdlibJsonCodec.dumps(value)
+
+    @classmethod
+    def dumps_indent(cls, value):
+        if not cls.nonfinite_loaded:
+            try:
+                data = orjson.dumps(value, option=orjson.OPT_INDENT_2)
+            except TypeError:
+                pass
+            else:
+                if not cls.FLOAT_PATTERN.search(data):
+                    return data.decode('utf-8')
+        return StdlibJsonCodec.dumps_indent(value)
+
+
+# JSONの読み書きに使うコーデック（autoはorjsonがインストールされていれば使う）
+JSON_CODECS = {'json': StdlibJsonCodec}
+if orjson is not None:
+    JSON_CODECS['orjson'] = OrjsonCodec
+json_codec = JSON_CODECS.get('orjson', StdlibJsonCodec)
+
+
+def use_json_codec(name):
+    """以降のJSONの読み書きに使うコーデックを切り替える"""
+    global json_codec
+    json_codec = JSON_CODECS.get('orjson', StdlibJsonCodec) if name == 'auto' else JSON_CODECS[name]
+    return json_codec
+
+
+# 出力形式ごとのデフォルト出力先
+DEFAULT_OUTPUT_FILES = {
+    'html': "public/structure_definition_elements_diff.html",
+    'jsonl': "public/structure_definition_elements_diff.jsonl",
+    'columnar': "public/structure_definition_elements_diff.columnar.json",
+}
+
+
+
+def fragment_dir_for(output_file):
+    """遅延読み込みモードでレポートと並べて置くフラグメントのディレクトリ"""
+    return Path(output_file).with_name(Path(output_file).stem + '_fragments')
+
+
+def fragment_name_for(filename):
+    """ファイルのフラグメント名（レポート内の位置によらず同じ名前にし、監視時に書き直さずに済むようにする）"""
+    return Path(filename).stem + '.json'
+
+
+def pages_dir_for(output_file):
+    """分割出力モードでインデックスと並べて置くページのディレクトリ"""
+    return Path(output_file).with_name(Path(output_file).stem + '_pages')
+
+
+# 分割出力のページごとの入力のハッシュ（次回の実行で変わっていないページを書き直さないため）
+PAGES_MANIFEST = 'manifest.json'
+
+
+_tool_version = None
+
+
+def tool_version():
+    """キャッシュ無効化用のツールバージョン（このスクリプト自身のダイジェスト）"""
+    global _tool_version
+    if _tool_version is None:
+        with open(__file__, 'rb') as f:
+            _tool_version = hashlib.sha256(f.read()).hexdigest()[:16]
+    return _tool_version
+
+
+class DiffCache:
+    """(旧ファイルハッシュ, 新ファイルハッシュ, ツールバージョン) をキーに差分結果を保存するSQLiteキャッシュ
+
+    サイズ上限を超えた場合は最終利用日時の古いエントリから削除する。
+    """
+
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(str(self.cache_dir / "diff_cache.sqlite3"))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS diff_cache ("
+            "key TEXT PRIMARY KEY, payload BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+
+    @staticmethod
+    def make_key(kind, v1_digest, v2_digest):
+        return hashlib.sha256(f"{tool_version()}:{kind}:{v1_digest}:{v2_digest}".encode('utf-8')).hexdigest()
+
+    def get(self, key, count=True):
+        """キャッシュを引く（countがFalseなら差分キャッシュのヒット・ミスに数えない）"""
+        row = self.conn.execute("SELECT payload FROM diff_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += count
+            return None
+        self.hits += count
+        self.conn.execute("UPDATE diff_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json_codec.loads(zlib.decompress(row[0]))
+
+    def put(self, key, value):
+        payload = zlib.compress(json_codec.dumps(value))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO diff_cache (key, payload, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, payload, len(payload), time.time()),
+        )
+
+    def evict(self):
+        """合計サイズが上限に収まるまで古いエントリを削除"""
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM diff_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute("SELECT key, size FROM diff_cache ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM diff_cache WHERE key = ?", (key,))
+            total -= size
+
+    def close(self):
+        self.evict()
+        self.conn.commit()
+        self.conn.close()
+
+
+# 処理フェーズの表示名（RunStats.phasesのキー -> 表示名）
+PHASE_LABELS = {
+    'identical_check': "同一ファイルの判定",
+    'cache_lookup': "差分キャッシュの参照",
+    'parallel_diff': "並列パース・差分計算",
+    'differential_check': "differentialの比較",
+    'parse_profiles': "StructureDefinitionのパース",
+    'diff': "差分計算（その他のパース含む）",
+    'impact_index': "用語の参照索引の作成",
+    'render': "HTML生成",
+    'export': "差分レコードの書き出し",
+}
+
+# カウンタの表示名（RunStats.countersのキー -> 表示名）
+COUNTER_LABELS = {
+    'files_parsed': "JSONパース回数",
+    'bytes_read': "パースしたJSONのバイト数",
+    'bytes_hashed': "ダイジェストを計算したバイト数",
+    'files_diffed': "差分を計算したファイル数",
+    'files_streamed': "ストリーミングで比較したファイル数",
+    'profiles_skipped': "differentialが同じで要素比較を省略したプロファイル数",
+    'elements_compared': "比較した要素数",
+    'cells_diffed': "差分表示したセル数",
+    'html_bytes_written': "書き出したHTML・フラグメントのバイト数",
+    'pages_written': "書き出したページ数",
+    'pages_skipped': "内容が変わらず書き出しを省略したページ数",
+    'records_written': "書き出した差分レコード数",
+    'cache_hits': "差分キャッシュのヒット",
+    'cache_misses': "差分キャッシュのミス",
+}
+
+
+class RunStats:
+    """処理フェーズごとの所要時間と、処理件数のカウンタ"""
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def phase(self, name):
+        """withブロックの所要時間をフェーズに加算する（同じフェーズは合計）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def merge(self, counters):
+        for name, value in counters.items():
+            self.counters[name] += value
+
+    def to_dict(self):
+        return {
+            'phases': {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            'counters': dict(self.counters),
+        }
+
+    def format_lines(self):
+        lines = ["処理時間の内訳:"]
+        for name, seconds in self.phases.items():
+            lines.append(f"  {PHASE_LABELS.get(name, name)}: {seconds:.2f}秒")
+        lines.append("処理件数:")
+        for name, value in self.counters.items():
+            lines.append(f"  {COUNTER_LABELS.get(name, name)}: {value:,}")
+        return lines
+
+
+def open_package_source(path, selector=None):
+    """バージョン指定（フォルダ or .tgz）から読み出し元を決定する
+
+    - .tgz ファイルを直接指定した場合はアーカイブから読む
+    - フォルダに展開済みの package/ があればそれを使う
+    - package/ がなく .tgz が1つだけ置かれたフォルダはアーカイブから読む
+
+    selectorを指定すると、それに一致するファイルだけを対象にする。
+    """
+    path = Path(path)
+    if path.is_file():
+        source = TarballPackageSource(path)
+    else:
+        source = None
+        if not (path / "package").is_dir():
+            tarballs = sorted(path.glob('*.tgz')) if path.is_dir() else []
+            if len(tarballs) == 1:
+                source = TarballPackageSource(tarballs[0])
+        if source is None:
+            source = DirectoryPackageSource(path / "package")
+    if selector:
+        source = FilteredPackageSource(source, selector)
+    return source
+
+
+def version_label(path):
+    """レポート表示用のバージョン名（フォルダ名、または.tgzの拡張子を除いた名前）"""
+    name = str(path).rstrip('/').split('/')[-1]
+    for suffix in ('.tgz', '.tar.gz'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+# 配列要素を対応付ける自然キーの候補（先頭の項目は必須、残りは任意）
+JSON_ARRAY_NATURAL_KEYS = (
+    ('code',),
+    ('system', 'version'),
+    ('url',),
+)
+
+
+def _natural_keys(v1_items, v2_items):
+    """両配列の全要素を一意に識別できる自然キーを探す
+
+    見つかれば (キー項目, 旧配列の各要素のキー, 新配列の各要素のキー) を、なければNoneを返す。
+    各要素のキーは1回だけ計算して呼び出し側の対応付けでもそのまま使う。
+    """
+    items = v1_items + v2_items
+    if not items or not all(isinstance(item, dict) for item in items):
+        return None
+    for fields in JSON_ARRAY_NATURAL_KEYS:
+        if not all(fields[0] in item for item in items):
+            continue
+        keys = []
+        for side in (v1_items, v2_items):
+            side_keys = [_natural_key(item, fields) for item in side]
+            if len(set(side_keys)) != len(side_keys):
+                break
+            keys.append(side_keys)
+        else:
+            return fields, keys[0], keys[1]
+    return None
+
+
+_canonical_json = json.JSONEncoder(ensure_ascii=False, sort_keys=True).encode
+
+
+def _natural_key(item, fields):
+    # 文字列はそのまま使う（先頭の '"' でJSON化した他の型の値と区別する）
+    return tuple(
+        (field, '"' + item[field] if item[field].__class__ is str else _canonical_json(item[field]))
+        for field in fields if field in item
+    )
+
+
+def _natural_key_label(item, fields):
+    return ','.join(f"{field}={item[field]}" for field in fields if field in item)
+
+
+def profile_elements(data):
+    """StructureDefinitionのelement配列を 要素キー -> ElementDefinition のdictで返す
+
+    snapshotを優先し、なければdifferentialを使う。スライスは同じpathを共有するため
+    ElementDefinition.idをキーにし、重複する場合は '#2' のように番号を付ける。
+    """
+    elements = {}
+    element_list = data.get('snapshot', {}).get('element', [])
+    if not element_list:
+        element_list = data.get('differential', {}).get('element', [])
+    occurrences = defaultdict(int)
+    for element in element_list:
+        path = element.get('path', '')
+        if path:
+            key = element.get('id') or path
+            occurrences[key] += 1
+            if occurrences[key] > 1:
+                key = f"{key}#{occurrences[key]}"
+            elements[key] = element
+    return elements
+
+
+def split_canonical(canonical):
+    """'url|version' 形式のcanonical参照を (url, version) に分ける"""
+    url, _, version = canonical.partition('|')
+    return url, version or None
+
+
+# FHIRコアのプロファイル（fhirVersionが同じなら変わらない）
+FHIR_CORE_PROFILE_PREFIX = 'http://hl7.org/fhir/StructureDefinition/'
+
+# 用語の参照元として索引に入れるリソース
+REFERENCING_PREFIXES = ('StructureDefinition-', 'ValueSet-')
+# 参照先として影響範囲を表示するリソース
+TERMINOLOGY_PREFIXES = ('ValueSet-', 'CodeSystem-')
+
+
+def resource_references(data, elements=None):
+    """リソース自身のurl・versionと、参照しているValueSet・CodeSystemのcanonical URLを返す
+
+    StructureDefinitionは要素のbinding.valueSet、ValueSetはcompose.include/excludeの
+    system・valueSetを (参照箇所, url, version) として集める。
+    """
+    refs = []
+    if not isinstance(data, dict):
+        return {'url': None, 'version': None, 'refs': refs}
+    resource_type = data.get('resourceType')
+    if resource_type == 'StructureDefinition':
+        if elements is None:
+            elements = profile_elements(data)
+        for key, element in elements.items():
+            binding = element.get('binding')
+            if isinstance(binding, dict) and isinstance(binding.get('valueSet'), str):
+                refs.append((key, *split_canonical(binding['valueSet'])))
+    elif resource_type == 'ValueSet':
+        compose = data.get('compose') or {}
+        for part in ('include', 'exclude'):
+            for entry in compose.get(part) or []:
+                if isinstance(entry.get('system'), str):
+                    refs.append((f"compose.{part}.system", entry['system'], entry.get('version')))
+                for value_set in entry.get('valueSet') or []:
+                    refs.append((f"compose.{part}.valueSet", *split_canonical(value_set)))
+    return {'url': data.get('url'), 'version': data.get('version'), 'refs': refs}
+
+
+def structural_json_diff(path, v1, v2, diffs):
+    """2つのJSON値を再帰的に比較し、変更のあった末端のパスだけをdiffsに追加する
+
+    dictはキーごと、配列は自然キー（code, system+version, url）があれば要素を対応付け、
+    なければ位置で比較する。
+    """
+    if v1 == v2:
+        return
+    if isinstance(v1, dict) and isinstance(v2, dict):
+        for k in sorted(v1.keys() | v2.keys()):
+            child = f"{path}.{k}"
+            if k not in v1:
+                diffs.append({'key': child, 'type': 'added', 'v1': None, 'v2': v2[k]})
+            elif k not in v2:
+                diffs.append({'key': child, 'type': 'removed', 'v1': v1[k], 'v2': None})
+            else:
+                structural_json_diff(child, v1[k], v2[k], diffs)
+    elif isinstance(v1, list) and isinstance(v2, list):
+        natural_keys = _natural_keys(v1, v2)
+        if natural_keys is None:
+            for i in range(max(len(v1), len(v2))):
+                child = f"{path}[{i}]"
+                if i >= len(v1):
+                    diffs.append({'key': child, 'type': 'added', 'v1': None, 'v2': v2[i]})
+                elif i >= len(v2):
+                    diffs.append({'key': child, 'type': 'removed', 'v1': v1[i], 'v2': None})
+                else:
+                    structural_json_diff(child, v1[i], v2[i], diffs)
+            return
+        fields, v1_keys, v2_keys = natural_keys
+        v2_index = dict(zip(v2_keys, v2))
+        for key, item in zip(v1_keys, v1):
+            child = f"{path}[{_natural_key_label(item, fields)}]"
+            if key in v2_index:
+                structural_json_diff(child, item, v2_index[key], diffs)
+            else:
+                diffs.append({'key': child, 'type': 'removed', 'v1': item, 'v2': None})
+        v1_keys = set(v1_keys)
+        for key, item in zip(v2_keys, v2):
+            if key not in v1_keys:
+                child = f"{path}[{_natural_key_label(item, fields)}]"
+                diffs.append({'key': child, 'type': 'added', 'v1': None, 'v2': item})
+    else:
+        diffs.append({'key': path, 'type': 'modified', 'v1': v1, 'v2': v2})
+
+
+# ストリーミングで読むファイルの大きさ（MB、これ以上のStructureDefinition以外のファイルが対象）
+DEFAULT_STREAM_THRESHOLD_MB = 64
+
+# ストリーミング時に要素を1件ずつ読む配列（ルートからのキーのパス）
+STREAMED_ARRAY_PATHS = (
+    ('concept',),
+    ('compose', 'include'),
+    ('compose', 'exclude'),
+    ('expansion', 'contains'),
+)
+
+# レポートに表示するファイルのメタ情報
+FILE_METADATA_KEYS = (
+    'resourceType', 'id', 'language', 'url', 'version', 'name', 'title', 'status', 'date', 'publisher',
+    'description', 'copyright', 'fhirVersion', 'kind', 'abstract', 'type', 'baseDefinition', 'derivation',
+    'mapping',
+)
+
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_JSON_ITEM_SEPARATOR = re.compile(r'[ \t\n\r]*([,\]])[ \t\n\r]*')
+_json_decoder = json.JSONDecoder()
+
+
+class JsonStreamCursor:
+    """バイナリストリームのJSONを先頭から少しずつ読み進めるカーソル
+
+    値は標準ライブラリのデコーダ（raw_decode）で1つずつ取り出し、読み終えた部分はバッファから捨てる。
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, stream):
+        self.reader = io.TextIOWrapper(stream, encoding='utf-8-sig')
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None):
+        """読み終えた部分を捨てて続きを読み足す（終端ならFalse）"""
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.reader.read(size or self.CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        """空白を読み飛ばし、次の文字を返す"""
+        while True:
+            self.pos = _JSON_WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("JSONの途中でファイルが終わっています")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"JSONの解析に失敗しました: '{char}' がありません（{self.buffer[self.pos:self.pos + 20]!r}）")
+        self.pos += 1
+
+    def read_value(self):
+        """次の値を1つ丸ごとデコードして返す"""
+        self.peek()
+        size = self.CHUNK_SIZE
+        while True:
+            try:
+                value, end = _json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # 値の途中でバッファが終わっている（大きな値ほど読み足す量を増やす）
+                if not self.fill(size):
+                    raise
+                size *= 2
+                continue
+            # バッファ末尾で終わる数値は続きがあるかもしれない
+            if end < len(self.buffer) or self.eof or not self.fill(size):
+                self.pos = end
+                return value
+
+    def read_items(self):
+        """空でない配列の '[' の直後から要素を1件ずつ返し、']' の後まで読み進める"""
+        decode = _json_decoder.raw_decode
+        separator = _JSON_ITEM_SEPARATOR
+        self.peek()
+        while True:
+            # バッファ内で要素と区切りが揃っていればそのまま使い、チャンクの境目だけ読み足しながら読む
+            try:
+                value, end = decode(self.buffer, self.pos)
+                match = separator.match(self.buffer, end)
+            except json.JSONDecodeError:
+                match = None
+            if match is not None:
+                self.pos = match.end()
+                char = match.group(1)
+            else:
+                value = self.read_value()
+                char = self.peek()
+                self.expect(',' if char != ']' else ']')
+                if char == ',':
+                    self.peek()
+            yield value
+            if char == ']':
+                return
+
+
+def iter_json_events(stream, array_paths=STREAMED_ARRAY_PATHS):
+    """JSON文書を先頭から読み、(イベント, キーのパス, 値) を順に返す
+
+    array_pathsの配列は要素を1件ずつ 'item' として、そこへ至る途中のオブジェクトは
+    'start_map' / 'end_map' で囲んで中身を、それ以外の値は丸ごと 'value' として返す。
+    配列の前後には 'start_array' / 'end_array' を返す。
+    """
+    array_paths = frozenset(array_paths)
+    prefixes = {path[:i] for path in array_paths for i in range(len(path))}
+    return _iter_value_events(JsonStreamCursor(stream), (), array_paths, prefixes)
+
+
+def _iter_value_events(cursor, path, array_paths, prefixes):
+    char = cursor.peek()
+    if char == '[' and path in array_paths:
+        yield 'start_array', path, None
+        cursor.pos += 1
+        if cursor.peek() == ']':
+            cursor.pos += 1
+        else:
+            for item in cursor.read_items():
+                yield 'item', path, item
+        yield 'end_array', path, None
+    elif char == '{' and path in prefixes:
+        yield 'start_map', path, None
+        cursor.pos += 1
+        if cursor.peek() == '}':
+            cursor.pos += 1
+        else:
+            while True:
+                key = cursor.read_value()
+                cursor.expect(':')
+                yield from _iter_value_events(cursor, path + (key,), array_paths, prefixes)
+                char = cursor.peek()
+                cursor.expect(',' if char != '}' else '}')
+                if char == '}':
+                    break
+        yield 'end_map', path, None
+    else:
+        yield 'value', path, cursor.read_value()
+
+
+def read_json_metadata(stream, keys=FILE_METADATA_KEYS):
+    """ルート直下のkeysの値だけを取り出す（大きな配列は1件ずつ読み捨て、全て揃えばそこで止める）"""
+    found = {}
+    wanted = set(keys)
+    for event, path, value in iter_json_events(stream):
+        if event == 'value' and len(path) == 1 and path[0] in wanted:
+            found[path[0]] = value
+            if len(found) == len(wanted):
+                break
+    return {key: found[key] for key in keys if key in found}
+
+
+def read_resource_references(stream):
+    """resource_referencesと同じ結果を、ValueSetのcompose.include/excludeを1件ずつ読みながら作る
+
+    StructureDefinitionはストリーミングの対象にしないため、ValueSetの参照だけを集める。
+    """
+    root = {}
+    entries = {'include': [], 'exclude': []}
+    for event, path, value in iter_json_events(stream):
+        if event == 'value' and len(path) == 1:
+            root[path[0]] = value
+        elif event == 'item' and path[0] == 'compose' and isinstance(value, dict):
+            entries[path[1]].append(value)
+    refs = []
+    if root.get('resourceType') == 'ValueSet':
+        for part in ('include', 'exclude'):
+            for entry in entries[part]:
+                if isinstance(entry.get('system'), str):
+                    refs.append((f"compose.{part}.system", entry['system'], entry.get('version')))
+                for value_set in entry.get('valueSet') or []:
+                    refs.append((f"compose.{part}.valueSet", *split_canonical(value_set)))
+    return {'url': root.get('url'), 'version': root.get('version'), 'refs': refs}
+
+
+class StreamedArray:
+    """ストリーミングで読んだ配列の代わりに文書へ置く要約
+
+    要素ごとのハッシュと自然キーだけを持ち、要素そのものは差分のあるものだけを後から読み直す。
+    ハッシュはvalue_fingerprintと同じくmarshalから作るため、キー順だけが異なる要素は
+    変更ありとして読み直し、元の値の比較で差分なしになる。
+    referenceに旧バージョンの同じ配列を渡すと、それにない内容の要素だけは読み直さずに済むよう保持する。
+    """
+
+    def __init__(self, package, filename, path, reference=None):
+        self.package = package
+        self.filename = filename
+        self.path = path
+        self.digests = []
+        self.all_dicts = True
+        # 自然キーの項目 -> 要素ごとのキーのハッシュ（先頭の項目を持たない要素があればNone）
+        self.keys = {fields: [] for fields in JSON_ARRAY_NATURAL_KEYS}
+        self._fingerprint = hashlib.blake2b(digest_size=16)
+        self.known_digests = set(reference.digests) if reference is not None else None
+        # 要素の番号 -> referenceにない内容の要素
+        self.kept_items = {}
+
+    def add(self, item):
+        digest = hashlib.blake2b(marshal.dumps(item), digest_size=16).digest()
+        if self.known_digests is not None and digest not in self.known_digests:
+            self.kept_items[len(self.digests)] = item
+        self.digests.append(digest)
+        self._fingerprint.update(digest)
+        if not isinstance(item, dict):
+            self.all_dicts = False
+            return
+        for fields, keys in self.keys.items():
+            if keys is not None:
+                if fields[0] in item:
+                    key = '\0'.join(part for pair in _natural_key(item, fields) for part in pair)
+                    keys.append(hashlib.blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=16).digest())
+                else:
+                    self.keys[fields] = None
+
+    def __len__(self):
+        return len(self.digests)
+
+    def __eq__(self, other):
+        if not isinstance(other, StreamedArray):
+            return NotImplemented
+        return len(self) == len(other) and self._fingerprint.digest() == other._fingerprint.digest()
+
+    def __hash__(self):
+        return hash(self._fingerprint.digest())
+
+    def summary(self):
+        return f"変更なし（{len(self):,} 件の要素、ストリーミング比較のため表示省略）"
+
+
+def _streamed_natural_keys(v1_array, v2_array):
+    """_natural_keysと同じ規則で、要約に記録したキーから両配列の自然キーを選ぶ"""
+    if not (len(v1_array) or len(v2_array)) or not (v1_array.all_dicts and v2_array.all_dicts):
+        return None
+    for fields in JSON_ARRAY_NATURAL_KEYS:
+        v1_keys = v1_array.keys[fields]
+        v2_keys = v2_array.keys[fields]
+        if v1_keys is None or v2_keys is None:
+            continue
+        if len(set(v1_keys)) == len(v1_keys) and len(set(v2_keys)) == len(v2_keys):
+            return fields, v1_keys, v2_keys
+    return None
+
+
+def summarize_streamed(value):
+    """文書中の要約を表示用の文字列に置き換える"""
+    if isinstance(value, StreamedArray):
+        return value.summary()
+    if isinstance(value, dict):
+        return {k: summarize_streamed(v) for k, v in value.items()}
+    return value
+
+
+def share_equal_values(element, shared):
+    """要素dictの値のうち、sharedに登録済みの等しい値は同じオブジェクトに置き換えたdictを返す"""
+    result = {}
+    for name, value in element.items():
+        result[name] = shared.setdefault((name, marshal.dumps(value)), value)
+    return result
+
+
+def compare_file_worker(v1_path, v2_path, codec_name, options, task):
+    """プロセスプールのワーカー: 1ファイル分のパースと差分計算を行う
+
+    optionsは比較器に渡す差分計算の設定（json_diff_mode・attributes）。
+    StructureDefinitionの変更なし・移動の行は、表に表示する列の値だけに絞った要素dictを返す。
+    要素dictの等しい値（ele-1の制約やmappingなど多くの要素で同じもの）と、その他のリソースの
+    変更なしの行の旧・新の値は同じオブジェクトを共有させ、pickle時に1回分しか転送されないようにする。
+    """
+    filename, v1_data, v2_data = task
+    use_json_codec(codec_name)
+    sources = {
+        'v1': MemoryPackageSource({filename: v1_data} if v1_data is not None else {}),
+        'v2': MemoryPackageSource({filename: v2_data} if v2_data is not None else {}),
+    }
+    comparator = StructureDefinitionElementComparator(v1_path, v2_path, sources=sources, **options)
+    diffs, _ = comparator.compute_file_diff(filename)
+    columns = comparator.table_columns(filename)
+    shared = {}
+    for diff in diffs:
+        if 'v1_element' not in diff:
+            if diff['type'] == 'unchanged':
+                diff['v2'] = diff['v1']
+        elif diff['type'] in ('unchanged', 'moved'):
+            if diff['v1_element'] is not None:
+                element = diff['v1_element']
+                diff['v1_element'] = diff['v2_element'] = share_equal_values(
+                    {name: element[name] for name in columns if name in element}, shared)
+        else:
+            for side in ('v1_element', 'v2_element'):
+                if diff[side] is not None:
+                    diff[side] = share_equal_values(diff[side], shared)
+    # 影響範囲の索引のため、メインプロセスでファイルを読み直さずに済むよう参照情報も返す
+    references = {}
+    if filename.startswith(REFERENCING_PREFIXES):
+        for package in ('v1', 'v2'):
+            key = comparator.document_key(package, filename)
+            if key in comparator.references:
+                references[package] = comparator.references[key]
+            elif comparator.documents.get(key) is not None:
+                references[package] = resource_references(comparator.documents[key])
+    return {
+        'differences': diffs,
+        'references': references,
+        'metadata': comparator.get_file_metadata(filename),
+        'attributes': sorted(comparator.file_attributes.get(filename, ())),
+        'parse_count': comparator.parse_count,
+        'counters': dict(comparator.stats.counters),
+    }
+
+
+def copy_stream(source, destination, size, chunk_size=1024 * 1024):
+    """sourceの現在位置からsizeバイトをdestinationへ写す"""
+    while size > 0:
+        chunk = source.read(min(size, chunk_size))
+        if not chunk:
+            break
+        destination.write(chunk)
+        size -= len(chunk)
+
+
+def task_size(task):
+    """ワーカーへ渡すタスクが保持するバイト数"""
+    _, v1_data, v2_data = task
+    return len(v1_data or b'') + len(v2_data or b'')
+
+
+def render_page_worker(v1_path, v2_path, codec_name, options, payload):
+    """プロセスプールのワーカー: 分割出力の1ページ分のHTMLを生成して書き出す
+
+    表の列と「snapshotのみ変更」のバッジに使う情報はpayloadで受け取り、パッケージは読まない。
+    """
+    task, file_attributes, snapshot_only = payload
+    use_json_codec(codec_name)
+    sources = {'v1': MemoryPackageSource({}), 'v2': MemoryPackageSource({})}
+    comparator = StructureDefinitionElementComparator(v1_path, v2_path, sources=sources, **options)
+    comparator.file_attributes.update(file_attributes)
+    comparator.snapshot_only_changes.update(snapshot_only)
+    comparator.write_page(*task)
+    return dict(comparator.stats.counters)
+
+
+class StructureDefinitionElementComparator:
+    def __init__(self, v1_path, v2_path, diff_cache=None, jobs=1, sources=None,
+                 diff_engine='patience', diff_max_lines=DEFAULT_DIFF_MAX_LINES, json_diff_mode='structural',
+                 reader=None, differential_first=False, selector=None, attributes=None,
+                 stream_threshold=DEFAULT_STREAM_THRESHOLD_MB * 1024 * 1024):
+        self.v1_path = Path(v1_path)
+        self.v2_path = Path(v2_path)
+        # 対象ファイルの絞り込み（読み出し元の一覧の段階で適用する）
+        self.selector = selector
+        if sources is None:
+            sources = {
+                'v1': open_package_source(self.v1_path, selector),
+                'v2': open_package_source(self.v2_path, selector),
+            }
+        self.sources = sources
+        # 比較・表示するElementDefinitionの属性（Noneなら全て）
+        self.attributes = frozenset(attributes) if attributes else None
+        self.reader = reader if reader is not None else PrefetchReader()
+        self.jobs = jobs
+        self.diff_engine = diff_engine
+        self.diff_max_lines = diff_max_lines
+        self.json_diff_mode = json_diff_mode
+        # このバイト数以上のStructureDefinition以外のファイルは文書全体を読み込まずに比較する（0で無効）
+        self.stream_threshold = stream_threshold
+        # Trueならdifferentialとベースの比較で変更のないプロファイルの要素比較を省略する
+        self.differential_first = differential_first
+        # differential・ベースが同じでsnapshotが同じため要素比較を省略したファイル
+        self.differential_skipped = set()
+        # differential・ベースが同じなのにsnapshotだけ異なるファイル -> 確かめられなかったパッケージ外のベースのURL
+        # （Noneならベースも変わっておらず、生成ツール由来の差分の可能性がある）
+        self.snapshot_only_changes = {}
+        # ファイル名 -> {要素キー: ElementRecord}
+        self.v1_elements = {}
+        self.v2_elements = {}
+        # 属性名の組み合わせ -> (共有するタプル, ハッシュを詰めるStruct)
+        self.attribute_name_sets = {}
+        # パース後に文書を解放したファイルのメタ情報
+        self.file_metadata = {}
+        # 新バージョンの要素を次の比較で旧バージョンとして使う場合はFalseにする
+        self.release_new_elements = True
+        # 表示用にシリアライズした値（id -> (値, 文字列)）。表の1行を出力するごとに破棄する
+        self.serialized_values = {}
+        # フェーズごとの所要時間と処理件数
+        self.stats = RunStats()
+        # (読み出し元, ファイル名) -> リソースのurl・versionと参照しているcanonical URL
+        self.references = {}
+        # 参照情報を差分キャッシュに保存済みのキー
+        self.cached_references = set()
+        # ファイルごとに出現する属性名（両バージョンの和集合）
+        self.file_attributes = defaultdict(set)
+        # (読み出し元, ファイル名) をキーにしたパース済みJSONのキャッシュ
+        # 読み出し元をキーにするため、複数の比較で同じバージョンを共有できる
+        self.documents = {}
+        self.document_errors = {}
+        self.parse_count = 0
+        # 両バージョンでバイト単位に同一なファイル（パースせずに変更なし扱い）
+        self.identical_files = set()
+        self.file_digests = {}
+        # 永続キャッシュから復元、または並列ワーカーで計算済みの差分結果とメタ情報
+        self.diff_cache = diff_cache
+        self.precomputed_results = {}
+        self.precomputed_metadata = {}
+
+    def close(self):
+        for source in self.sources.values():
+            source.close()
+        if self.diff_cache is not None:
+            self.diff_cache.close()
+
+    def document_key(self, package, filename):
+        return (self.sources[package], filename)
+
+    def get_document(self, package, filename):
+        """JSONファイルを1回だけパースし、以降はキャッシュから返す（存在しない・パース失敗時はNone）"""
+        key = self.document_key(package, filename)
+        if key in self.documents:
+            return self.documents[key]
+        source = self.sources[package]
+        if not source.exists(filename):
+            self.documents[key] = None
+            return None
+        try:
+            content = source.read(filename)
+        except Exception as e:
+            return self.load_document(package, filename, None, e)
+        return self.load_document(package, filename, content)
+
+    def load_document(self, package, filename, content, error=None):
+        """読み出したバイト列をパースしてキャッシュに入れる（読み出しに失敗した場合はerrorを記録）"""
+        key = self.document_key(package, filename)
+        self.parse_count += 1
+        data = None
+        if error is None:
+            self.stats.counters['bytes_read'] += len(content)
+            try:
+                data = json_codec.loads(content)
+            except Exception as e:
+                error = e
+        if error is not None:
+            self.document_errors[key] = error
+        self.documents[key] = data
+        return data
+
+    def get_file_digest(self, package, filename):
+        """ファイル内容のダイジェストを1回だけ計算して返す"""
+        key = self.document_key(package, filename)
+        if key not in self.file_digests:
+            self.file_digests[key] = file_digest(self.sources[package], filename)
+            self.stats.counters['bytes_hashed'] += self.sources[package].size(filename)
+        return self.file_digests[key]
+
+    def compute_digests(self, package, filenames):
+        """未計算のファイルのダイジェストを、先読みしながら読み出し元に効率の良い順序でまとめて計算する"""
+        source = self.sources[package]
+        pending = [name for name in source.order(filenames)
+                   if self.document_key(package, name) not in self.file_digests]
+        # ストリーミング対象の大きなファイルは全体を読み込まず、チャンク単位でハッシュする
+        for filename in [name for name in pending if self.is_streamed(name)]:
+            self.get_file_digest(package, filename)
+        pending = [name for name in pending if self.document_key(package, name) not in self.file_digests]
+        for filename, digest, error in self.reader.read_files(source, pending, process=sha256_digest):
+            if error is not None:
+                raise error
+            self.file_digests[self.document_key(package, filename)] = digest
+            self.stats.counters['bytes_hashed'] += source.size(filename)
+
+    def find_identical_files(self):
+        """サイズ→ダイジェストの順に比較し、内容が同一のファイルをパース前に特定"""
+        v1_source = self.sources['v1']
+        v2_source = self.sources['v2']
+        common = set(v1_source.list_files('*.json')) & set(v2_source.list_files('*.json'))
+        candidates = [name for name in common if v1_source.size(name) == v2_source.size(name)]
+        for package in self.sources:
+            self.compute_digests(package, candidates)
+        self.identical_files = {
+            name for name in candidates
+            if self.get_file_digest('v1', name) == self.get_file_digest('v2', name)
+        }
+        return self.identical_files
+
+    def diff_cache_key(self, filename):
+        """両バージョンのファイル内容ハッシュから差分キャッシュのキーを作る"""
+        kind = 'StructureDefinition' if filename.startswith('StructureDefinition-') else 'Other'
+        if kind == 'StructureDefinition' and self.differential_first:
+            # snapshotのみの変更かどうかも一緒に保存するため、通常の比較とは別のキーにする
+            kind = 'StructureDefinition+differential'
+        if kind != 'Other' and self.attributes is not None:
+            kind += ':' + ','.join(sorted(self.attributes))
+        if kind == 'Other' and self.is_streamed(filename):
+            # 変更のない配列を要約して保存するため、通常の比較とは別のキーにする
+            kind = 'Other+stream'
+        if kind.startswith('Other'):
+            # structuralとflatでは差分の行が異なるため、モードごとに別のキーにする
+            kind += ':' + self.json_diff_mode
+        digests = [
+            self.get_file_digest(package, filename) if self.sources[package].exists(filename) else '-'
+            for package in ('v1', 'v2')
+        ]
+        return DiffCache.make_key(kind, *digests)
+
+    def load_cached_results(self, filenames):
+        """差分キャッシュにヒットしたファイルはパースせずに結果を復元"""
+        for package, source in self.sources.items():
+            self.compute_digests(package, [f for f in filenames if source.exists(f)])
+        for filename in filenames:
+            entry = self.diff_cache.get(self.diff_cache_key(filename))
+            if entry is None:
+                continue
+            self.precomputed_results[filename] = entry['differences']
+            self.precomputed_metadata[filename] = entry['metadata']
+            self.file_attributes[filename].update(entry['attributes'])
+            if 'snapshot_only' in entry:
+                self.snapshot_only_changes[filename] = entry['snapshot_only']['external_base']
+            if entry.get('differential_skipped'):
+                self.differential_skipped.add(filename)
+
+    def store_cached_result(self, filename, differences):
+        if self.diff_cache is None:
+            return
+        entry = {
+            'differences': differences,
+            'metadata': self.get_file_metadata(filename),
+            'attributes': sorted(self.file_attributes.get(filename, ())),
+        }
+        if filename in self.snapshot_only_changes:
+            entry['snapshot_only'] = {'external_base': self.snapshot_only_changes[filename]}
+        if filename in self.differential_skipped:
+            entry['differential_skipped'] = True
+        self.diff_cache.put(self.diff_cache_key(filename), entry)
+
+    def preload_documents(self, package, filenames):
+        """未読込のファイルを読み出し元に効率の良い順序で先読みし、届いた順にパースする"""
+        source = self.sources[package]
+        pending = [name for name in filenames
+                   if self.document_key(package, name) not in self.documents and source.exists(name)]
+        for filename, content, error in self.reader.read_files(source, source.order(pending)):
+            self.load_document(package, filename, content, error)
+
+    def parse_structure_definition_elements(self, package, filename):
+        """StructureDefinitionファイルからelement配列を抽出し、要素キー -> ElementRecord で返す
+
+        抽出後は文書全体を保持せず、要素の元データだけをレコードに残す。
+        """
+        elements = self.load_raw_elements(package, filename)
+        name_sets = self.attribute_name_sets
+        records = {}
+        attributes = self.attributes
+        for key, element in elements.items():
+            if attributes is None:
+                names = tuple(sorted(element))
+            else:
+                names = tuple(sorted(name for name in element if name in attributes))
+            entry = name_sets.get(names)
+            if entry is None:
+                entry = name_sets[names] = (tuple(sys.intern(name) for name in names),
+                                            struct.Struct(f"{len(names)}q"))
+            shared, packer = entry
+            hashes = packer.pack(*[value_fingerprint(element[name]) for name in shared])
+            records[key] = ElementRecord(shared, hashes, element)
+        # このファイルに出現する属性を収集
+        attributes = self.file_attributes[filename]
+        for names in {record.names for record in records.values()}:
+            attributes.update(names)
+        return records
+
+    def load_raw_elements(self, package, filename):
+        """StructureDefinitionのelement配列を 要素キー -> ElementDefinition のdictで返す"""
+        data = self.get_document(package, filename)
+        key = self.document_key(package, filename)
+        error = self.document_errors.get(key)
+        if error is not None:
+            print(f"Error parsing {self.sources[package].describe(filename)}: {error}")
+            return {}
+        if data is None:
+            return {}
+        if package == self.metadata_package(filename):
+            self.file_metadata[filename] = self.get_file_metadata(filename)
+        # 要素とメタ情報を取り出したら文書全体は解放する
+        self.documents.pop(key, None)
+        
+        try:
+            elements = profile_elements(data)
+            # 用語の参照は要素を取り出したこの時点で記録し、影響範囲の索引作成で読み直さない
+            self.references[key] = resource_references(data, elements)
+            return elements
+        except Exception as e:
+            print(f"Error parsing {self.sources[package].describe(filename)}: {e}")
+            return {}
+
+    def materialize_elements(self, package, filename, records):
+        """元データを解放済みのレコードに、ファイルを読み直してElementDefinitionを戻す"""
+        for key, element in self.load_raw_elements(package, filename).items():
+            if key in records:
+                records[key].element = element
+
+    def release_unchanged_elements(self, filename):
+        """表示に使わない要素の元データを解放する
+
+        両バージョンで要素の並びと値が同じファイルは両方とも保持しない。
+        それ以外でも値の変わらない要素は旧バージョン側で表示するため、新バージョン側は保持しない。
+        """
+        v1_records = self.v1_elements.get(filename)
+        v2_records = self.v2_elements.get(filename)
+        if v1_records is None or v2_records is None:
+            return
+        unchanged = [
+            key for key, record in v1_records.items()
+            if key in v2_records and record.same_values(v2_records[key])
+        ]
+        if len(unchanged) == len(v1_records) == len(v2_records) and list(v1_records) == list(v2_records):
+            for record in v1_records.values():
+                record.element = None
+        if self.release_new_elements:
+            for key in unchanged:
+                v2_records[key].element = None
+    
+    def compare_files(self):
+        """両バージョンのStructureDefinitionファイルを比較"""
+        with self.stats.phase('identical_check'):
+            self.find_identical_files()
+        if self.diff_cache is not None:
+            with self.stats.phase('cache_lookup'):
+                changed_files = set()
+                for source in self.sources.values():
+                    changed_files.update(source.list_files('*.json'))
+                self.load_cached_results(sorted(changed_files - self.identical_files))
+        if self.differential_first:
+            with self.stats.phase('differential_check'):
+                self.check_differentials()
+        if self.jobs > 1:
+            with self.stats.phase('parallel_diff'):
+                self.compute_diffs_parallel()
+        with self.stats.phase('parse_profiles'):
+            skipped = self.identical_files | set(self.precomputed_results)
+            # 1.9.0のStructureDefinitionファイル一覧を取得（複数比較で共有する場合は読込済みのものを除く）
+            v1_files = [f for f in self.sources['v1'].list_files("StructureDefinition-*.json")
+                        if f not in skipped and f not in self.v1_elements]
+            self.preload_documents('v1', v1_files)
+            for filename in v1_files:
+                self.v1_elements[filename] = self.parse_structure_definition_elements('v1', filename)
+            
+            # 1.10.0のStructureDefinitionファイル一覧を取得
+            v2_files = [f for f in self.sources['v2'].list_files("StructureDefinition-*.json")
+                        if f not in skipped and f not in self.v2_elements]
+            self.preload_documents('v2', v2_files)
+            for filename in v2_files:
+                self.v2_elements[filename] = self.parse_structure_definition_elements('v2', filename)
+            for filename in v2_files:
+                self.release_unchanged_elements(filename)
+    
+    def check_differentials(self):
+        """differentialとベースのプロファイルを先に比較し、snapshotの要素比較が必要なファイルを絞り込む
+
+        両バージョンでdifferential・baseDefinition・fhirVersionが同じで、ベースのプロファイルも変わっていなければ
+        snapshotも変わらないはずなので、snapshotが同じなら要素比較を行わずに変更なしとする。
+        それでもsnapshotが異なるファイルは要素比較を行い、snapshot_only_changesに記録する。
+        ベースがパッケージ外（FHIRコア以外）で変更の有無を確かめられない場合は、そのURLを一緒に記録する。
+        """
+        skipped = self.identical_files | set(self.precomputed_results)
+        candidates = sorted(
+            set(self.sources['v1'].list_files("StructureDefinition-*.json"))
+            & set(self.sources['v2'].list_files("StructureDefinition-*.json")) - skipped
+        )
+        for package in ('v1', 'v2'):
+            self.preload_documents(package, candidates)
+        documents = {}
+        for filename in candidates:
+            v1_data = self.get_document('v1', filename)
+            v2_data = self.get_document('v2', filename)
+            if isinstance(v1_data, dict) and isinstance(v2_data, dict):
+                documents[filename] = (v1_data, v2_data)
+        # ベースのプロファイルをURLから引く（キャッシュから復元したファイルはメタ情報のURLを使う）
+        url_files = {data.get('url'): filename for filename, (_, data) in documents.items()}
+        for filename, meta in self.precomputed_metadata.items():
+            if filename.startswith('StructureDefinition-') and meta.get('url'):
+                url_files.setdefault(meta['url'], filename)
+        statuses = {}
+        identical_urls = []
+
+        def is_identical_profile(url):
+            """両バージョンで内容が同一のプロファイルのURLか（最初に必要になった時点でURLを集める）"""
+            if not identical_urls:
+                identical_urls.append(self.identical_profile_urls())
+            return url in identical_urls[0]
+
+        def definition_status(filename):
+            """differentialとベースが変わっていなければTrue、変わっていればFalse、
+            パッケージ外のベースのため確かめられなければそのベースのURLを返す"""
+            if filename not in statuses:
+                # 循環参照に備えて、判定中は変更なしとしておく
+                statuses[filename] = True
+                if filename in documents:
+                    v1_data, v2_data = documents[filename]
+                    base = v2_data.get('baseDefinition')
+                    if any(v1_data.get(k) != v2_data.get(k) for k in ('differential', 'baseDefinition', 'fhirVersion')):
+                        status = False
+                    elif not base or base.startswith(FHIR_CORE_PROFILE_PREFIX):
+                        status = True
+                    elif base in url_files:
+                        status = definition_status(url_files[base])
+                    elif is_identical_profile(base):
+                        # パッケージ内で両バージョン同一のベースは変わっていない
+                        status = True
+                    else:
+                        status = base
+                else:
+                    # キャッシュから復元したファイルは要素に変更がなければ変更なしとする
+                    status = not any(
+                        diff['type'] != 'unchanged' for diff in self.precomputed_results.get(filename, ())
+                    )
+                statuses[filename] = status
+            return statuses[filename]
+
+        for filename, (v1_data, v2_data) in documents.items():
+            status = definition_status(filename)
+            if status is False:
+                continue
+            # 同じsnapshotならdict同士の比較は最後まで辿るが、両方をダイジェスト化するより速い
+            if v1_data.get('snapshot') != v2_data.get('snapshot'):
+                self.snapshot_only_changes[filename] = None if status is True else status
+                continue
+            self.precomputed_metadata[filename] = self.get_file_metadata(filename)
+            self.precomputed_results[filename] = []
+            self.differential_skipped.add(filename)
+            self.store_cached_result(filename, [])
+            for package in ('v1', 'v2'):
+                self.release_document(package, filename)
+        if self.jobs > 1:
+            # 並列実行ではワーカーが読み直すため保持しない
+            for filename in documents:
+                for package in ('v1', 'v2'):
+                    self.release_document(package, filename)
+        self.stats.counters['profiles_skipped'] += len(self.differential_skipped)
+
+    def identical_profile_urls(self):
+        """両バージョンで内容が同一のStructureDefinitionのURLを返す（文書全体はパースせず、urlだけを読み出す）"""
+        source = self.sources['v2']
+        urls = set()
+        for filename in source.order(sorted(f for f in self.identical_files if f.startswith('StructureDefinition-'))):
+            try:
+                with source.open(filename) as stream:
+                    url = read_json_metadata(stream, ('url',)).get('url')
+            except Exception:
+                continue
+            if url:
+                urls.add(url)
+        return urls
+
+    def compute_diffs_parallel(self):
+        """未計算のファイルをプロセスプールでパース・差分計算する
+
+        ファイルの読み出しはメインプロセスで（アーカイブ順に）行い、両バージョンが揃ったファイルから
+        順にワーカーへ渡して、読み出しと差分計算を重ねる。ワーカーへ渡して結果を受け取っていないファイルは
+        jobsの2倍の件数かつ先読みのバイト数の上限（--read-ahead-mb）までとし、それを超える間は
+        最も古いファイルの結果を待ってから次を読む。
+        """
+        all_files = set()
+        for source in self.sources.values():
+            all_files.update(source.list_files('*.json'))
+        # ストリーミング対象のファイルはワーカーへ丸ごと渡さず、後でメインプロセスで比較する
+        pending = sorted(f for f in all_files - self.identical_files - set(self.precomputed_results)
+                         if not self.is_streamed(f))
+        if not pending:
+            return
+        options = {
+            'json_diff_mode': self.json_diff_mode,
+            'attributes': sorted(self.attributes) if self.attributes is not None else None,
+            'stream_threshold': self.stream_threshold,
+        }
+        worker = partial(compare_file_worker, str(self.v1_path), str(self.v2_path), json_codec.name, options)
+        window = self.jobs * 2
+        in_flight = deque()
+        in_flight_bytes = 0
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            for task in self.iter_file_pairs(pending):
+                in_flight.append((task, executor.submit(worker, task)))
+                in_flight_bytes += task_size(task)
+                while in_flight and (len(in_flight) >= window or in_flight_bytes > self.reader.max_bytes):
+                    task, future = in_flight.popleft()
+                    in_flight_bytes -= task_size(task)
+                    self.store_worker_result(task, future.result())
+            while in_flight:
+                task, future = in_flight.popleft()
+                self.store_worker_result(task, future.result())
+
+    def iter_file_pairs(self, filenames):
+        """(ファイル名, 旧バージョンの内容, 新バージョンの内容) を、両方が読めたファイルから順に生成する
+
+        両バージョンの読み出しを1件ずつ交互に進める。同じパッケージの別バージョンはアーカイブ内の
+        順序がほぼ同じため、片方だけ読めて待っているファイルは少数にとどまる。
+        """
+        readers = []
+        needed = defaultdict(int)
+        for package, source in self.sources.items():
+            files = source.order([f for f in filenames if source.exists(f)])
+            for filename in files:
+                needed[filename] += 1
+            readers.append((package, self.reader.read_files(source, files)))
+        waiting = {}
+        while readers:
+            for reader in list(readers):
+                package, files = reader
+                item = next(files, None)
+                if item is None:
+                    readers.remove(reader)
+                    continue
+                filename, content, error = item
+                if error is not None:
+                    raise error
+                contents = waiting.setdefault(filename, {})
+                contents[package] = content
+                if len(contents) == needed[filename]:
+                    del waiting[filename]
+                    yield filename, contents.get('v1'), contents.get('v2')
+
+    def store_worker_result(self, task, result):
+        """ワーカーの差分計算の結果を取り込み、差分キャッシュに保存する"""
+        filename = task[0]
+        for package, references in result['references'].items():
+            self.references.setdefault(self.document_key(package, filename), references)
+        self.parse_count += result['parse_count']
+        self.stats.merge(result['counters'])
+        self.precomputed_results[filename] = result['differences']
+        self.precomputed_metadata[filename] = result['metadata']
+        self.file_attributes[filename].update(result['attributes'])
+        self.store_cached_result(filename, result['differences'])
+
+    def compute_file_diff(self, filename):
+        """1ファイル分の差分を計算し (差分, 種別) を返す"""
+        self.stats.counters['files_diffed'] += 1
+        if filename.startswith('StructureDefinition-'):
+            for package, elements in (('v1', self.v1_elements), ('v2', self.v2_elements)):
+                if filename not in elements and self.sources[package].exists(filename):
+                    elements[filename] = self.parse_structure_definition_elements(package, filename)
+            return self.analyze_element_differences(filename), 'StructureDefinition'
+        if self.is_streamed(filename):
+            return self.json_diff_streamed(filename), 'Other'
+        v1_json = self.load_json('v1', filename)
+        v2_json = self.load_json('v2', filename)
+        if self.json_diff_mode == 'flat':
+            return self.json_diff_flat(v1_json, v2_json), 'Other'
+        return self.json_diff_structural(v1_json, v2_json), 'Other'
+
+    def refresh_file(self, filename):
+        """更新されたファイルの読込結果を破棄して差分を計算し直し、(差分, 種別) を返す
+
+        両バージョンで内容が同一、またはどちらにも存在しない場合はNoneを返す。
+        """
+        for package in ('v1', 'v2'):
+            key = self.document_key(package, filename)
+            self.documents.pop(key, None)
+            self.document_errors.pop(key, None)
+            self.file_digests.pop(key, None)
+            self.references.pop(key, None)
+            self.cached_references.discard(key)
+        for store in (self.v1_elements, self.v2_elements, self.file_attributes, self.file_metadata,
+                      self.precomputed_results, self.precomputed_metadata):
+            store.pop(filename, None)
+        self.identical_files.discard(filename)
+        v1_source = self.sources['v1']
+        v2_source = self.sources['v2']
+        if not v1_source.exists(filename) and not v2_source.exists(filename):
+            return None
+        if (v1_source.exists(filename) and v2_source.exists(filename)
+                and v1_source.size(filename) == v2_source.size(filename)
+                and self.get_file_digest('v1', filename) == self.get_file_digest('v2', filename)):
+            self.identical_files.add(filename)
+            return None
+        filetype = 'StructureDefinition' if filename.startswith('StructureDefinition-') else 'Other'
+        if self.diff_cache is not None:
+            self.load_cached_results([filename])
+            if filename in self.precomputed_results:
+                return self.precomputed_results[filename], filetype
+        diffs, filetype = self.compute_file_diff(filename)
+        self.store_cached_result(filename, diffs)
+        return diffs, filetype
+
+    def analyze_element_differences(self, filename):
+        """特定のファイルのelement差分を分析
+
+        両バージョンのsnapshot順にマージしながら1回だけ走査する。
+        両方に存在するが相対順序の変わった要素は移動（moved）として扱う。
+        値の比較は属性ごとのハッシュで行い、元のElementDefinitionは差分のあるファイルでのみ参照する。
+        """
+        v1_elements = self.v1_elements.get(filename, {})
+        v2_elements = self.v2_elements.get(filename, {})
+        # ハッシュの異なる要素は元の値で確かめるため、解放済みなら読み直す
+        for package, records, others in (('v1', v1_elements, v2_elements), ('v2', v2_elements, v1_elements)):
+            if any(record.element is None and key in others and not record.same_values(others[key])
+                   for key, record in records.items()):
+                self.materialize_elements(package, filename, records)
+        v1_keys = list(v1_elements)
+        v2_keys = list(v2_elements)
+        v1_positions = {key: i for i, key in enumerate(v1_keys)}
+        v2_positions = {key: j for j, key in enumerate(v2_keys)}
+        differences = []
+        done = set()
+        i = j = 0
+        
+        while i < len(v1_keys) or j < len(v2_keys):
+            if i < len(v1_keys) and v1_keys[i] in done:
+                i += 1
+                continue
+            if j < len(v2_keys) and v2_keys[j] in done:
+                j += 1
+                continue
+            v1_key = v1_keys[i] if i < len(v1_keys) else None
+            v2_key = v2_keys[j] if j < len(v2_keys) else None
+            
+            if v1_key is not None and v1_key == v2_key:
+                differences.append(self.compare_elements(v1_key, v1_elements[v1_key], v2_elements[v2_key], moved=False))
+                done.add(v1_key)
+                i += 1
+                j += 1
+            elif v1_key is not None and v1_key not in v2_positions:
+                # 削除
+                differences.append({
+                    'path': v1_key,
+                    'type': 'removed',
+                    'v1_element': v1_elements[v1_key],
+                    'v2_element': None
+                })
+                i += 1
+            elif v2_key is not None and v2_key not in v1_positions:
+                # 新規追加
+                differences.append({
+                    'path': v2_key,
+                    'type': 'added',
+                    'v1_element': None,
+                    'v2_element': v2_elements[v2_key]
+                })
+                j += 1
+            elif v2_positions[v1_key] - j > v1_positions[v2_key] - i:
+                # 旧側の要素の方が大きく離れた位置へ移動している
+                differences.append(self.compare_elements(v1_key, v1_elements[v1_key], v2_elements[v1_key], moved=True))
+                done.add(v1_key)
+                i += 1
+            else:
+                differences.append(self.compare_elements(v2_key, v1_elements[v2_key], v2_elements[v2_key], moved=True))
+                done.add(v2_key)
+                j += 1
+        
+        self.stats.counters['elements_compared'] += len(differences)
+        return self.resolve_element_rows(filename, differences)
+
+    def resolve_element_rows(self, filename, differences):
+        """差分行のElementRecordを表示用のElementDefinitionに置き換える
+
+        差分のないファイルでは元データを持たせず、差分のあるファイルでは解放済みなら読み直す。
+        変更なしの行は旧・新で同じdictを共有する。
+        """
+        changed = any(diff['type'] != 'unchanged' for diff in differences)
+        if not changed:
+            for diff in differences:
+                diff['v1_element'] = diff['v2_element'] = None
+            return differences
+        # 旧バージョンは全行、新バージョンは値の変わった行（追加・変更）で元データを使う
+        missing = set()
+        for diff in differences:
+            if diff['v1_element'] is not None and diff['v1_element'].element is None:
+                missing.add('v1')
+            if diff['type'] in ('added', 'modified') and diff['v2_element'].element is None:
+                missing.add('v2')
+        for package, elements in (('v1', self.v1_elements), ('v2', self.v2_elements)):
+            if package in missing:
+                self.materialize_elements(package, filename, elements[filename])
+        for diff in differences:
+            v1_record = diff['v1_element']
+            v2_record = diff['v2_element']
+            diff['v1_element'] = v1_record.element if v1_record is not None else None
+            if diff['type'] in ('unchanged', 'moved'):
+                diff['v2_element'] = diff['v1_element']
+            else:
+                diff['v2_element'] = v2_record.element if v2_record is not None else None
+            for attribute in diff.get('changed_attributes', ()):
+                attribute['v1_value'] = diff['v1_element'].get(attribute['attribute'])
+                attribute['v2_value'] = diff['v2_element'].get(attribute['attribute'])
+        return differences
+
+    def compare_elements(self, key, v1_record, v2_record, moved):
+        """両バージョンに存在する1要素の属性を比較
+
+        ハッシュが一致する属性は値をたどらずに同一とみなし、一致しない属性だけ元の値を比較する。
+        """
+        changed_attributes = []
+        if not v1_record.same_values(v2_record):
+            v1_hashes = v1_record.attribute_hashes()
+            v2_hashes = v2_record.attribute_hashes()
+            for attr in v1_hashes.keys() | v2_hashes.keys():
+                if (v1_hashes.get(attr) != v2_hashes.get(attr)
+                        and v1_record.element.get(attr) != v2_record.element.get(attr)):
+                    changed_attributes.append({
+                        'attribute': attr,
+                        'v1_value': None,
+                        'v2_value': None
+                    })
+        
+        if changed_attributes:
+            return {
+                'path': key,
+                'type': 'modified',
+                'moved': moved,
+                'v1_element': v1_record,
+                'v2_element': v2_record,
+                'changed_attributes': changed_attributes
+            }
+        # 変更なし（順序のみ変わった場合は移動）
+        return {
+            'path': key,
+            'type': 'moved' if moved else 'unchanged',
+            'v1_element': v1_record,
+            'v2_element': v2_record
+        }
+    
+    def serialize_value(self, value):
+        """dict/listを表示用のJSON文字列にする
+
+        同じ値オブジェクトはセル表示・行数判定・差分表示で使い回し、1回だけシリアライズする。
+        値への参照も保持するため、idが別の値に再利用されることはない。
+        """
+        cached = self.serialized_values.get(id(value))
+        if cached is None or cached[0] is not value:
+            cached = (value, json_codec.dumps_indent(value))
+            self.serialized_values[id(value)] = cached
+        return cached[1]
+
+    def format_value(self, value):
+        """値をHTML表示用にフォーマット"""
+        if value is None:
+            return '<span class="no-value">-</span>'
+        elif isinstance(value, (dict, list)):
+            return f'<pre class="complex-value">{self.serialize_value(value)}</pre>'
+        else:
+            return str(value)
+    
+    def format_unchanged_value(self, value):
+        """変更なしの値を表示用にフォーマット（diff_max_linesを超える大きな値は省略）"""
+        if self.diff_max_lines and isinstance(value, (dict, list)):
+            line_count = self.serialize_value(value).count('\n') + 1
+            if line_count > self.diff_max_lines:
+                return f'<span class="no-value">変更なし（{line_count} 行、表示省略）</span>'
+        return self.format_value(value)
+
+    def html_diff(self, old, new):
+        self.stats.counters['cells_diffed'] += 1
+        # old/newがdictやlistなら整形
+        if isinstance(old, (dict, list)):
+            old = self.serialize_value(old)
+        if isinstance(new, (dict, list)):
+            new = self.serialize_value(new)
+        old_lines = str(old).splitlines()
+        new_lines = str(new).splitlines()
+        if self.diff_max_lines and len(old_lines) + len(new_lines) > self.diff_max_lines:
+            # 大きな値は行数のみ要約表示する
+            ops = patience_diff_lines(old_lines, new_lines)
+            added = sum(1 for tag, _ in ops if tag == '+')
+            removed = sum(1 for tag, _ in ops if tag == '-')
+            return f'<div class="diff-summary">差分が大きいため要約表示: +{added} / −{removed} 行</div>'
+        parts = []
+        for tag, line in LINE_DIFF_ENGINES[self.diff_engine](old_lines, new_lines):
+            if tag == '+':
+                parts.append(f'<div class="diff-added">+ {line}</div>')
+            elif tag == '-':
+                parts.append(f'<div class="diff-removed">- {line}</div>')
+            else:
+                parts.append(f'<div>{line}</div>')
+        return ''.join(parts)
+
+    def get_file_metadata(self, filename):
+        """StructureDefinitionファイルのメタ情報をdictで返す（新バージョン優先）"""
+        if filename in self.precomputed_metadata:
+            return self.precomputed_metadata[filename]
+        if filename in self.file_metadata:
+            return self.file_metadata[filename]
+        package = self.metadata_package(filename)
+        if self.is_streamed(filename):
+            return self.read_streamed_metadata(package, filename)
+        data = self.get_document(package, filename)
+        error = self.document_errors.get(self.document_key(package, filename))
+        if error is not None:
+            return {'error': str(error)}
+        if data is None:
+            return {}
+        try:
+            return {k: data.get(k) for k in FILE_METADATA_KEYS if k in data}
+        except Exception as e:
+            return {'error': str(e)}
+
+    def metadata_package(self, filename):
+        return 'v2' if self.sources['v2'].exists(filename) else 'v1'
+
+    def read_streamed_metadata(self, package, filename):
+        """ストリーミング対象のファイルのメタ情報を、文書全体を読み込まずに取り出す"""
+        error = self.document_errors.get(self.document_key(package, filename))
+        if error is None and self.sources[package].exists(filename):
+            try:
+                with self.sources[package].open(filename) as stream:
+                    self.file_metadata[filename] = read_json_metadata(stream)
+            except Exception as e:
+                error = e
+        if error is not None:
+            return {'error': str(error)}
+        return self.file_metadata.get(filename, {})
+
+    def load_references(self, package, filenames):
+        """ファイルごとの参照情報を揃える
+
+        パース済みの文書、もう一方のバージョンの同一ファイル、差分キャッシュの順に使い、
+        どれにもないファイルだけを先読みしながら読み直す。キャッシュにないものは保存しておく。
+        """
+        source = self.sources[package]
+        other = 'v1' if package == 'v2' else 'v2'
+        pending = []
+        for filename in filenames:
+            key = self.document_key(package, filename)
+            if key not in self.references:
+                other_key = self.document_key(other, filename)
+                if filename in self.identical_files and other_key in self.references:
+                    self.references[key] = self.references[other_key]
+                elif self.documents.get(key) is not None:
+                    self.references[key] = resource_references(self.documents[key])
+                elif self.is_streamed(filename):
+                    self.references[key] = self.read_streamed_references(package, filename)
+                elif self.diff_cache is not None:
+                    cached = self.diff_cache.get(self.references_cache_key(package, filename), count=False)
+                    if cached is None:
+                        pending.append(filename)
+                        continue
+                    self.references[key] = cached
+                    self.cached_references.add(key)
+                else:
+                    pending.append(filename)
+                    continue
+            if self.diff_cache is not None and key not in self.cached_references:
+                self.diff_cache.put(self.references_cache_key(package, filename), self.references[key])
+                self.cached_references.add(key)
+        for filename, content, error in self.reader.read_files(source, source.order(pending)):
+            data = None
+            if error is None:
+                self.parse_count += 1
+                self.stats.counters['bytes_read'] += len(content)
+                try:
+                    data = json_codec.loads(content)
+                except Exception:
+                    pass
+            key = self.document_key(package, filename)
+            self.references[key] = resource_references(data)
+            if self.diff_cache is not None:
+                self.diff_cache.put(self.references_cache_key(package, filename), self.references[key])
+                self.cached_references.add(key)
+
+    def read_streamed_references(self, package, filename):
+        try:
+            with self.sources[package].open(filename) as stream:
+                return read_resource_references(stream)
+        except Exception:
+            return resource_references(None)
+
+    def references_cache_key(self, package, filename):
+        return DiffCache.make_key('References', self.get_file_digest(package, filename), '-')
+
+    def build_reference_index(self):
+        """両バージョンのStructureDefinition・ValueSetから、参照先のURL -> 参照元 の逆引き索引を作る
+
+        参照元は {'file', 'location', 'version', 'packages', 'source_url', 'source_version'} で、
+        packagesはその参照があるバージョン（'v1'・'v2'）の集合。
+        """
+        entries = {}
+        for package in ('v2', 'v1'):
+            source = self.sources[package]
+            files = [f for f in source.list_files('*.json') if f.startswith(REFERENCING_PREFIXES)]
+            self.load_references(package, files)
+            for filename in files:
+                references = self.references[self.document_key(package, filename)]
+                for location, url, version in references['refs']:
+                    entry = entries.get((url, filename, location, version))
+                    if entry is None:
+                        entry = entries[(url, filename, location, version)] = {
+                            'file': filename,
+                            'location': location,
+                            'version': version,
+                            'packages': set(),
+                            'source_url': references['url'],
+                            'source_version': references['version'],
+                        }
+                    entry['packages'].add(package)
+        index = defaultdict(list)
+        for (url, _, _, _), entry in entries.items():
+            index[url].append(entry)
+        return index
+
+    def find_impacts(self, modified_files):
+        """変更のあったValueSet・CodeSystemごとに、それを参照する要素・リソースを索引から引く
+
+        ValueSetから参照されている場合は、そのValueSetの参照元もたどる（viaに経由したValueSetのURL）。
+        ファイル名 -> [(参照元, via)] を返す。
+        """
+        targets = [filename for filename, _, _ in modified_files if filename.startswith(TERMINOLOGY_PREFIXES)]
+        if not targets:
+            return {}
+        index = self.build_reference_index()
+        impacts = {}
+        for filename in targets:
+            meta = self.get_file_metadata(filename)
+            if not meta.get('url'):
+                continue
+            found = []
+            seen_refs = set()
+            pending = [(meta['url'], meta.get('version'), None)]
+            seen_urls = {meta['url']}
+            while pending:
+                url, version, via = pending.pop(0)
+                for ref in index.get(url, ()):
+                    if ref['version'] and version and ref['version'] != version:
+                        continue
+                    if (ref['file'], ref['location']) in seen_refs:
+                        continue
+                    seen_refs.add((ref['file'], ref['location']))
+                    found.append((ref, via))
+                    source_url = ref['source_url']
+                    if ref['file'].startswith('ValueSet-') and source_url and source_url not in seen_urls:
+                        seen_urls.add(source_url)
+                        pending.append((source_url, ref['source_version'], source_url))
+            if found:
+                impacts[filename] = found
+        return impacts
+
+    def get_impact_html(self, impacts, file_links):
+        """変更された用語を参照する要素・リソースの一覧をHTMLで返す
+
+        file_linksはレポート内にあるファイルのファイル名 -> リンク先で、該当するファイルはリンクする。
+        """
+        profiles = sorted({ref['file'] for ref, _ in impacts if ref['file'].startswith('StructureDefinition-')})
+        parts = [f'<div class="impact-list"><strong>影響を受ける参照元: {len(impacts)}件'
+                 f'（プロファイル {len(profiles)}件）</strong><ul>']
+        for ref, via in sorted(impacts, key=lambda item: (item[0]['file'], item[0]['location'])):
+            name = ref['file']
+            if name in file_links:
+                name = f'<a href="{file_links[name]}">{name}</a>'
+            notes = []
+            if ref['version']:
+                notes.append(f"version {ref['version']}")
+            if via:
+                notes.append(f"経由: {via}")
+            if ref['packages'] == {'v1'}:
+                notes.append("旧バージョンのみ")
+            elif ref['packages'] == {'v2'}:
+                notes.append("新バージョンのみ")
+            note_html = f' <span class="impact-note">（{"、".join(notes)}）</span>' if notes else ''
+            parts.append(f'<li>{name} <code>{ref["location"]}</code>{note_html}</li>')
+        parts.append('</ul></div>')
+        return ''.join(parts)
+
+    def get_file_metadata_html(self, meta):
+        """メタ情報をHTMLテーブルで返す"""
+        if not meta:
+            return '<div>メタ情報なし</div>'
+        parts = ['<table style="border-collapse:collapse;">']
+        for k, v in meta.items():
+            parts.append(f'<tr><th style="text-align:left;padding:2px 8px;background:#f8f9fa;">{k}</th><td style="padding:2px 8px;">{self.format_value(v)}</td></tr>')
+        parts.append('</table>')
+        return ''.join(parts)
+
+    def get_differential_summary_html(self):
+        """differential優先モードの結果をサマリー用のHTMLで返す（モード未使用時は空）"""
+        if not self.differential_first:
+            return ''
+        external = sum(1 for base in self.snapshot_only_changes.values() if base is not None)
+        return (f"\n<p>differentialが同じで要素比較を省略したプロファイル数: {len(self.differential_skipped)}</p>"
+                f"\n<p>differentialが同じなのにsnapshotが異なるプロファイル数: {len(self.snapshot_only_changes)}"
+                f"（うちパッケージ外のベースによるもの {external}）</p>")
+
+    def get_script_source_html(self):
+        """このスクリプト自身のソースをHTMLで返す"""
+        try:
+            with open(__file__, 'r', encoding='utf-8') as f:
+                code = f.read()
+            return f'<pre style="max-height:400px;overflow-y:auto;background:#222;color:#eee;padding:10px;border-radius:6px;">{code}</pre>'
+        except Exception:
+            return '<div>スクリプトソース取得不可</div>'
+
+    def collect_modified_files(self):
+        """差分のあるファイルを (ファイル名, 差分, 種別) のリストで返す"""
+        modified_files = []
+        files = self.iter_modified_files()
+        total_files = next(files)
+        modified_files.extend(files)
+        return modified_files, total_files
+
+    def iter_modified_files(self):
+        """差分のあるファイルを (ファイル名, 差分, 種別) として1件ずつ生成する
+
+        最初の1件目だけは比較対象の総ファイル数を返す。
+        """
+        # 統計情報を計算
+        # StructureDefinition以外も含めて全JSONファイルを対象にする
+        all_files = set()
+        for package, source in self.sources.items():
+            files = source.list_files('*.json')
+            all_files.update(files)
+            self.preload_documents(package, [
+                f for f in files
+                if not f.startswith('StructureDefinition-')
+                and f not in self.identical_files and f not in self.precomputed_results
+                and not self.is_streamed(f)
+            ])
+        yield len(all_files)
+        for filename in sorted(all_files):
+            if filename in self.identical_files:
+                # 内容が同一のファイルは差分計算を行わない
+                continue
+            if filename in self.precomputed_results:
+                diffs = self.precomputed_results[filename]
+                filetype = 'StructureDefinition' if filename.startswith('StructureDefinition-') else 'Other'
+            else:
+                diffs, filetype = self.compute_file_diff(filename)
+                self.store_cached_result(filename, diffs)
+            if any(d['type'] != 'unchanged' for d in diffs):
+                yield filename, diffs, filetype
+
+    def generate_html_report(self, output_file="public/structure_definition_elements_diff.html", output_mode='full',
+                             shard_by='file'):
+        """HTMLレポートを生成（チャンク単位でファイルへ書き出す）
+
+        output_mode='lazy' の場合は表の行をファイルごとのJSONに分け、
+        レポート本体にはサマリーとサイドバーだけを書き出す。
+        output_mode='sharded' の場合は変更ありファイルごと（shard_by='type'ならリソース種別ごと）の
+        ページと、サマリー・サイドバーだけのインデックスページに分けて書き出す。
+        """
+        if output_mode == 'sharded':
+            with self.stats.phase('diff'):
+                modified_files, total_files = self.collect_modified_files()
+            with self.stats.phase('impact_index'):
+                impacts = self.find_impacts(modified_files)
+            with self.stats.phase('render'):
+                self.write_sharded_report(output_file, modified_files, total_files, impacts, shard_by)
+            print(f"HTMLレポートが生成されました: {output_file}")
+            return output_file
+        self.write_streamed_report(output_file, lazy=(output_mode == 'lazy'))
+        self.stats.counters['html_bytes_written'] += os.path.getsize(output_file)
+        
+        print(f"HTMLレポートが生成されました: {output_file}")
+        return output_file
+
+    def write_streamed_report(self, output_file, lazy=False):
+        """差分を1ファイルずつ計算しながらHTMLレポートを書き出す
+
+        各ファイルのセクションは差分の計算直後に一時ファイルへ書き出し、差分と要素はその場で解放する。
+        サイドバーとサマリーは変更ありファイルが揃ってから先頭に書き、セクションは一時ファイルからつなぐ。
+        影響範囲の一覧は変更ありファイルへのリンクを含むため、セクション内の差し込み位置だけを記録しておく。
+        lazyがTrueの場合は表の行をファイルごとのJSON（フラグメント）に分けて書き出す。
+        """
+        fragment_path = None
+        fragment_dir = None
+        if lazy:
+            fragment_path = fragment_dir_for(output_file)
+            fragment_path.mkdir(parents=True, exist_ok=True)
+            # 前回実行時のフラグメントが残らないようにする
+            for stale in fragment_path.glob('*.json'):
+                stale.unlink()
+            fragment_dir = fragment_path.name
+        modified_files = []
+        impact_offsets = []
+        files = self.iter_modified_files()
+        with self.stats.phase('diff'):
+            total_files = next(files)
+        with tempfile.TemporaryFile(dir=Path(output_file).parent) as spool:
+            while True:
+                with self.stats.phase('diff'):
+                    entry = next(files, None)
+                if entry is None:
+                    break
+                filename, differences, filetype = entry
+                with self.stats.phase('render'):
+                    if fragment_path is not None:
+                        self.write_fragment(fragment_path, filename, differences, filetype)
+                    fragment_url = f"{fragment_dir}/{fragment_name_for(filename)}" if fragment_dir else None
+                    meta = self.file_metadata[filename] = self.get_file_metadata(filename)
+                    chunks = self.iter_file_section_html(len(modified_files), filename, differences, filetype,
+                                                         meta, fragment_url)
+                    # 最初のチャンクは影響範囲の一覧の直前で終わる
+                    spool.write(next(chunks).encode('utf-8'))
+                    impact_offsets.append((spool.tell(), filename))
+                    for chunk in chunks:
+                        spool.write(chunk.encode('utf-8'))
+                modified_files.append((filename, None, filetype))
+                self.release_file(filename)
+            with self.stats.phase('impact_index'):
+                impacts = self.find_impacts(modified_files)
+            with self.stats.phase('render'):
+                file_links = {filename: f"#file-{file_idx}" for file_idx, (filename, _, _) in enumerate(modified_files)}
+                spool.seek(0)
+                with open(output_file, 'wb') as f:
+                    f.write(self.get_report_head_html([name for name, _, _ in modified_files], total_files,
+                                                      fragment_dir).encode('utf-8'))
+                    position = 0
+                    for offset, filename in impact_offsets:
+                        if filename in impacts:
+                            copy_stream(spool, f, offset - position)
+                            position = offset
+                            f.write(self.get_impact_html(impacts[filename], file_links).encode('utf-8'))
+                    shutil.copyfileobj(spool, f, 1024 * 1024)
+                    f.write(self.get_report_tail_html(fragment_dir).encode('utf-8'))
+
+    def release_file(self, filename):
+        """書き出し済みのファイルの差分・要素・文書を解放する
+
+        影響範囲の索引で使う参照情報は、文書を解放する前に記録しておく。
+        """
+        self.precomputed_results.pop(filename, None)
+        self.v1_elements.pop(filename, None)
+        self.v2_elements.pop(filename, None)
+        for package in ('v1', 'v2'):
+            self.release_document(package, filename)
+
+    def release_document(self, package, filename):
+        """パース済みの文書を解放する（参照情報が未記録なら先に記録する）"""
+        key = self.document_key(package, filename)
+        data = self.documents.pop(key, None)
+        if data is not None and filename.startswith(REFERENCING_PREFIXES) and key not in self.references:
+            self.references[key] = resource_references(data)
+
+    def get_report_head_html(self, filenames, total_files, fragment_dir=None, page_links=None):
+        """レポートの先頭（サイドバー・ヘッダ・サマリー・凡例）のHTML"""
+        # サイドバー用ファイルリスト
+        sidebar_items = []
+        for file_idx, filename in enumerate(filenames):
+            href = page_links[filename] if page_links is not None else f"#file-{file_idx}"
+            sidebar_items.append(f'<div class="sidebar-item" title="{filename}"><a href="{href}">{filename}</a></div>')
+        # 追加情報（スクリプト全文）
+        script_html = self.get_script_source_html()
+        # バージョン名を引数から取得
+        v1_label = version_label(self.v1_path)
+        v2_label = version_label(self.v2_path)
+        return f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>jpclins StructureDefinition Elements差分レポート ({v1_label} → {v2_label})</title>
+    <style>
+{REPORT_CSS}
+    </style>
+</head>
+<body>
+<div id="sidebar">
+<h3>差分ファイル一覧</h3>
+<div id="sidebar-list">
+{''.join(sidebar_items)}
+</div>
+</div>
+<div id="main-content">
+<div class="container">
+<div class="header">
+<h1>jpclins StructureDefinition Elements差分レポート</h1>
+<p>バージョン {v1_label} → {v2_label} の比較結果</p>
+<p>生成日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')}</p>
+</div>
+<div class="summary">
+<h2>差分サマリー</h2>
+<p>比較対象ファイル数: {total_files}</p>
+<p>変更ありファイル数: {len(filenames)}</p>
+<p>内容同一のためパースを省略したファイル数: {len(self.identical_files)}</p>{self.get_differential_summary_html()}
+</div>
+<div style="margin-bottom:24px;">
+<button class="fold-btn" onclick="toggleDisplay('script-info')">追加情報（スクリプト全文など）表示/非表示</button>
+<div id="script-info" style="display:none;">{script_html}</div>
+</div>
+<div class="content">
+{REPORT_LEGEND_HTML if page_links is None else ''}"""
+
+    @staticmethod
+    def get_report_tail_html(fragment_dir=None):
+        """レポートの末尾（スクリプト）のHTML"""
+        js_script = REPORT_JS
+        if fragment_dir:
+            js_script += LAZY_REPORT_JS
+        return """
+        </div>
+    </div>
+""" + f"<script>{js_script}</script>" + """
+</body>
+</html>"""
+
+    def iter_html_report(self, modified_files, total_files, fragment_dir=None, impacts=None, page_links=None):
+        """HTMLレポートを先頭から順にチャンクとして生成する
+
+        fragment_dirを指定した場合、各ファイルの表はそのディレクトリのJSONから遅延描画する。
+        impactsを省略した場合は、変更された用語の影響範囲をここで索引から引く。
+        page_links（ファイル名 -> 分割出力のページへのリンク）を指定した場合は、表の代わりに
+        各ページへのリンクを並べたインデックスを生成する。
+        """
+        yield self.get_report_head_html([filename for filename, _, _ in modified_files], total_files,
+                                        fragment_dir, page_links)
+        
+        if page_links is not None:
+            # 分割出力のインデックス: 各ページへのリンクと件数だけを並べる
+            for filename, differences, _ in modified_files:
+                yield self.get_index_entry_html(filename, differences, self.get_file_metadata(filename),
+                                                page_links[filename])
+        
+        # 変更されたファイルごとにテーブルを生成
+        file_links = {filename: f"#file-{file_idx}" for file_idx, (filename, _, _) in enumerate(modified_files)}
+        if impacts is None and page_links is None:
+            impacts = self.find_impacts(modified_files)
+        for file_idx, (filename, differences, filetype) in enumerate(modified_files if page_links is None else ()):
+            fragment_url = f"{fragment_dir}/{fragment_name_for(filename)}" if fragment_dir else None
+            impact_html = self.get_impact_html(impacts[filename], file_links) if filename in impacts else ''
+            yield from self.iter_file_section_html(file_idx, filename, differences, filetype,
+                                                   self.get_file_metadata(filename), fragment_url, impact_html)
+        
+        yield self.get_report_tail_html(fragment_dir)
+
+    def get_badges_html(self, filename, differences):
+        """差分種別ごとの件数のバッジ（snapshotのみの変更であればその旨のバッジも付ける）"""
+        count_added = sum(1 for d in differences if d['type'] == 'added')
+        count_removed = sum(1 for d in differences if d['type'] == 'removed')
+        count_modified = sum(1 for d in differences if d['type'] == 'modified')
+        count_unchanged = sum(1 for d in differences if d['type'] == 'unchanged')
+        count_moved = sum(1 for d in differences if d['type'] == 'moved' or d.get('moved'))
+        noise_badge = ''
+        if filename in self.snapshot_only_changes:
+            external_base = self.snapshot_only_changes[filename]
+            if external_base is None:
+                noise_badge = ('\n    <span class="badge badge-noise" title="differentialとベースのプロファイルは変わっていません">'
+                               'snapshotのみ変更（生成ツール由来の可能性）</span>')
+            else:
+                noise_badge = (f'\n    <span class="badge badge-noise" title="{external_base}">'
+                               'snapshotのみ変更（パッケージ外のベースの変更による可能性）</span>')
+        return f"""<span class="badge badge-added">追加: {count_added}</span>
+    <span class="badge badge-removed">削除: {count_removed}</span>
+    <span class="badge badge-modified">変更: {count_modified}</span>
+    <span class="badge badge-unchanged">変更なし: {count_unchanged}</span>
+    <span class="badge badge-moved">移動: {count_moved}</span>{noise_badge}"""
+
+    def iter_file_section_html(self, file_idx, filename, differences, filetype, meta, fragment_url=None,
+                               impact_html=''):
+        """1ファイル分の差分セクションをチャンクとして生成する
+
+        fragment_urlを指定した場合は表の行を埋め込まず、展開時にそのJSONから描画する。
+        impact_htmlは変更された用語を参照する要素・リソースの一覧で、表の前に出力する
+        （最初のチャンクはその直前で終わるため、後から差し込む場合は位置をここで記録できる）。
+        """
+        file_id = f"file{file_idx}"
+        desc = meta.get("description") or filename
+        meta_html = self.get_file_metadata_html(meta)
+        # 遅延読み込み時は折りたたんだ状態で出力する
+        wrap_style = ' style="display:none"' if fragment_url else ''
+        yield f"""
+<a id="file-{file_idx}"></a>
+<div class="file-section">
+  <div class="file-header" id="file-header-{file_idx}" onclick="toggleFileSection({file_idx})">
+    <h2>{desc}</h2>
+    {self.get_badges_html(filename, differences)}
+    <button class="toggle-btn" onclick="event.stopPropagation();toggleRows('{file_id}', false)">差分のみ表示</button>
+    <button class="toggle-btn" onclick="event.stopPropagation();toggleRows('{file_id}', true)">全行表示</button>
+    <button class="fold-btn" onclick="event.stopPropagation();toggleDisplay('meta-{file_id}', '{file_id}')">メタ情報表示/非表示</button>
+  </div>
+  <div class="file-content-wrap" id="file-content-wrap-{file_idx}"{wrap_style}>
+    <div id="meta-{file_id}" style="display:none;margin-bottom:10px;">{meta_html}</div>"""
+        yield f"""{impact_html}
+"""
+        if fragment_url:
+            yield f"""
+    <div class="table-container" id="table-{file_id}" data-fragment="{fragment_url}"><p class="lazy-placeholder">展開すると差分を読み込みます（{len(differences)}行）</p></div>
+"""
+        elif filetype == 'StructureDefinition':
+            yield """
+    <div class="table-container">"""
+            yield self.table_open_html(filename, filetype)
+            for _, row_html in self.iter_table_rows(file_id, filename, differences, filetype):
+                yield row_html
+            yield self.table_close_html(filetype)
+            yield """
                 </div>
 """
-            else:
-                html_content += f"""
-    <div class="table-container">
+        else:
+            yield """
+    <div class="table-container">"""
+            yield self.table_open_html(filename, filetype)
+            for _, row_html in self.iter_table_rows(file_id, filename, differences, filetype):
+                yield row_html
+            yield self.table_close_html(filetype)
+            yield """
+    </div>
+"""
+        yield """
+  </div>
+</div>
+"""
+
+    def table_columns(self, filename):
+        """このファイルに出現する属性だけを列にする"""
+        return [attr for attr in sorted(self.file_attributes.get(filename, ())) if attr != 'path']
+
+    def table_open_html(self, filename, filetype):
+        """差分テーブルの開始部分（tbodyの開始タグまで）"""
+        if filetype == 'StructureDefinition':
+            columns = self.table_columns(filename)
+            header_cells = ''.join(f"""
+                                <th>{attr}</th>""" for attr in columns)
+            return f"""
+      <table class="elements-table" style="min-width:{60 * (len(columns) + 2)}px;">
+        <thead>
+          <tr>
+            <th>Path</th>
+            <th>Type</th>{header_cells}
+                            </tr>
+                        </thead>
+                        <tbody>"""
+        return """
       <table class="elements-table">
         <thead>
           <tr><th>属性</th><th>旧値</th><th>新値</th><th>diff</th></tr>
         </thead>
         <tbody>
 """
-                for diff in differences:
-                    row_class = f"row-{diff['type']} row-{file_id}"
-                    v1_val = diff['v1']
-                    v2_val = diff['v2']
+
+    def table_close_html(self, filetype):
+        """差分テーブルの終了部分"""
+        if filetype == 'StructureDefinition':
+            return """
+                        </tbody>
+                    </table>"""
+        return """
+        </tbody>
+      </table>"""
+
+    def iter_table_rows(self, file_id, filename, differences, filetype, hide_unchanged=True):
+        """差分テーブルの行を (差分種別, 行HTML) として1行ずつ生成する
+
+        hide_unchangedがTrueの場合、変更なしの行は非表示の状態で出力する。
+        """
+        if filetype == 'StructureDefinition':
+            columns = self.table_columns(filename)
+            for diff in differences:
+                # 変更された属性は比較時に判明しているため、ここで値を比較し直さない
+                changed = {a['attribute'] for a in diff.get('changed_attributes', ())}
+                row_class = f"row-{diff['type']} row-{file_id}"
+                display_style = 'style="display:none"' if diff['type'] == 'unchanged' and hide_unchanged else ''
+                type_label = f"{diff['type']} (moved)" if diff.get('moved') else diff['type']
+                cells = [f"""
+                            <tr class="{row_class}" {display_style}>
+                                <td class="path-cell">{diff['path']}</td>
+                                <td>{type_label}</td>"""]
+                v1_element = diff.get('v1_element', {})
+                v2_element = diff.get('v2_element', {})
+                for attr in columns:
+                    v1_value = v1_element.get(attr) if v1_element else None
+                    v2_value = v2_element.get(attr) if v2_element else None
                     if diff['type'] == 'added':
-                        cell_class = 'cell-added'
+                        cell_content = f"""
+                                    <td class="cell-added"><div class="diff-cell-content">{self.format_value(v2_value)}</div></td>"""
                     elif diff['type'] == 'removed':
-                        cell_class = 'cell-removed'
-                    elif diff['type'] == 'modified':
-                        cell_class = 'cell-modified'
-                    else:
-                        cell_class = ''
-                    html_content += f"""
+                        cell_content = f"""
+                                    <td class="cell-removed"><div class="diff-cell-content">{self.format_value(v1_value)}</div></td>"""
+                    elif diff['type'] == 'modified' and attr in changed:
+                        cell_content = f"""
+                                    <td class="cell-modified"><div class="diff-cell-content">{self.html_diff(v1_value, v2_value)}</div></td>"""
+                    else:  # unchanged / moved / 変更のない属性
+                        cell_content = f"""
+                                    <td><div class="diff-cell-content">{self.format_value(v1_value)}</div></td>"""
+                    cells.append(cell_content)
+                cells.append("""
+                            </tr>""")
+                self.serialized_values.clear()
+                yield diff['type'], ''.join(cells)
+            return
+        for diff in differences:
+            row_class = f"row-{diff['type']} row-{file_id}"
+            v1_val = diff['v1']
+            v2_val = diff['v2']
+            self.serialized_values.clear()
+            if diff['type'] == 'unchanged':
+                # 変更なしの行は値を1回だけ表示し、大きな値は行数のみ表示する
+                hidden = ' style="display:none"' if hide_unchanged else ''
+                yield diff['type'], f"""
+          <tr class="{row_class}"{hidden}>
+            <td class="path-cell">{diff['key']}</td>
+            <td><div class="diff-cell-content">{self.format_unchanged_value(v1_val)}</div></td>
+            <td><div class="diff-cell-content">{self.format_value(None)}</div></td>
+            <td><div class="diff-cell-content">{self.format_value(None)}</div></td>
+          </tr>
+"""
+                continue
+            yield diff['type'], f"""
           <tr class="{row_class}">
             <td class="path-cell">{diff['key']}</td>
             <td><div class="diff-cell-content">{self.format_value(v1_val)}</div></td>
@@ -705,37 +3026,253 @@ function toggleDisplay(id, fileId) {
             <td><div class="diff-cell-content">{self.html_diff(v1_val, v2_val)}</div></td>
           </tr>
 """
-                html_content += """
-        </tbody>
-      </table>
-    </div>
-"""
-            html_content += """
+        self.serialized_values.clear()
+
+    def build_file_fragment(self, filename, differences, filetype):
+        """遅延読み込み用に、1ファイル分の表をJSONで返せる形にまとめる
+
+        行は描画時にJSONから組み立て直すため、行のクラスにはレポート内の位置ではなくファイル名を使う。
+        """
+        rows = self.iter_table_rows(Path(filename).stem, filename, differences, filetype, hide_unchanged=False)
+        return {
+            'open': self.table_open_html(filename, filetype).strip(),
+            'close': self.table_close_html(filetype).strip(),
+            'rows': [[row_type, row_html.strip()] for row_type, row_html in rows],
+        }
+
+    def write_fragment(self, fragment_dir, filename, differences, filetype):
+        fragment = self.build_file_fragment(filename, differences, filetype)
+        fragment_file = fragment_dir / fragment_name_for(filename)
+        with open(fragment_file, 'wb') as f:
+            f.write(json_codec.dumps(fragment))
+        self.stats.counters['html_bytes_written'] += os.path.getsize(fragment_file)
+
+    def get_index_entry_html(self, filename, differences, meta, href):
+        """分割出力のインデックスに並べる、1ファイル分のページへのリンクと件数"""
+        desc = meta.get("description") or filename
+        return f"""
+<div class="file-section">
+  <div class="file-header">
+    <h2><a href="{href}">{desc}</a></h2>
+    {self.get_badges_html(filename, differences)}
   </div>
 </div>
 """
-        
-        html_content += """
+
+    @staticmethod
+    def page_name(filename, shard_by='file'):
+        """分割出力でファイルを載せるページの名前（ファイルごと、またはリソース種別ごと）"""
+        stem = Path(filename).stem
+        return stem.split('-', 1)[0] if shard_by == 'type' else stem
+
+    def page_key(self, name, index_href, sections):
+        """ページの内容を決める入力のハッシュ（両バージョンのファイル内容・影響範囲・表示設定）"""
+        parts = [tool_version(), version_label(self.v1_path), version_label(self.v2_path), self.diff_engine,
+                 self.diff_max_lines, self.json_diff_mode, name, index_href]
+        for _, filename, _, _, _, impact_html in sections:
+            parts.append([filename, self.diff_cache_key(filename), impact_html,
+                          filename in self.snapshot_only_changes, self.snapshot_only_changes.get(filename)])
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def write_sharded_report(self, output_file, modified_files, total_files, impacts, shard_by='file'):
+        """ページごとのHTMLを <レポート名>_pages/ 以下に、インデックスをoutput_fileに書き出す
+
+        ページの入力のハッシュを manifest.json に記録し、前回から変わっていないページは書き直さない。
+        書き出すページは並列実行時（jobs > 1）にはプロセスプールで生成する。
+        """
+        pages_dir = pages_dir_for(output_file)
+        pages_dir.mkdir(parents=True, exist_ok=True)
+        index_href = f"../{Path(output_file).name}"
+        pages = {}
+        for entry in modified_files:
+            pages.setdefault(self.page_name(entry[0], shard_by), []).append(entry)
+        page_links = {}
+        for name, entries in pages.items():
+            for local_idx, (filename, _, _) in enumerate(entries):
+                page_links[filename] = f"{name}.html#file-{local_idx}"
+        manifest_file = pages_dir / PAGES_MANIFEST
+        try:
+            previous = json.loads(manifest_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            previous = {}
+        manifest = {}
+        tasks = []
+        for name, entries in sorted(pages.items()):
+            sections = [
+                (local_idx, filename, differences, filetype, self.get_file_metadata(filename),
+                 self.get_impact_html(impacts[filename], page_links) if filename in impacts else '')
+                for local_idx, (filename, differences, filetype) in enumerate(entries)
+            ]
+            manifest[name] = self.page_key(name, index_href, sections)
+            page_file = pages_dir / f"{name}.html"
+            if previous.get(name) == manifest[name] and page_file.exists():
+                self.stats.counters['pages_skipped'] += 1
+                continue
+            tasks.append((str(page_file), name, index_href, sections))
+        # 変更がなくなったファイルのページを削除する
+        for stale in pages_dir.glob('*.html'):
+            if stale.stem not in manifest:
+                stale.unlink()
+        self.write_pages(tasks)
+        manifest_file.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding='utf-8')
+        print(f"ページを書き出しました: {len(tasks)}件（内容が変わらず省略: {len(pages) - len(tasks)}件） {pages_dir}")
+        index_links = {filename: f"{pages_dir.name}/{link}" for filename, link in page_links.items()}
+        with open(output_file, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+            for chunk in self.iter_html_report(modified_files, total_files, page_links=index_links):
+                f.write(chunk)
+        self.stats.counters['html_bytes_written'] += os.path.getsize(output_file)
+
+    def write_pages(self, tasks):
+        """分割出力のページを書き出す（jobs > 1 ならプロセスプールで並列に生成する）"""
+        if self.jobs <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                self.write_page(*task)
+            return
+        options = {'diff_engine': self.diff_engine, 'diff_max_lines': self.diff_max_lines}
+        worker = partial(render_page_worker, str(self.v1_path), str(self.v2_path), json_codec.name, options)
+        payloads = []
+        for task in tasks:
+            filenames = [section[1] for section in task[3]]
+            file_attributes = {name: self.file_attributes.get(name, set()) for name in filenames}
+            snapshot_only = {name: self.snapshot_only_changes[name]
+                             for name in filenames if name in self.snapshot_only_changes}
+            payloads.append((task, file_attributes, snapshot_only))
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            for counters in executor.map(worker, payloads):
+                self.stats.merge(counters)
+
+    def write_page(self, page_file, name, index_href, sections):
+        """分割出力の1ページを一時ファイルに書き出してから置き換える（中断しても壊れたページを残さない）"""
+        page_file = Path(page_file)
+        temp_file = page_file.with_name(page_file.name + '.tmp')
+        with open(temp_file, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+            for chunk in self.iter_page_html(name, index_href, sections):
+                f.write(chunk)
+        os.replace(temp_file, page_file)
+        self.stats.counters['pages_written'] += 1
+        self.stats.counters['html_bytes_written'] += os.path.getsize(page_file)
+
+    def iter_page_html(self, name, index_href, sections):
+        """分割出力の1ページ分のHTMLをチャンクとして生成する
+
+        前回と同じ内容なら書き直さずに済むよう、生成日時やサイドバーなど他のページに依存する内容は含めない。
+        """
+        v1_label = version_label(self.v1_path)
+        v2_label = version_label(self.v2_path)
+        yield f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{name} - jpclins StructureDefinition Elements差分レポート ({v1_label} → {v2_label})</title>
+    <style>
+{REPORT_CSS}
+    </style>
+</head>
+<body>
+<div id="main-content" style="margin-left:0;">
+<div class="container">
+<div class="header">
+<h1>{name}</h1>
+<p>バージョン {v1_label} → {v2_label} の比較結果</p>
+<p><a href="{index_href}" style="color: white;">差分ファイル一覧に戻る</a></p>
+</div>
+<div class="content">
+{REPORT_LEGEND_HTML}"""
+        for local_idx, filename, differences, filetype, meta, impact_html in sections:
+            yield from self.iter_file_section_html(local_idx, filename, differences, filetype, meta,
+                                                   impact_html=impact_html)
+        yield """
         </div>
     </div>
-""" + f"<script>{js_script}</script>" + """
+""" + f"<script>{REPORT_JS}</script>" + """
 </body>
 </html>"""
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        
-        print(f"HTMLレポートが生成されました: {output_file}")
-        return output_file
 
-    def load_json(self, file_path):
-        if not file_path.exists():
-            return {}
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return {}
+    def iter_diff_records(self, filename, differences, filetype):
+        """1ファイル分の差分を、変更のあった要素・属性ごとのレコードとして生成する
+
+        StructureDefinitionの変更要素は属性ごとに1レコード、追加・削除・移動は要素ごとに1レコード。
+        それ以外のリソースは変更箇所のパスごとに1レコード。
+        """
+        resource_type = filename.split('-', 1)[0]
+        for diff in differences:
+            if diff['type'] == 'unchanged':
+                continue
+            if filetype != 'StructureDefinition':
+                yield {
+                    'file': filename, 'resourceType': resource_type, 'path': diff['key'],
+                    'change': diff['type'], 'attribute': None, 'old': diff['v1'], 'new': diff['v2'], 'moved': False,
+                }
+                continue
+            v1_element = diff.get('v1_element') or {}
+            v2_element = diff.get('v2_element') or {}
+            if diff['type'] == 'modified':
+                for attr in sorted(a['attribute'] for a in diff['changed_attributes']):
+                    yield {
+                        'file': filename, 'resourceType': resource_type, 'path': diff['path'],
+                        'change': 'modified', 'attribute': attr,
+                        'old': v1_element.get(attr), 'new': v2_element.get(attr),
+                        'moved': bool(diff.get('moved')),
+                    }
+            elif diff['type'] == 'moved':
+                yield {
+                    'file': filename, 'resourceType': resource_type, 'path': diff['path'],
+                    'change': 'moved', 'attribute': None, 'old': None, 'new': None, 'moved': True,
+                }
+            else:
+                yield {
+                    'file': filename, 'resourceType': resource_type, 'path': diff['path'],
+                    'change': diff['type'], 'attribute': None,
+                    'old': diff.get('v1_element'), 'new': diff.get('v2_element'), 'moved': False,
+                }
+
+    def export_records(self, output_file, output_format='jsonl'):
+        """差分をHTMLを作らずに機械可読な形式で書き出し、レコード数を返す
+
+        jsonl: 1行1レコードで、ファイルごとに差分を計算しながら逐次書き出す。
+        columnar: 列ごとの配列にまとめた1つのJSON。file・resourceType・change・attributeは
+        辞書化して番号で持つ。
+        """
+        files = self.iter_modified_files()
+        next(files)
+        count = 0
+        if output_format == 'jsonl':
+            with open(output_file, 'wb', buffering=1024 * 1024) as f:
+                for filename, differences, filetype in files:
+                    for record in self.iter_diff_records(filename, differences, filetype):
+                        f.write(json_codec.dumps(record))
+                        f.write(b'\n')
+                        count += 1
+            self.stats.counters['records_written'] += count
+            print(f"差分レコードを書き出しました: {output_file}")
+            return count
+
+        dictionary_columns = ('file', 'resourceType', 'change', 'attribute')
+        value_columns = ('path', 'old', 'new', 'moved')
+        dictionaries = {column: {} for column in dictionary_columns}
+        data = {column: [] for column in dictionary_columns + value_columns}
+        for filename, differences, filetype in files:
+            for record in self.iter_diff_records(filename, differences, filetype):
+                for column in dictionary_columns:
+                    codes = dictionaries[column]
+                    data[column].append(codes.setdefault(record[column], len(codes)))
+                for column in value_columns:
+                    data[column].append(record.get(column))
+                count += 1
+        with open(output_file, 'wb', buffering=1024 * 1024) as f:
+            f.write(json_codec.dumps({
+                'rows': count,
+                'dictionaries': {column: list(codes) for column, codes in dictionaries.items()},
+                'columns': data,
+            }))
+        self.stats.counters['records_written'] += count
+        print(f"差分レコードを書き出しました: {output_file}")
+        return count
+
+    def load_json(self, package, filename):
+        data = self.get_document(package, filename)
+        return data if data is not None else {}
 
     def json_diff_flat(self, v1, v2):
         # ルート直下の全keyを比較
@@ -754,29 +3291,745 @@ function toggleDisplay(id, fileId) {
                 diffs.append({'key': k, 'type': 'modified', 'v1': v1_val, 'v2': v2_val})
         return diffs
 
+    def json_diff_structural(self, v1, v2):
+        """ルート直下のkeyごとに比較し、変更のあるkeyは変更箇所の末端パスまで掘り下げる"""
+        diffs = []
+        for k in sorted(set(v1.keys()) | set(v2.keys())):
+            v1_val = v1.get(k)
+            v2_val = v2.get(k)
+            if v1_val == v2_val:
+                diffs.append({'key': k, 'type': 'unchanged', 'v1': v1_val, 'v2': v2_val})
+            elif k not in v1:
+                diffs.append({'key': k, 'type': 'added', 'v1': None, 'v2': v2_val})
+            elif k not in v2:
+                diffs.append({'key': k, 'type': 'removed', 'v1': v1_val, 'v2': None})
+            else:
+                structural_json_diff(k, v1_val, v2_val, diffs)
+        return diffs
+
+    def is_streamed(self, filename):
+        """文書全体を読み込まずに比較するファイルか（構造比較で、どちらかのバージョンが閾値以上）"""
+        if not self.stream_threshold or self.json_diff_mode == 'flat':
+            return False
+        if filename.startswith('StructureDefinition-'):
+            return False
+        return any(
+            source.exists(filename) and source.size(filename) >= self.stream_threshold
+            for source in self.sources.values()
+        )
+
+    def scan_streamed_document(self, package, filename, reference=None):
+        """ストリーミングで1回読み、大きな配列をStreamedArrayに置き換えた文書を返す
+
+        referenceに旧バージョンの文書を渡すと、同じ位置の配列にない内容の要素を保持しておく。
+        """
+        source = self.sources[package]
+        if not source.exists(filename):
+            return {}
+        key = self.document_key(package, filename)
+        self.parse_count += 1
+        self.stats.counters['files_streamed'] += 1
+        self.stats.counters['bytes_read'] += source.size(filename)
+        root = {}
+        containers = [root]
+        try:
+            with source.open(filename) as stream:
+                for event, path, value in iter_json_events(stream):
+                    if event == 'value':
+                        if not path:
+                            # ルートがオブジェクトでない文書
+                            return {}
+                        containers[-1][path[-1]] = value
+                    elif event == 'item':
+                        containers[-1].add(value)
+                    elif event in ('start_map', 'start_array'):
+                        if path:
+                            if event == 'start_map':
+                                child = {}
+                            else:
+                                child = StreamedArray(package, filename, path,
+                                                      reference=self.find_streamed_array(reference, path))
+                            containers[-1][path[-1]] = child
+                            containers.append(child)
+                    elif path:
+                        containers.pop()
+        except Exception as e:
+            self.document_errors[key] = e
+            return {}
+        if package == self.metadata_package(filename):
+            self.file_metadata[filename] = {k: root[k] for k in FILE_METADATA_KEYS if k in root}
+        return root
+
+    @staticmethod
+    def find_streamed_array(document, path):
+        for key in path:
+            if not isinstance(document, dict):
+                return None
+            document = document.get(key)
+        return document if isinstance(document, StreamedArray) else None
+
+    def load_streamed_items(self, array, indices=None):
+        """要約した配列の要素のうちindicesの番号のものを読み直す（Noneなら全件をリストで返す）"""
+        if indices is not None:
+            kept = {i: array.kept_items[i] for i in indices if i in array.kept_items}
+            indices = set(indices) - set(kept)
+            if not indices:
+                return kept
+        source = self.sources[array.package]
+        self.stats.counters['bytes_read'] += source.size(array.filename)
+        items = {} if indices is not None else []
+        position = 0
+        with source.open(array.filename) as stream:
+            for event, path, value in iter_json_events(stream):
+                if path != array.path:
+                    continue
+                if event == 'item':
+                    if indices is None:
+                        items.append(value)
+                    elif position in indices:
+                        items[position] = value
+                    position += 1
+                elif event == 'end_array':
+                    break
+        if indices is not None:
+            items.update(kept)
+        return items
+
+    def materialize_streamed(self, value):
+        """要約した配列を読み直して元の値に戻す（配列ごと追加・削除された場合など）"""
+        if isinstance(value, StreamedArray):
+            return self.load_streamed_items(value)
+        if isinstance(value, dict):
+            return {k: self.materialize_streamed(v) for k, v in value.items()}
+        return value
+
+    def json_diff_streamed(self, filename):
+        """json_diff_structuralと同じ差分を、大きな配列の要素を1件ずつ読みながら計算する
+
+        1回目の読み込みでは配列の要素ごとのハッシュと自然キーだけを残し（新バージョンは旧バージョンにない
+        内容の要素も残す）、旧バージョンのハッシュの異なる要素だけを2回目の読み込みで取り出して比較する。
+        変更のない配列は件数だけを表示する。
+        """
+        v1 = self.scan_streamed_document('v1', filename)
+        v2 = self.scan_streamed_document('v2', filename, reference=v1)
+        diffs = []
+        for k in sorted(set(v1.keys()) | set(v2.keys())):
+            v1_val = v1.get(k)
+            v2_val = v2.get(k)
+            if v1_val == v2_val:
+                diffs.append({'key': k, 'type': 'unchanged',
+                              'v1': summarize_streamed(v1_val), 'v2': summarize_streamed(v2_val)})
+            elif k not in v1:
+                diffs.append({'key': k, 'type': 'added', 'v1': None, 'v2': self.materialize_streamed(v2_val)})
+            elif k not in v2:
+                diffs.append({'key': k, 'type': 'removed', 'v1': self.materialize_streamed(v1_val), 'v2': None})
+            else:
+                self.streamed_structural_diff(k, v1_val, v2_val, diffs)
+        return diffs
+
+    def streamed_structural_diff(self, path, v1, v2, diffs):
+        """要約した配列を含む値をstructural_json_diffと同じ規則で比較する"""
+        if v1 == v2:
+            return
+        if isinstance(v1, StreamedArray) and isinstance(v2, StreamedArray):
+            self.diff_streamed_array(path, v1, v2, diffs)
+        elif isinstance(v1, dict) and isinstance(v2, dict):
+            for k in sorted(v1.keys() | v2.keys()):
+                child = f"{path}.{k}"
+                if k not in v1:
+                    diffs.append({'key': child, 'type': 'added', 'v1': None,
+                                  'v2': self.materialize_streamed(v2[k])})
+                elif k not in v2:
+                    diffs.append({'key': child, 'type': 'removed', 'v1': self.materialize_streamed(v1[k]),
+                                  'v2': None})
+                else:
+                    self.streamed_structural_diff(child, v1[k], v2[k], diffs)
+        else:
+            structural_json_diff(path, self.materialize_streamed(v1), self.materialize_streamed(v2), diffs)
+
+    def diff_streamed_array(self, path, v1_array, v2_array, diffs):
+        """要約した2つの配列を比較し、ハッシュの異なる要素だけを読み直して差分を追加する"""
+        natural_keys = _streamed_natural_keys(v1_array, v2_array)
+        if natural_keys is None:
+            fields = None
+            v1_keys, v2_keys = range(len(v1_array)), range(len(v2_array))
+        else:
+            fields, v1_keys, v2_keys = natural_keys
+        v1_index = {key: i for i, key in enumerate(v1_keys)}
+        v2_index = {key: j for j, key in enumerate(v2_keys)}
+        v1_needed = set()
+        v2_needed = set()
+        for key, i in v1_index.items():
+            j = v2_index.get(key)
+            if j is None:
+                v1_needed.add(i)
+            elif v1_array.digests[i] != v2_array.digests[j]:
+                v1_needed.add(i)
+                v2_needed.add(j)
+        v2_needed.update(j for key, j in v2_index.items() if key not in v1_index)
+        v1_items = self.load_streamed_items(v1_array, v1_needed)
+        v2_items = self.load_streamed_items(v2_array, v2_needed)
+        if fields is None:
+            for i in range(max(len(v1_array), len(v2_array))):
+                child = f"{path}[{i}]"
+                if i >= len(v1_array):
+                    diffs.append({'key': child, 'type': 'added', 'v1': None, 'v2': v2_items[i]})
+                elif i >= len(v2_array):
+                    diffs.append({'key': child, 'type': 'removed', 'v1': v1_items[i], 'v2': None})
+                elif i in v1_items:
+                    structural_json_diff(child, v1_items[i], v2_items[i], diffs)
+            return
+        for i, key in enumerate(v1_keys):
+            if i not in v1_items:
+                continue
+            item = v1_items[i]
+            child = f"{path}[{_natural_key_label(item, fields)}]"
+            j = v2_index.get(key)
+            if j is None:
+                diffs.append({'key': child, 'type': 'removed', 'v1': item, 'v2': None})
+            else:
+                structural_json_diff(child, item, v2_items[j], diffs)
+        for j, key in enumerate(v2_keys):
+            if key not in v1_index:
+                item = v2_items[j]
+                child = f"{path}[{_natural_key_label(item, fields)}]"
+                diffs.append({'key': child, 'type': 'added', 'v1': None, 'v2': item})
+
+
+class VersionTimeline:
+    """古い順に並べた複数バージョンを隣接ペアごとに比較し、要素単位の変更履歴をまとめる
+
+    各バージョンのパース結果とダイジェストは隣接する2つの比較で共有するため、
+    どのパッケージも1回しか読み込まない。
+    """
+
+    def __init__(self, version_paths, diff_cache=None, jobs=1, reader=None, selector=None, attributes=None,
+                 stream_threshold=DEFAULT_STREAM_THRESHOLD_MB * 1024 * 1024):
+        self.version_paths = [Path(p) for p in version_paths]
+        self.labels = [version_label(p) for p in self.version_paths]
+        self.sources = [open_package_source(p, selector) for p in self.version_paths]
+        self.attributes = attributes
+        self.stream_threshold = stream_threshold
+        self.elements = [{} for _ in self.version_paths]
+        self.documents = {}
+        self.document_errors = {}
+        self.file_digests = {}
+        self.diff_cache = diff_cache
+        self.jobs = jobs
+        self.reader = reader
+        self.parse_count = 0
+        self.identical_count = 0
+        # ファイル名 -> (種別, {Path/属性 -> {比較インデックス: (差分種別, 変更属性リスト)}})
+        self.history = {}
+        self.file_descriptions = {}
+        self.stats = RunStats()
+
+    def close(self):
+        for source in self.sources:
+            source.close()
+        if self.diff_cache is not None:
+            self.diff_cache.close()
+
+    def pair_comparator(self, index):
+        """index番目とその次のバージョンを比較するComparatorを作る"""
+        comparator = StructureDefinitionElementComparator(
+            self.version_paths[index], self.version_paths[index + 1],
+            diff_cache=self.diff_cache, jobs=self.jobs,
+            sources={'v1': self.sources[index], 'v2': self.sources[index + 1]},
+            reader=self.reader, attributes=self.attributes, stream_threshold=self.stream_threshold,
+        )
+        # 同じバージョンのパース結果・ダイジェストを隣接する比較間で共有する
+        comparator.documents = self.documents
+        comparator.document_errors = self.document_errors
+        comparator.file_digests = self.file_digests
+        comparator.v1_elements = self.elements[index]
+        comparator.v2_elements = self.elements[index + 1]
+        comparator.release_new_elements = False
+        comparator.stats = self.stats
+        return comparator
+
+    def release_version(self, index):
+        """以降の比較で使わないバージョンのパース結果を解放する"""
+        source = self.sources[index]
+        for store in (self.documents, self.document_errors, self.file_digests):
+            for key in [key for key in store if key[0] is source]:
+                del store[key]
+        self.elements[index].clear()
+
+    def build(self):
+        for index in range(len(self.version_paths) - 1):
+            print(f"比較中: {self.labels[index]} → {self.labels[index + 1]}")
+            comparator = self.pair_comparator(index)
+            comparator.compare_files()
+            with self.stats.phase('diff'):
+                modified_files, _ = comparator.collect_modified_files()
+            for filename, differences, filetype in modified_files:
+                self.record(index, filename, differences, filetype)
+                meta = comparator.get_file_metadata(filename)
+                self.file_descriptions[filename] = meta.get('description') or filename
+            self.parse_count += comparator.parse_count
+            self.identical_count += len(comparator.identical_files)
+            self.release_version(index)
+
+    def record(self, index, filename, differences, filetype):
+        """1回の比較結果のうち変更のあった行を履歴に追加"""
+        _, rows = self.history.setdefault(filename, (filetype, {}))
+        for diff in differences:
+            if diff['type'] == 'unchanged':
+                continue
+            row_key = diff['path'] if filetype == 'StructureDefinition' else diff['key']
+            changed = sorted(a['attribute'] for a in diff.get('changed_attributes', []))
+            rows.setdefault(row_key, {})[index] = (diff['type'], changed)
+
+    def format_history_cell(self, entry):
+        if entry is None:
+            return '<td><span class="no-value">-</span></td>'
+        change_type, changed = entry
+        if change_type == 'added':
+            return '<td class="cell-added">追加</td>'
+        if change_type == 'removed':
+            return '<td class="cell-removed">削除</td>'
+        if change_type == 'moved':
+            return '<td class="cell-modified">移動</td>'
+        label = f"変更: {', '.join(changed)}" if changed else "変更"
+        return f'<td class="cell-modified">{label}</td>'
+
+    def generate_html_report(self, output_file="public/structure_definition_elements_timeline.html"):
+        """変更履歴のHTMLレポートを生成"""
+        with self.stats.phase('render'):
+            with open(output_file, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+                for chunk in self.iter_timeline_html():
+                    f.write(chunk)
+        self.stats.counters['html_bytes_written'] += os.path.getsize(output_file)
+        print(f"HTMLレポートが生成されました: {output_file}")
+        return output_file
+
+    def iter_timeline_html(self):
+        transitions = [f"{old} → {new}" for old, new in zip(self.labels, self.labels[1:])]
+        filenames = sorted(self.history)
+        sidebar_items = ''.join(
+            f'<div class="sidebar-item" title="{filename}"><a href="#file-{file_idx}">{filename}</a></div>'
+            for file_idx, filename in enumerate(filenames)
+        )
+        yield f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>jpclins StructureDefinition Elements変更履歴 ({self.labels[0]} → {self.labels[-1]})</title>
+    <style>
+{REPORT_CSS}
+    </style>
+</head>
+<body>
+<div id="sidebar">
+<h3>変更履歴のあるファイル一覧</h3>
+<div id="sidebar-list">
+{sidebar_items}
+</div>
+</div>
+<div id="main-content">
+<div class="container">
+<div class="header">
+<h1>jpclins StructureDefinition Elements変更履歴</h1>
+<p>バージョン {' → '.join(self.labels)} の比較結果</p>
+<p>生成日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')}</p>
+</div>
+<div class="summary">
+<h2>差分サマリー</h2>
+<p>比較バージョン数: {len(self.labels)}</p>
+<p>変更のあったファイル数: {len(filenames)}</p>
+<p>JSONパース回数: {self.parse_count}</p>
+</div>
+<div class="content">"""
+        header_cells = ''.join(f'<th>{t}</th>' for t in transitions)
+        for file_idx, filename in enumerate(filenames):
+            filetype, rows = self.history[filename]
+            first_column = 'Path' if filetype == 'StructureDefinition' else '属性'
+            yield f"""
+<a id="file-{file_idx}"></a>
+<div class="file-section">
+  <div class="file-header">
+    <h2>{self.file_descriptions.get(filename, filename)}</h2>
+    <span class="badge badge-modified">変更のあった行: {len(rows)}</span>
+  </div>
+  <div class="table-container">
+    <table class="elements-table">
+      <thead>
+        <tr><th>{first_column}</th>{header_cells}</tr>
+      </thead>
+      <tbody>
+"""
+            for row_key in sorted(rows):
+                cells = ''.join(self.format_history_cell(rows[row_key].get(i)) for i in range(len(transitions)))
+                yield f"""        <tr><td class="path-cell">{row_key}</td>{cells}</tr>
+"""
+            yield """      </tbody>
+    </table>
+  </div>
+</div>
+"""
+        yield """
+</div>
+</div>
+</div>
+</body>
+</html>"""
+
+
+class ReportWatcher:
+    """展開済みパッケージのファイル更新を監視し、変更のあったファイルだけを再比較する
+
+    パース結果と差分は比較器に保持したままにし、レポートは遅延読み込みモードで出力する。
+    更新時はレポート本体と、変更のあったファイルのフラグメントだけを書き直す。
+    用語の影響範囲は、変更された用語か、変更されたファイルの参照が変わった場合だけ引き直す。
+    """
+
+    def __init__(self, comparator, output_file, interval=1.0):
+        for package, path in (('v1', comparator.v1_path), ('v2', comparator.v2_path)):
+            if getattr(comparator.sources[package], 'package_dir', None) is None:
+                raise ValueError(f"監視できるのは展開済みのフォルダのみです: {path}")
+        self.comparator = comparator
+        self.output_file = output_file
+        self.fragment_dir = fragment_dir_for(output_file)
+        self.interval = interval
+        self.modified = {}
+        self.total_files = 0
+        self.impacts = {}
+        # 書き出し済みのフラグメントのファイル名
+        self.written_fragments = set()
+        self.mtimes = self.scan()
+
+    def scan(self):
+        """両バージョンの *.json の (更新時刻, サイズ) を取得"""
+        mtimes = {}
+        for package, source in self.comparator.sources.items():
+            if not source.package_dir.exists():
+                continue
+            with os.scandir(source.package_dir) as entries:
+                for entry in entries:
+                    if (entry.name.endswith('.json') and entry.is_file()
+                            and (not self.comparator.selector or self.comparator.selector(entry.name))):
+                        stat = entry.stat()
+                        mtimes[(package, entry.name)] = (stat.st_mtime_ns, stat.st_size)
+        return mtimes
+
+    def build(self):
+        """初回の比較を行いレポートを書き出す"""
+        files = self.comparator.iter_modified_files()
+        self.total_files = next(files)
+        self.modified = {filename: (diffs, filetype) for filename, diffs, filetype in files}
+        self.impacts = self.comparator.find_impacts(self.modified_files())
+        self.write_report(changed=None)
+
+    def poll(self):
+        """前回の走査以降に追加・更新・削除されたファイル名を返す"""
+        mtimes = self.scan()
+        changed = {
+            filename for (package, filename) in mtimes.keys() | self.mtimes.keys()
+            if mtimes.get((package, filename)) != self.mtimes.get((package, filename))
+        }
+        self.mtimes = mtimes
+        return changed
+
+    def modified_files(self):
+        return [(filename, *self.modified[filename]) for filename in sorted(self.modified)]
+
+    def file_references(self, filenames, load=True):
+        """参照元になりうるファイルの、両バージョンの参照情報を返す
+
+        loadがFalseなら読み込み済みの参照情報だけを使う（更新前の状態を、更新後のファイルを読まずに取るため）。
+        """
+        comparator = self.comparator
+        files = [f for f in filenames if f.startswith(REFERENCING_PREFIXES)]
+        references = {}
+        for package, source in comparator.sources.items():
+            if load:
+                comparator.load_references(package, [f for f in files if source.exists(f)])
+            for filename in files:
+                references[(package, filename)] = comparator.references.get(comparator.document_key(package, filename))
+        return references
+
+    def update(self, filenames):
+        """変更されたファイルだけを再比較し、レポートを更新する"""
+        has_targets = any(filename.startswith(TERMINOLOGY_PREFIXES) for filename in self.modified)
+        terminology_changed = any(filename.startswith(TERMINOLOGY_PREFIXES) for filename in filenames)
+        previous_references = (self.file_references(filenames, load=False)
+                               if has_targets and not terminology_changed else None)
+        for filename in filenames:
+            result = self.comparator.refresh_file(filename)
+            if result is not None and any(d['type'] != 'unchanged' for d in result[0]):
+                self.modified[filename] = result
+            else:
+                self.modified.pop(filename, None)
+        self.total_files = len({filename for _, filename in self.mtimes})
+        # 用語の変更がなく、変更されたファイルの参照も変わらなければ影響範囲は前回のまま使う
+        if terminology_changed or (previous_references is not None
+                                   and self.file_references(filenames) != previous_references):
+            self.impacts = self.comparator.find_impacts(self.modified_files())
+        self.write_report(changed=set(filenames))
+
+    def write_report(self, changed):
+        """レポート本体と、変更のあったフラグメントを書き出す（changed=Noneなら全て）"""
+        modified_files = self.modified_files()
+        self.fragment_dir.mkdir(parents=True, exist_ok=True)
+        if changed is None:
+            for stale in self.fragment_dir.glob('*.json'):
+                stale.unlink()
+            self.written_fragments = set()
+        written = 0
+        for filename, differences, filetype in modified_files:
+            if changed is None or filename in changed or filename not in self.written_fragments:
+                self.comparator.write_fragment(self.fragment_dir, filename, differences, filetype)
+                self.written_fragments.add(filename)
+                written += 1
+        for filename in self.written_fragments - self.modified.keys():
+            (self.fragment_dir / fragment_name_for(filename)).unlink(missing_ok=True)
+            self.written_fragments.discard(filename)
+        with open(self.output_file, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+            for chunk in self.comparator.iter_html_report(modified_files, self.total_files, self.fragment_dir.name,
+                                                          self.impacts):
+                f.write(chunk)
+        return written
+
+    def run(self):
+        """Ctrl+Cで止めるまで監視を続ける"""
+        print(f"ファイルの更新を監視しています（{self.interval}秒間隔、Ctrl+Cで終了）...")
+        try:
+            while True:
+                time.sleep(self.interval)
+                changed = self.poll()
+                if not changed:
+                    continue
+                start = time.perf_counter()
+                self.update(changed)
+                elapsed = time.perf_counter() - start
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] {len(changed)}ファイルを再比較しました"
+                      f"（{elapsed:.2f}秒）: {', '.join(sorted(changed))}")
+        except KeyboardInterrupt:
+            print("監視を終了します")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="jpclins StructureDefinition Elements差分比較ツール")
+    parser.add_argument('versions', nargs='*', metavar='version',
+                        help="バージョンフォルダまたは.tgz（通常は旧・新の2つ、--timeline時は古い順に複数）")
+    parser.add_argument('--timeline', action='store_true',
+                        help="指定した全バージョンを古い順に比較し、要素ごとの変更履歴レポートを生成する")
+    parser.add_argument('--no-cache', action='store_true', help="差分キャッシュを使わずに全ファイルを再計算する")
+    parser.add_argument('--cache-dir', default='.diff_cache', help="差分キャッシュの保存先（デフォルト: .diff_cache）")
+    parser.add_argument('--cache-max-mb', type=int, default=DiffCache.DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="差分キャッシュのサイズ上限(MB)。超過分は古いものから削除")
+    parser.add_argument('--diff-engine', choices=sorted(LINE_DIFF_ENGINES), default='patience',
+                        help="セル内差分に使う行差分エンジン（デフォルト: patience）")
+    parser.add_argument('--diff-max-lines', type=int, default=DEFAULT_DIFF_MAX_LINES,
+                        help="この行数（旧+新）を超える値は差分を要約表示する（0で無制限）")
+    parser.add_argument('--json-diff', choices=['structural', 'flat'], default='structural',
+                        help="StructureDefinition以外の比較方法（structural: 変更箇所のパスまで掘り下げる / flat: ルート直下のkey単位）")
+    parser.add_argument('--differential-first', action='store_true',
+                        help="differentialとベースのプロファイルが変わっていないStructureDefinitionは、snapshotが同じなら要素比較を省略する")
+    parser.add_argument('--include', action='append', default=[], metavar='GLOB',
+                        help="比較するファイル名のパターン（例: 'StructureDefinition-*'。複数指定可）")
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                        help="比較から除外するファイル名のパターン（複数指定可）")
+    parser.add_argument('--resource-type', action='append', default=[], metavar='TYPE',
+                        help="比較するリソース種別（ファイル名の先頭で判定。例: StructureDefinition, ValueSet。複数指定可）")
+    parser.add_argument('--attributes', type=lambda value: [name.strip() for name in value.split(',') if name.strip()],
+                        metavar='NAMES',
+                        help="StructureDefinitionで比較・表示する要素属性をカンマ区切りで指定する（例: min,max,type,binding）")
+    parser.add_argument('--stream-threshold-mb', type=float, default=DEFAULT_STREAM_THRESHOLD_MB,
+                        help="このサイズ(MB)以上のCodeSystem・ValueSetなどは文書全体を読み込まず、concept・compose.includeなどを"
+                             "1件ずつ読みながら比較する（0で無効）")
+    parser.add_argument('--json-codec', choices=['auto'] + sorted(JSON_CODECS), default='auto',
+                        help="JSONの読み書きに使うライブラリ（auto: orjsonがあれば使い、なければ標準ライブラリ）")
+    parser.add_argument('--io-threads', type=int, default=DEFAULT_IO_THREADS,
+                        help="ファイルを先読みするスレッド数（0で先読みしない。.tgzは常に1）")
+    parser.add_argument('--read-ahead', type=int, default=DEFAULT_READ_AHEAD,
+                        help="先読みするファイル数の上限")
+    parser.add_argument('--read-ahead-mb', type=int, default=DEFAULT_READ_AHEAD_MB,
+                        help="先読みして未処理のまま保持するデータ量の上限（MB）")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="パース・差分計算を並列実行するプロセス数（0でCPUコア数）")
+    parser.add_argument('--format', choices=['html', 'jsonl', 'columnar'], default='html',
+                        help="出力形式（jsonl: 変更1件を1行のJSONで / columnar: 列ごとの配列にまとめたJSON）")
+    parser.add_argument('--output', '-o', help="出力ファイル（デフォルト: public/structure_definition_elements_diff.<形式の拡張子>）")
+    parser.add_argument('--watch', action='store_true',
+                        help="初回の比較後もフォルダ内のファイル更新を監視し、変更されたファイルだけを再比較してレポートを更新する")
+    parser.add_argument('--watch-interval', type=float, default=1.0, help="--watch時の更新確認の間隔(秒)")
+    parser.add_argument('--output-mode', choices=['full', 'lazy', 'sharded'], default='full',
+                        help="full: 全行を1つのHTMLに埋め込む / lazy: 行データをファイルごとのJSONに分け、展開時に読み込む"
+                             " / sharded: 変更ありファイルごとのページとインデックスページに分ける")
+    parser.add_argument('--shard-by', choices=['file', 'type'], default='file',
+                        help="--output-mode sharded のページの単位（file: ファイルごと / type: リソース種別ごと）")
+    parser.add_argument('--stats-json', metavar='PATH',
+                        help="フェーズごとの処理時間と処理件数をJSONで書き出す（夜間実行の推移確認用）")
+    parser.add_argument('--profile', nargs='?', const='time', choices=['time', 'memory'],
+                        help="time: cProfileで処理時間の多い関数を表示 / memory: tracemallocでメモリ割り当ての多い箇所を表示（数倍遅くなる）")
+    parser.add_argument('--profile-output', metavar='PATH', help="--profile time の計測結果をpstats形式で保存する")
+    args = parser.parse_args(argv)
+    if args.timeline and len(args.versions) < 2:
+        parser.error("--timeline には2つ以上のバージョンを古い順に指定してください")
+    if args.timeline and (args.format != 'html' or args.output):
+        parser.error("--timeline ではHTMLレポートのみ出力できます（--format / --output は指定できません）")
+    if args.watch and (args.timeline or args.format != 'html'):
+        parser.error("--watch はHTMLレポート（--timeline なし）でのみ使えます")
+    if not args.timeline and len(args.versions) > 2:
+        parser.error("3つ以上のバージョンを比較する場合は --timeline を指定してください")
+    return args
+
+def run_timeline(args, diff_cache, jobs):
+    """複数バージョンの変更履歴モード"""
+    print("jpclins StructureDefinition Elements変更履歴の作成を開始します...")
+    timeline = VersionTimeline(args.versions, diff_cache=diff_cache, jobs=jobs, reader=make_reader(args),
+                               selector=make_selector(args), attributes=args.attributes,
+                               stream_threshold=stream_threshold_bytes(args))
+    timeline.build()
+    print("HTMLレポートを生成中...")
+    output_file = timeline.generate_html_report()
+    timeline.close()
+
+    print(f"JSONパース回数: {timeline.parse_count}")
+    print(f"内容同一のためパースを省略したファイル数（全比較の合計）: {timeline.identical_count}")
+    report_stats(args, timeline.stats, timeline.parse_count, diff_cache)
+    print(f"\n✅ 完了！")
+    print(f"レポートファイル: {output_file}")
+
+def run_watch(args, comparator):
+    """ファイル更新の監視モード（レポートは遅延読み込みモードで出力）"""
+    output_file = args.output or DEFAULT_OUTPUT_FILES['html']
+    try:
+        watcher = ReportWatcher(comparator, output_file, interval=args.watch_interval)
+    except ValueError as e:
+        print(f"エラー: {e}")
+        comparator.close()
+        return
+    print("HTMLレポートを生成中...")
+    watcher.build()
+    print(f"レポートファイル: {output_file}")
+    watcher.run()
+    comparator.close()
+
+def make_reader(args):
+    """コマンドライン引数から先読みの設定を作る"""
+    return PrefetchReader(threads=args.io_threads, read_ahead=args.read_ahead,
+                          max_bytes=args.read_ahead_mb * 1024 * 1024)
+
+def stream_threshold_bytes(args):
+    return int(args.stream_threshold_mb * 1024 * 1024)
+
+def make_selector(args):
+    """コマンドライン引数から対象ファイルの絞り込み条件を作る"""
+    return FileSelector(include=args.include, exclude=args.exclude, resource_types=args.resource_type)
+
+def report_stats(args, stats, parse_count, diff_cache):
+    """処理時間の内訳と処理件数を表示し、指定があればJSONで書き出す"""
+    stats.counters['files_parsed'] = parse_count
+    if diff_cache is not None:
+        stats.counters['cache_hits'] = diff_cache.hits
+        stats.counters['cache_misses'] = diff_cache.misses
+    print(f"JSONコーデック: {json_codec.name}")
+    for line in stats.format_lines():
+        print(line)
+    if args.stats_json:
+        with open(args.stats_json, 'w', encoding='utf-8') as f:
+            json.dump(stats.to_dict(), f, ensure_ascii=False, indent=2)
+        print(f"処理統計を書き出しました: {args.stats_json}")
+
+def run_with_profile(args, limit=25):
+    """cProfileまたはtracemallocで計測しながら実行し、負荷の大きい箇所を表示"""
+    if args.profile == 'memory':
+        tracemalloc.start()
+        try:
+            run(args)
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        print(f"\nメモリ割り当て（ピーク {peak / (1024 * 1024):.1f}MB、終了時点で確保されている上位{limit}件）:")
+        for stat in snapshot.statistics('lineno')[:limit]:
+            print(f"  {stat}")
+        return
+    profiler = cProfile.Profile()
+    profiler.runcall(run, args)
+    print(f"\nプロファイル結果（累積時間の上位{limit}件）:")
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(limit)
+    if args.profile_output:
+        profiler.dump_stats(args.profile_output)
+        print(f"プロファイルを保存しました: {args.profile_output}")
+
 def main():
     """メイン関数"""
-    if len(sys.argv) >= 3:
-        v1_path = sys.argv[1]
-        v2_path = sys.argv[2]
+    args = parse_args()
+    if args.profile:
+        run_with_profile(args)
+    else:
+        run(args)
+
+def run(args):
+    """コマンドライン引数に従って比較を実行する"""
+    use_json_codec(args.json_codec)
+    diff_cache = None
+    if not args.no_cache:
+        diff_cache = DiffCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    if args.timeline:
+        run_timeline(args, diff_cache, jobs)
+        return
+
+    if len(args.versions) == 2:
+        v1_path, v2_path = args.versions
     else:
         v1_path = "jp-eCSCLINS.r4-1.9.0-snap"
         v2_path = "jp-eCSCLINS.r4-1.10.0-snap"
-        print("使い方: python compare_structure_definition_elements.py <旧バージョンフォルダ> <新バージョンフォルダ>")
+        print("使い方: python compare_structure_definition_elements.py <旧バージョンフォルダ|.tgz> <新バージョンフォルダ|.tgz>")
         print(f"デフォルト: {v1_path} → {v2_path}")
     
     print("jpclins StructureDefinition Elements差分比較を開始します...")
     print(f"比較対象: {v1_path} → {v2_path}")
     
-    comparator = StructureDefinitionElementComparator(v1_path, v2_path)
+    comparator = StructureDefinitionElementComparator(
+        v1_path, v2_path, diff_cache=diff_cache, jobs=jobs,
+        diff_engine=args.diff_engine, diff_max_lines=args.diff_max_lines,
+        json_diff_mode=args.json_diff, reader=make_reader(args),
+        differential_first=args.differential_first,
+        selector=make_selector(args), attributes=args.attributes,
+        stream_threshold=stream_threshold_bytes(args),
+    )
     
     print("ファイル一覧を取得中...")
     comparator.compare_files()
     
-    print("HTMLレポートを生成中...")
-    output_file = comparator.generate_html_report()
+    if args.watch:
+        run_watch(args, comparator)
+        return
+
+    if args.format == 'html':
+        print("HTMLレポートを生成中...")
+        output_file = comparator.generate_html_report(
+            args.output or DEFAULT_OUTPUT_FILES['html'], output_mode=args.output_mode, shard_by=args.shard_by)
+    else:
+        print("差分レコードを書き出し中...")
+        output_file = args.output or DEFAULT_OUTPUT_FILES[args.format]
+        with comparator.stats.phase('export'):
+            record_count = comparator.export_records(output_file, args.format)
+    comparator.close()
     
+    print(f"JSONパース回数: {comparator.parse_count}")
+    print(f"内容同一のためパースを省略したファイル数: {len(comparator.identical_files)}")
+    if comparator.differential_first:
+        print(f"differentialが同じで要素比較を省略したプロファイル数: {len(comparator.differential_skipped)}")
+        if comparator.snapshot_only_changes:
+            print("differentialが同じなのにsnapshotが異なるプロファイル:")
+            for filename, external_base in sorted(comparator.snapshot_only_changes.items()):
+                reason = "生成ツール由来の可能性" if external_base is None else f"パッケージ外のベース {external_base}"
+                print(f"  {filename}（{reason}）")
+    if diff_cache is not None:
+        print(f"差分キャッシュ: ヒット {diff_cache.hits} / ミス {diff_cache.misses}")
+    report_stats(args, comparator.stats, comparator.parse_count, diff_cache)
     print(f"\n✅ 完了！")
+    if args.format != 'html':
+        print(f"出力ファイル: {output_file}（{record_count}レコード）")
+        return
     print(f"レポートファイル: {output_file}")
     print(f"ブラウザで {output_file} を開いて差分を確認してください。")
 
@@ -0,0 +1,259 @@
+import json
+
+import pytest
+
+from compare_structure_definition_elements import (
+    DiffCache,
+    JsonStreamCursor,
+    MemoryPackageSource,
+    StructureDefinitionElementComparator,
+    patience_diff_lines,
+    structural_json_diff,
+)
+
+
+def make_sources(v1_files, v2_files):
+    def encode(files):
+        return {name: json.dumps(data).encode('utf-8') for name, data in files.items()}
+    return {'v1': MemoryPackageSource(encode(v1_files)), 'v2': MemoryPackageSource(encode(v2_files))}
+
+
+def collect(v1_files, v2_files, **options):
+    comparator = StructureDefinitionElementComparator(
+        'pkg-1.0.0', 'pkg-1.1.0', sources=make_sources(v1_files, v2_files), **options)
+    try:
+        comparator.compare_files()
+        modified_files, _ = comparator.collect_modified_files()
+        return {filename: differences for filename, differences, _ in modified_files}
+    finally:
+        comparator.close()
+
+
+def test_diff_cache_is_separated_by_json_diff_mode(tmp_path):
+    v1_files = {'ValueSet-example.json': {
+        'resourceType': 'ValueSet', 'url': 'http://example.org/ValueSet/example', 'status': 'draft',
+        'compose': {'include': [{'system': 'http://example.org/cs', 'concept': [{'code': 'a'}]}]},
+    }}
+    v2_files = {'ValueSet-example.json': {
+        'resourceType': 'ValueSet', 'url': 'http://example.org/ValueSet/example', 'status': 'active',
+        'compose': {'include': [{'system': 'http://example.org/cs', 'concept': [{'code': 'b'}]}]},
+    }}
+    expected = {mode: collect(v1_files, v2_files, json_diff_mode=mode) for mode in ('structural', 'flat')}
+    assert expected['structural'] != expected['flat']
+
+    for mode in ('flat', 'structural', 'flat'):
+        cache = DiffCache(tmp_path / 'cache')
+        assert collect(v1_files, v2_files, json_diff_mode=mode, diff_cache=cache) == expected[mode]
+
+
+def profile(url, base, short):
+    return {
+        'resourceType': 'StructureDefinition', 'url': url, 'baseDefinition': base, 'fhirVersion': '4.0.1',
+        'differential': {'element': [{'id': 'Observation.code', 'path': 'Observation.code', 'min': 1}]},
+        'snapshot': {'element': [
+            {'id': 'Observation', 'path': 'Observation', 'short': short},
+            {'id': 'Observation.code', 'path': 'Observation.code', 'min': 1},
+        ]},
+    }
+
+
+def test_differential_first_resolves_identical_base_in_package():
+    base = profile('http://example.org/StructureDefinition/base',
+                   'http://hl7.org/fhir/StructureDefinition/Observation', 'Base')
+    v1_files = {
+        'StructureDefinition-base.json': base,
+        'StructureDefinition-child.json': profile('http://example.org/StructureDefinition/child',
+                                                  'http://example.org/StructureDefinition/base', 'Child'),
+    }
+    v2_files = {
+        'StructureDefinition-base.json': base,
+        'StructureDefinition-child.json': profile('http://example.org/StructureDefinition/child',
+                                                  'http://example.org/StructureDefinition/base', 'Child v2'),
+    }
+    comparator = StructureDefinitionElementComparator(
+        'pkg-1.0.0', 'pkg-1.1.0', sources=make_sources(v1_files, v2_files), differential_first=True)
+    try:
+        comparator.compare_files()
+        assert comparator.identical_files == {'StructureDefinition-base.json'}
+        assert comparator.snapshot_only_changes == {'StructureDefinition-child.json': None}
+    finally:
+        comparator.close()
+
+
+
+def test_differential_skipped_profiles_are_cached_with_references(tmp_path):
+    """要素比較を省略したプロファイルも差分キャッシュに保存し、文書を解放する前に参照情報を記録する"""
+    v1 = profile('http://example.org/StructureDefinition/child',
+                 'http://hl7.org/fhir/StructureDefinition/Observation', 'Child')
+    v1['snapshot']['element'][1]['binding'] = {'valueSet': 'http://example.org/ValueSet/codes'}
+    v2 = dict(v1, date='2026-01-01')
+    files = ({'StructureDefinition-child.json': v1}, {'StructureDefinition-child.json': v2})
+
+    for expected_parses in (2, 0):
+        comparator = StructureDefinitionElementComparator(
+            'pkg-1.0.0', 'pkg-1.1.0', sources=make_sources(*files), differential_first=True,
+            diff_cache=DiffCache(tmp_path / 'cache'))
+        try:
+            comparator.compare_files()
+            assert comparator.differential_skipped == {'StructureDefinition-child.json'}
+            assert comparator.parse_count == expected_parses
+            if expected_parses:
+                assert not comparator.documents
+                assert all(
+                    'http://example.org/ValueSet/codes' in str(comparator.references[
+                        comparator.document_key(package, 'StructureDefinition-child.json')])
+                    for package in ('v1', 'v2'))
+        finally:
+            comparator.close()
+
+def element_rows(v1_elements, v2_elements):
+    """snapshotだけの最小プロファイルを比較し、(path, type, moved, 変更属性) の並びを返す"""
+    def document(elements):
+        return {'resourceType': 'StructureDefinition', 'url': 'http://example.org/StructureDefinition/x',
+                'snapshot': {'element': elements}}
+    comparator = StructureDefinitionElementComparator(
+        'pkg-1.0.0', 'pkg-1.1.0',
+        sources=make_sources({'StructureDefinition-x.json': document(v1_elements)},
+                             {'StructureDefinition-x.json': document(v2_elements)}))
+    try:
+        comparator.compare_files()
+        differences, filetype = comparator.compute_file_diff('StructureDefinition-x.json')
+    finally:
+        comparator.close()
+    assert filetype == 'StructureDefinition'
+    return [(row['path'], row['type'], row.get('moved', False),
+             sorted(change['attribute'] for change in row.get('changed_attributes', ())))
+            for row in differences]
+
+
+def element(element_id, **attributes):
+    return {'id': element_id, 'path': element_id, **attributes}
+
+
+def test_element_merge_walk_reports_added_and_removed_in_place():
+    rows = element_rows(
+        [element('Observation'), element('Observation.a'), element('Observation.gone')],
+        [element('Observation'), element('Observation.new'), element('Observation.a')],
+    )
+    assert rows == [
+        ('Observation', 'unchanged', False, []),
+        ('Observation.new', 'added', False, []),
+        ('Observation.a', 'unchanged', False, []),
+        ('Observation.gone', 'removed', False, []),
+    ]
+
+
+def test_element_merge_walk_detects_moved_elements():
+    rows = element_rows(
+        [element('Observation'), element('Observation.a', min=0), element('Observation.b'), element('Observation.c')],
+        [element('Observation'), element('Observation.c'), element('Observation.a', min=1), element('Observation.b')],
+    )
+    assert rows == [
+        ('Observation', 'unchanged', False, []),
+        ('Observation.c', 'moved', False, []),
+        ('Observation.a', 'modified', False, ['min']),
+        ('Observation.b', 'unchanged', False, []),
+    ]
+
+    # 移動と属性変更が重なった要素は modified のまま moved 印を付ける
+    rows = element_rows(
+        [element('Observation'), element('Observation.a'), element('Observation.b')],
+        [element('Observation'), element('Observation.b', max='1'), element('Observation.a')],
+    )
+    assert rows[1] == ('Observation.b', 'modified', True, ['max'])
+    assert rows[2] == ('Observation.a', 'unchanged', False, [])
+
+
+def test_element_keys_number_duplicate_paths():
+    rows = element_rows(
+        [{'path': 'Observation'}, {'path': 'Observation.x', 'short': '1'}, {'path': 'Observation.x', 'short': '2'}],
+        [{'path': 'Observation'}, {'path': 'Observation.x', 'short': '1'}, {'path': 'Observation.x', 'short': 'two'},
+         {'path': 'Observation.x', 'short': '3'}],
+    )
+    assert rows == [
+        ('Observation', 'unchanged', False, []),
+        ('Observation.x', 'unchanged', False, []),
+        ('Observation.x#2', 'modified', False, ['short']),
+        ('Observation.x#3', 'added', False, []),
+    ]
+
+
+def test_patience_diff_lines():
+    assert patience_diff_lines(['a', 'b', 'c', 'd'], ['a', 'c', 'b', 'd', 'e']) == [
+        (' ', 'a'), ('-', 'b'), (' ', 'c'), ('+', 'b'), (' ', 'd'), ('+', 'e'),
+    ]
+    assert patience_diff_lines([], ['x']) == [('+', 'x')]
+    assert patience_diff_lines(['x'], []) == [('-', 'x')]
+
+
+def test_html_diff_summarizes_values_over_diff_max_lines():
+    comparator = StructureDefinitionElementComparator(
+        'pkg-1.0.0', 'pkg-1.1.0', sources=make_sources({}, {}), diff_max_lines=6)
+    try:
+        assert comparator.html_diff('a\nb', 'a\nc') == (
+            '<div>a</div><div class="diff-removed">- b</div><div class="diff-added">+ c</div>')
+        old = '\n'.join(['same', 'old 1', 'old 2'])
+        new = '\n'.join(['same', 'new 1', 'new 2', 'new 3', 'new 4'])
+        assert comparator.html_diff(old, new) == (
+            '<div class="diff-summary">差分が大きいため要約表示: +4 / −2 行</div>')
+    finally:
+        comparator.close()
+
+
+def test_structural_json_diff_matches_array_items_by_natural_key():
+    v1 = {'concept': [{'code': 'a', 'display': 'A'}, {'code': 'b', 'display': 'B'}]}
+    v2 = {'concept': [{'code': 'b', 'display': 'B'}, {'code': 'a', 'display': 'Alpha'}, {'code': 'c'}]}
+    diffs = []
+    structural_json_diff('root', v1, v2, diffs)
+    assert diffs == [
+        {'key': 'root.concept[code=a].display', 'type': 'modified', 'v1': 'A', 'v2': 'Alpha'},
+        {'key': 'root.concept[code=c]', 'type': 'added', 'v1': None, 'v2': {'code': 'c'}},
+    ]
+
+    # 自然キーのない要素は位置で対応付ける
+    diffs = []
+    structural_json_diff('root', {'item': [{'x': 1}, {'x': 2}]}, {'item': [{'x': 2}, {'x': 1}]}, diffs)
+    assert [row['key'] for row in diffs] == ['root.item[0].x', 'root.item[1].x']
+
+
+CODE_SYSTEMS = (
+    {'resourceType': 'CodeSystem', 'url': 'http://example.org/CodeSystem/large', 'version': '1.0.0',
+     'concept': [{'code': f'c{i}', 'display': f'Concept {i}', 'designation': [{'value': f'概念 {i}'}]}
+                 for i in range(40)]},
+    {'resourceType': 'CodeSystem', 'url': 'http://example.org/CodeSystem/large', 'version': '1.1.0',
+     'concept': ([{'code': f'c{i}', 'display': f'Concept {i}', 'designation': [{'value': f'概念 {i}'}]}
+                  for i in range(40) if i not in (3, 17)]
+                 + [{'code': 'c5b', 'display': 'Concept 5b'}]),
+     'count': 39},
+)
+
+
+@pytest.mark.parametrize('chunk_size', [JsonStreamCursor.CHUNK_SIZE, 7])
+def test_streamed_diff_matches_document_diff(monkeypatch, chunk_size):
+    """ストリーミング比較の差分が、文書全体を読み込んだ構造比較と同じになること（トークンを分断するチャンクでも）"""
+    v1, v2 = CODE_SYSTEMS
+    v2 = json.loads(json.dumps(v2))
+    next(concept for concept in v2['concept'] if concept['code'] == 'c10')['display'] = 'Concept ten'
+    files = ({'CodeSystem-large.json': v1}, {'CodeSystem-large.json': v2})
+
+    def changed_rows(**options):
+        comparator = StructureDefinitionElementComparator(
+            'pkg-1.0.0', 'pkg-1.1.0', sources=make_sources(*files), **options)
+        try:
+            comparator.compare_files()
+            assert comparator.is_streamed('CodeSystem-large.json') == bool(options['stream_threshold'])
+            differences, filetype = comparator.compute_file_diff('CodeSystem-large.json')
+            expected = comparator.json_diff_structural(v1, v2)
+        finally:
+            comparator.close()
+        assert filetype == 'Other'
+        return ([row for row in differences if row['type'] != 'unchanged'],
+                [row for row in expected if row['type'] != 'unchanged'])
+
+    monkeypatch.setattr(JsonStreamCursor, 'CHUNK_SIZE', chunk_size)
+    streamed, expected = changed_rows(stream_threshold=1)
+    document, _ = changed_rows(stream_threshold=0)
+    assert document == expected
+    assert streamed == expected
+    assert {row['key'] for row in expected} >= {
+        'concept[code=c3]', 'concept[code=c17]', 'concept[code=c10].display', 'concept[code=c5b]', 'count', 'version'}